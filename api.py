@@ -3,17 +3,27 @@ BRain API - RESTful endpoints for Currents intelligence layer
 Provides ranked belief currents, market data, and personalization
 """
 from flask import Blueprint, jsonify, request
+import base64
+import json
 import sqlite3
 import os
+from collections import defaultdict
 from datetime import datetime
 from brain_algorithm import calculate_belief_intensity
+from db_pool import db_pool
+from http_cache import http_cache, catalog_validator
+from market_search import market_search
+from probability_series import probability_series, parse_since, CHART_POINTS, MAX_POINTS
 
 api = Blueprint('api', __name__, url_prefix='/api/v1')
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'brain.db')
 
+# History points returned with a market unless ?points= says otherwise
+API_HISTORY_POINTS = 500
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_pool.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -27,7 +37,44 @@ def health():
         'timestamp': datetime.utcnow().isoformat()
     })
 
+# /markets sort keys -> column (indexed per key by migrations/006)
+SORT_COLUMNS = {
+    'belief_intensity': 'm.belief_intensity',
+    'volume': 'COALESCE(m.volume_24h, 0)',
+    'probability': 'm.probability'
+}
+
+# Same formula as calculate_belief_intensity, for DBs without migrations/006
+BELIEF_INTENSITY_SQL = "((COALESCE(m.volume_24h, 0) / 10000.0) * 0.6 + (1 - ABS(0.5 - m.probability) * 2) * 0.4)"
+
+_has_belief_column = None
+
+def _belief_intensity_column(cursor):
+    """Persisted column if migrations/006 is applied, else the inline formula"""
+    global _has_belief_column
+    if _has_belief_column is None:
+        cursor.execute("PRAGMA table_info(markets)")
+        _has_belief_column = any(row[1] == 'belief_intensity' for row in cursor.fetchall())
+    return 'm.belief_intensity' if _has_belief_column else BELIEF_INTENSITY_SQL
+
+def encode_after(sort_value, market_id):
+    """Opaque keyset cursor: last row's sort value + market_id"""
+    raw = json.dumps([sort_value, market_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_after(after):
+    """(sort_value, market_id) from encode_after(); raises ValueError"""
+    try:
+        padded = after + '=' * (-len(after) % 4)
+        sort_value, market_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid after cursor: {e}')
+    if not isinstance(market_id, str) or not isinstance(sort_value, (int, float)):
+        raise ValueError('Invalid after cursor')
+    return sort_value, market_id
+
 @api.route('/markets', methods=['GET'])
+@http_cache.cached(catalog_validator, max_age=10)
 def list_markets():
     """
     GET /api/v1/markets
@@ -36,6 +83,7 @@ def list_markets():
       - market_type: Filter by type (binary, multiple)
       - limit: Number of results (default 20, max 100)
       - offset: Pagination offset
+      - after: Keyset cursor (next_after from the previous page; ignores offset)
       - sort: Sort order (belief_intensity, volume, probability)
     """
     # Parse and validate query parameters
@@ -45,81 +93,112 @@ def list_markets():
         limit = min(int(request.args.get('limit', 20)), 100)
         offset = int(request.args.get('offset', 0))
         sort_by = request.args.get('sort', 'belief_intensity')
+        after = request.args.get('after')
         
         # Validate pagination
         if limit < 1 or offset < 0:
             return jsonify({'error': 'Invalid pagination parameters'}), 400
         
         # Validate sort_by
-        allowed_sorts = {'belief_intensity', 'volume', 'probability'}
-        if sort_by not in allowed_sorts:
-            return jsonify({'error': f'Invalid sort field. Allowed: {", ".join(allowed_sorts)}'}), 400
+        if sort_by not in SORT_COLUMNS:
+            return jsonify({'error': f'Invalid sort field. Allowed: {", ".join(SORT_COLUMNS)}'}), 400
+
+        after_key = decode_after(after) if after else None
             
     except ValueError as e:
         return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
     
     conn = get_db()
     cursor = conn.cursor()
+
+    belief_column = _belief_intensity_column(cursor)
+    sort_column = belief_column if sort_by == 'belief_intensity' else SORT_COLUMNS[sort_by]
+    belief_select = '' if belief_column == 'm.belief_intensity' else f", {belief_column} AS belief_intensity"
     
-    # Build query
-    query = """
-        SELECT m.*, 
-               GROUP_CONCAT(DISTINCT mt.tag) as tags
-        FROM markets m
-        LEFT JOIN market_tags mt ON m.market_id = mt.market_id
-        WHERE m.status = 'open'
-    """
+    # Filters
+    where = ["m.status = 'open'"]
     params = []
     
     if category:
-        query += " AND m.category = ?"
+        where.append("m.category = ?")
         params.append(category)
     
     if market_type:
-        query += " AND m.market_type = ?"
+        where.append("m.market_type = ?")
         params.append(market_type)
+
+    # Total only for offset paging (keyset clients page until next_after is null)
+    total = None
+    if after_key is None:
+        cursor.execute(f"SELECT COUNT(*) FROM markets m WHERE {' AND '.join(where)}", params)
+        total = cursor.fetchone()[0]
+
+    # Keyset: rows after (value, market_id) in ORDER BY value DESC, market_id
+    # (the <= bound lets SQLite seek straight to the page in the index)
+    page_where = list(where)
+    page_params = list(params)
+    if after_key is not None:
+        sort_value, after_id = after_key
+        page_where.append(f"{sort_column} <= ? AND ({sort_column} < ? OR m.market_id > ?)")
+        page_params.extend([sort_value, sort_value, after_id])
+        offset = 0
+
+    # One page of markets, ranked and sliced in SQL
+    cursor.execute(f"""
+        SELECT m.*{belief_select}, {sort_column} AS sort_value
+        FROM markets m
+        WHERE {' AND '.join(page_where)}
+        ORDER BY {sort_column} DESC, m.market_id
+        LIMIT ? OFFSET ?
+    """, page_params + [limit, offset])
     
-    query += " GROUP BY m.market_id"
-    
-    cursor.execute(query, params)
+    markets = [dict(row) for row in cursor.fetchall()]
+    page_ids = [m['market_id'] for m in markets]
     
-    # Fetch and rank markets
-    markets = []
-    for row in cursor.fetchall():
-        market = dict(row)
-        market['tags'] = market['tags'].split(',') if market['tags'] else []
-        market['belief_intensity'] = calculate_belief_intensity(market)
-        
-        # Fetch options for multi-option markets
-        if market.get('market_type') == 'multiple':
-            cursor.execute("""
-                SELECT option_id, option_text, probability
+    # Tags and options for this page only (one query each)
+    tags = defaultdict(list)
+    options = defaultdict(list)
+    if page_ids:
+        placeholders = ','.join('?' * len(page_ids))
+        cursor.execute(f"""
+            SELECT market_id, tag FROM market_tags WHERE market_id IN ({placeholders})
+        """, page_ids)
+        for row in cursor.fetchall():
+            if row['tag'] not in tags[row['market_id']]:
+                tags[row['market_id']].append(row['tag'])
+
+        multi_ids = [m['market_id'] for m in markets if m.get('market_type') == 'multiple']
+        if multi_ids:
+            cursor.execute(f"""
+                SELECT market_id, option_id, option_text, probability
                 FROM market_options
-                WHERE market_id = ?
-                ORDER BY probability DESC
-            """, (market['market_id'],))
-            market['options'] = [dict(opt) for opt in cursor.fetchall()]
-        
-        markets.append(market)
-    
-    # Sort
-    if sort_by == 'belief_intensity':
-        markets.sort(key=lambda x: x['belief_intensity'], reverse=True)
-    elif sort_by == 'volume':
-        markets.sort(key=lambda x: x['volume_24h'], reverse=True)
-    elif sort_by == 'probability':
-        markets.sort(key=lambda x: x['probability'], reverse=True)
-    
-    # Paginate
-    paginated = markets[offset:offset + limit]
+                WHERE market_id IN ({','.join('?' * len(multi_ids))})
+                ORDER BY market_id, probability DESC
+            """, multi_ids)
+            for row in cursor.fetchall():
+                options[row['market_id']].append({
+                    'option_id': row['option_id'],
+                    'option_text': row['option_text'],
+                    'probability': row['probability']
+                })
     
     conn.close()
+
+    next_after = None
+    for market in markets:
+        sort_value = market.pop('sort_value')
+        market['tags'] = tags.get(market['market_id'], [])
+        if market.get('market_type') == 'multiple':
+            market['options'] = options.get(market['market_id'], [])
+    if len(markets) == limit:
+        next_after = encode_after(sort_value, markets[-1]['market_id'])
     
     return jsonify({
-        'markets': paginated,
-        'total': len(markets),
+        'markets': markets,
+        'total': total,
         'limit': limit,
-        'offset': offset
+        'offset': offset,
+        'next_after': next_after
     })
 
 @api.route('/markets/<market_id>', methods=['GET'])
@@ -127,7 +206,15 @@ def get_market(market_id):
     """
     GET /api/v1/markets/{market_id}
     Returns detailed market information including history
+    Query params:
+      - points: Max history points (default 500, max 5000; downsampled)
+      - since: History start (ISO timestamp or relative: 24h, 7d, 4w)
     """
+    try:
+        points, since = _history_params(default_points=API_HISTORY_POINTS)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+
     conn = get_db()
     cursor = conn.cursor()
     
@@ -149,14 +236,10 @@ def get_market(market_id):
     market['tags'] = market['tags'].split(',') if market['tags'] else []
     market['belief_intensity'] = calculate_belief_intensity(market)
     
-    # Get probability history
-    cursor.execute("""
-        SELECT probability, volume, timestamp
-        FROM probability_history
-        WHERE market_id = ?
-        ORDER BY timestamp ASC
-    """, (market_id,))
-    market['probability_history'] = [dict(row) for row in cursor.fetchall()]
+    # Get probability history (downsampled to the requested size)
+    series = probability_series.get_series(market_id, points=points, since=since, conn=conn)
+    market['probability_history'] = series['points']
+    market['history_resolution'] = series['resolution']
     
     # Get options for multi-option markets
     if market.get('market_type') == 'multiple':
@@ -172,6 +255,42 @@ def get_market(market_id):
     
     return jsonify({'market': market})
 
+@api.route('/markets/<market_id>/history', methods=['GET'])
+def get_market_history(market_id):
+    """
+    GET /api/v1/markets/{market_id}/history
+    Probability series for charts, read from the coarsest tier that fits
+    Query params:
+      - points: Max points (default 200, max 5000)
+      - since: Start (ISO timestamp or relative: 24h, 7d, 4w)
+    """
+    try:
+        points, since = _history_params(default_points=CHART_POINTS)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+
+    conn = get_db()
+    try:
+        if conn.execute("SELECT 1 FROM markets WHERE market_id = ?", (market_id,)).fetchone() is None:
+            return jsonify({'error': 'Market not found'}), 404
+        series = probability_series.get_series(market_id, points=points, since=since, conn=conn)
+    finally:
+        conn.close()
+
+    return jsonify({
+        'market_id': market_id,
+        'resolution': series['resolution'],
+        'since': since,
+        'history': series['points']
+    })
+
+def _history_params(default_points):
+    """(points, since) from the query string; raises ValueError"""
+    points = int(request.args.get('points', default_points))
+    if points < 1 or points > MAX_POINTS:
+        raise ValueError(f'points must be between 1 and {MAX_POINTS}')
+    return points, parse_since(request.args.get('since'))
+
 @api.route('/feed', methods=['GET'])
 def get_feed():
     """
@@ -265,17 +384,63 @@ def get_trending():
     
     return jsonify({'trending': trending})
 
-# Future endpoints (stubs for now)
 @api.route('/search', methods=['GET'])
 def search():
     """
     GET /api/v1/search?q=query
-    Search markets by title/description
+    Full-text search over title, description, editorial description, tags
+    and taxonomy (BM25 blended with belief intensity)
+    Query params:
+      - q: Search text (last word matches as a prefix)
+      - category: Filter by category
+      - limit: Number of results (default 20, max 50)
+      - offset: Pagination offset
     """
     query = request.args.get('q', '')
-    # TODO: Implement full-text search
-    return jsonify({'results': [], 'query': query})
+    try:
+        category = request.args.get('category')
+        limit = min(int(request.args.get('limit', 20)), 50)
+        offset = int(request.args.get('offset', 0))
+
+        if limit < 1 or offset < 0:
+            return jsonify({'error': 'Invalid pagination parameters'}), 400
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+
+    result = market_search.search(query, category=category, limit=limit, offset=offset)
+
+    return jsonify({
+        'results': result['results'],
+        'query': query,
+        'pagination': {
+            'limit': limit,
+            'offset': offset,
+            'has_more': result['has_more']
+        }
+    })
 
+@api.route('/search/suggest', methods=['GET'])
+def search_suggest():
+    """
+    GET /api/v1/search/suggest?q=prefix
+    Typeahead: market titles matching what the user has typed so far
+    Query params:
+      - q: Partial search text
+      - category: Filter by category
+      - limit: Number of suggestions (default 8, max 20)
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = min(int(request.args.get('limit', 8)), 20)
+        if limit < 1:
+            return jsonify({'error': 'Invalid limit'}), 400
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+
+    suggestions = market_search.suggest(query, limit=limit, category=request.args.get('category'))
+    return jsonify({'suggestions': suggestions, 'query': query})
+
+# Future endpoints (stubs for now)
 @api.route('/user/<user_id>/feed', methods=['GET'])
 def personalized_feed(user_id):
     """
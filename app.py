@@ -7,6 +7,8 @@ from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 import sqlite3
 import os
+import sys
+import signal
 import logging
 import time
 import requests
@@ -14,11 +16,24 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 
 # Import config and Rain client
-from config import USE_RAIN_API, RAIN_API_URL, BRAIN_V1_ENABLED
+from config import USE_RAIN_API, RAIN_API_URL, RAIN_SYNC_ENABLED, BRAIN_V1_ENABLED
+from db_pool import db_pool
 from rain_client import RainClient
 from brain_algorithm import calculate_belief_intensity
 from tracking_engine import tracker
 from personalization import personalizer
+from market_catalog import market_catalog
+from event_queue import event_queue
+from impression_tracker import impression_tracker
+from feed_cache import CursorExpired, feed_cache, feed_snapshots
+from geoip import geoip
+from homepage_layout import homepage_layout
+from market_search import market_search
+from related_markets import related_markets
+from probability_series import probability_series, CHART_POINTS
+from markets_feed import markets_feed
+from http_cache import http_cache, catalog_validator, trending_validator
+from rain_sync import rain_sync
 
 # Setup logging
 logging.basicConfig(
@@ -30,9 +45,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Geo-IP lookup cache (to avoid repeated API calls)
-GEO_CACHE = {}
-
 # Rate limiting for waitlist submissions
 # Format: {ip_address: [timestamp1, timestamp2, ...]}
 WAITLIST_RATE_LIMIT = defaultdict(list)
@@ -41,31 +53,25 @@ RATE_LIMIT_MAX = 3  # Max 3 submissions per hour per IP
 
 def get_country_from_ip(ip_address):
     """
-    Get country code from IP address using ip-api.com (free, supports IPv6)
-    Falls back to 'UNKNOWN' if lookup fails
+    Get country code from IP address using the local geo-IP database (supports IPv6)
+    Never makes network calls: see geoip.py / import_geoip.py (bounded LRU in front)
+    Falls back to 'UNKNOWN' if the address isn't covered or geoip.dat is missing
     """
     # Skip private IPs
     if ip_address in ['127.0.0.1', 'localhost'] or ip_address.startswith('192.168.') or ip_address.startswith('10.'):
         return 'LOCAL'
     
-    # Check cache
-    if ip_address in GEO_CACHE:
-        return GEO_CACHE[ip_address]
-    
-    try:
-        # Use ip-api.com free API (no key needed, supports IPv6, 45 req/min limit)
-        response = requests.get(f'http://ip-api.com/json/{ip_address}?fields=countryCode', timeout=2)
-        if response.status_code == 200:
-            data = response.json()
-            country_code = data.get('countryCode')
-            if country_code and len(country_code) == 2:
-                GEO_CACHE[ip_address] = country_code
-                logger.info(f"Geo lookup: {ip_address} -> {country_code}")
-                return country_code
-    except Exception as e:
-        logger.warning(f"Geo lookup failed for {ip_address}: {e}")
-    
-    return 'UNKNOWN'
+    return geoip.lookup(ip_address) or 'UNKNOWN'
+
+if not geoip.loaded:
+    logger.error("Geo-IP database missing: countries resolve to UNKNOWN until "
+                 "import_geoip.py builds it")
+
+# Tracking events are written behind the request; geo is resolved on the writer thread
+event_queue.start(geo_resolver=get_country_from_ip)
+
+# Feed impressions likewise (bulk + deduped, one transaction per flush)
+impression_tracker.start()
 
 app = Flask(__name__)
 
@@ -94,10 +100,14 @@ CORS(app, resources={
             "http://127.0.0.1:*"      # For local development
         ],
         "methods": ["GET", "POST"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "If-None-Match"],
+        "expose_headers": ["ETag"]
     }
 })
 
+# ETags / 304s, Cache-Control and gzip/br for app + blueprint responses
+http_cache.init_app(app)
+
 # Register API blueprint
 from api import api as api_blueprint
 app.register_blueprint(api_blueprint)
@@ -108,6 +118,10 @@ DB_PATH = os.path.join(os.path.dirname(__file__), 'brain.db')
 # Initialize Rain client (used when USE_RAIN_API = True)
 rain_client = RainClient(RAIN_API_URL) if USE_RAIN_API else None
 
+# Rain mode reads Rain per request only with the mirror sync turned off;
+# otherwise brain.db is kept in sync (rain_sync.py) and read like local mode
+RAIN_DIRECT = USE_RAIN_API and not RAIN_SYNC_ENABLED
+
 # Robots.txt route (block crawlers during development)
 @app.route('/robots.txt')
 def robots():
@@ -328,13 +342,13 @@ class BRain:
     
     def _get_conn(self):
         """Get database connection (local mode only)"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_pool.connect(DB_PATH)
         conn.row_factory = sqlite3.Row
         return conn
     
     def get_homepage_feed(self):
         """Get ranked markets for homepage"""
-        if USE_RAIN_API and rain_client:
+        if RAIN_DIRECT and rain_client:
             # Use Rain API
             try:
                 rain_markets = rain_client.list_markets()
@@ -372,101 +386,16 @@ class BRain:
                 logger.error(f"Error getting Rain API feed: {e}", exc_info=True)
                 return {'hero': [], 'grid': [], 'stream': []}
         else:
-            # Use local database
-            conn = None
+            # Use local database (layout precomputed per catalog snapshot)
             try:
-                conn = self._get_conn()
-                cursor = conn.cursor()
-                
-                # Main query - fetch all markets
-                cursor.execute("""
-                    SELECT m.market_id, m.title, m.description, m.editorial_description, m.category, 
-                           m.language, m.probability, m.volume_24h, m.volume_total, m.participant_count,
-                           m.image_url, m.status, m.created_at, m.resolution_date, m.resolved, 
-                           m.outcome, m.market_type,
-                           GROUP_CONCAT(DISTINCT mt.tag) as tags
-                    FROM markets m
-                    LEFT JOIN market_tags mt ON m.market_id = mt.market_id
-                    WHERE m.status = 'open'
-                    GROUP BY m.market_id
-                """)
-                
-                markets = [dict(row) for row in cursor.fetchall()]
-                
-                # Batch fetch options for multi-option markets (FIX N+1!)
-                multi_ids = [m['market_id'] for m in markets if m.get('market_type') == 'multiple']
-                options_by_market = defaultdict(list)
-                
-                if multi_ids:
-                    placeholders = ','.join('?' * len(multi_ids))
-                    cursor.execute(f"""
-                        SELECT market_id, option_id, option_text, probability
-                        FROM market_options
-                        WHERE market_id IN ({placeholders})
-                        ORDER BY market_id, probability DESC
-                    """, multi_ids)
-                    
-                    for row in cursor.fetchall():
-                        options_by_market[row['market_id']].append(dict(row))
-                
-                # Process markets
-                for market in markets:
-                    market['tags'] = market['tags'].split(',') if market['tags'] else []
-                    market['belief_intensity'] = calculate_belief_intensity(market)
-                    
-                    # Add options if multi-option market
-                    if market['market_id'] in options_by_market:
-                        market['top_options'] = options_by_market[market['market_id']][:5]
-                
-                # Sort by belief intensity
-                markets.sort(key=lambda x: x['belief_intensity'], reverse=True)
-                
-                # ALWAYS prioritize visually interesting categories for hero (Roy's feedback)
-                visual_categories = ['Sports', 'Entertainment', 'Technology', 'Crypto']
-                visual_markets = [m for m in markets if m['category'] in visual_categories]
-                
-                logger.info(f"🎨 Hero selection: Found {len(visual_markets)} visual markets")
-                logger.info(f"🎨 Current top market: {markets[0]['title'][:40]} ({markets[0]['category']})")
-                
-                if visual_markets:
-                    # Use highest-belief-intensity visual market as hero
-                    hero_market = visual_markets[0]
-                    logger.info(f"🎨 Promoting to hero: {hero_market['title'][:40]} ({hero_market['category']})")
-                    markets.remove(hero_market)
-                    markets.insert(0, hero_market)
-                
-                # ALWAYS ensure at least one multi-option market in hero or grid (for testing)
-                top_9 = markets[:9] if len(markets) >= 9 else markets
-                has_multi = any(m.get('market_type') == 'multiple' for m in top_9)
-                
-                if not has_multi and len(markets) > 9:
-                    # Find first multi-option market outside top 9
-                    multi_market = next((m for m in markets[9:] if m.get('market_type') == 'multiple'), None)
-                    if multi_market:
-                        # Remove it from its position and insert at position 8 (last grid slot)
-                        markets.remove(multi_market)
-                        markets.insert(8, multi_market)
-                
-                return {
-                    'hero': markets[0:1] if markets else [],
-                    'grid': markets[1:13] if len(markets) > 1 else [],
-                    'stream': markets[13:40] if len(markets) > 13 else []
-                }
-            
+                return homepage_layout.get().as_dict()
             except Exception as e:
                 logger.error(f"Error getting homepage feed: {e}", exc_info=True)
                 return {'hero': [], 'grid': [], 'stream': []}
-            
-            finally:
-                if conn:
-                    try:
-                        conn.close()
-                    except:
-                        pass
     
     def get_market_detail(self, market_id):
         """Get market details with history"""
-        if USE_RAIN_API and rain_client:
+        if RAIN_DIRECT and rain_client:
             # Use Rain API
             rain_market = rain_client.get_market(market_id)
             if not rain_market:
@@ -510,15 +439,10 @@ class BRain:
             market = dict(row)
             market['tags'] = market['tags'].split(',') if market['tags'] else []
             
-            # Get probability history
-            cursor.execute("""
-                SELECT probability, volume, timestamp
-                FROM probability_history
-                WHERE market_id = ?
-                ORDER BY timestamp ASC
-            """, (market_id,))
-            
-            market['probability_history'] = [dict(row) for row in cursor.fetchall()]
+            # Get probability history, sized for the detail chart
+            market['probability_history'] = probability_series.get_series(
+                market_id, points=CHART_POINTS, conn=conn
+            )['points']
             
             # Calculate outcomes
             market['outcomes'] = [
@@ -530,58 +454,26 @@ class BRain:
             return market
     
     def get_related_markets(self, market_id, limit=3):
-        """Find related markets by tags"""
-        if USE_RAIN_API and rain_client:
-            # Use Rain API - simple implementation: just get other markets
-            # In production, Rain API would have a related markets endpoint
-            all_markets = rain_client.list_markets()
-            if not all_markets:
-                return []
-            
-            # Filter out current market and convert to BRain format
-            related = [
-                rain_client.convert_to_brain_format(m) 
-                for m in all_markets 
-                if m.get('market_id') != market_id
-            ][:limit]
-            
-            return related
-        else:
-            # Use local database
-            conn = self._get_conn()
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT tag FROM market_tags WHERE market_id = ?", (market_id,))
-            target_tags = set(row['tag'] for row in cursor.fetchall())
-            
-            if not target_tags:
-                conn.close()
-                return []
-            
-            cursor.execute("""
-                SELECT m.*, 
-                       COUNT(DISTINCT mt.tag) as tag_overlap,
-                       GROUP_CONCAT(DISTINCT mt.tag) as tags
-                FROM markets m
-                JOIN market_tags mt ON m.market_id = mt.market_id
-                WHERE mt.tag IN ({})
-                  AND m.market_id != ?
-                  AND m.status = 'open'
-                GROUP BY m.market_id
-                ORDER BY tag_overlap DESC
-                LIMIT ?
-            """.format(','.join('?' * len(target_tags))), (*target_tags, market_id, limit))
-            
-            related = [dict(row) for row in cursor.fetchall()]
-            for m in related:
-                m['tags'] = m['tags'].split(',') if m['tags'] else []
-            
-            conn.close()
-            return related
+        """Find related markets by tag similarity (precomputed index, both modes)"""
+        return related_markets.get_related(market_id, limit)
 
 # Initialize BRain
 brain = BRain()
 
+# Mirror Rain into brain.db (one process holds the sync lease)
+if USE_RAIN_API and RAIN_SYNC_ENABLED and rain_client:
+    rain_sync.use_rain(rain_client)
+    rain_sync.start()
+
+# Homepage layout is rebuilt in the background when market data changes
+if not RAIN_DIRECT:
+    homepage_layout.start()
+
+# Related-markets index follows the catalog (or the Rain market list)
+if RAIN_DIRECT and rain_client:
+    related_markets.use_rain(rain_client)
+related_markets.start()
+
 # Routes
 @app.route('/')
 def index():
@@ -686,7 +578,7 @@ def index():
                 # If Joni market not in list, fetch it from database
                 if not joni_market:
                     try:
-                        conn = sqlite3.connect('brain.db')
+                        conn = db_pool.connect('brain.db')
                         conn.row_factory = sqlite3.Row
                         cursor = conn.cursor()
                         cursor.execute("""
@@ -740,7 +632,7 @@ def index():
                 # If Yaniv market not in list, fetch it from database
                 if not yaniv_market:
                     try:
-                        conn = sqlite3.connect('brain.db')
+                        conn = db_pool.connect('brain.db')
                         conn.row_factory = sqlite3.Row
                         cursor = conn.cursor()
                         cursor.execute("""
@@ -793,7 +685,7 @@ def index():
                 
                 # Fetch markets from database if not in current list
                 nigeria_all_ids = ['nigeria-afcon-2027'] + nigeria_sports_ids + nigeria_nonsports_ids
-                conn = sqlite3.connect('brain.db')
+                conn = db_pool.connect('brain.db')
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -839,7 +731,7 @@ def index():
             
             # Log impressions server-side
             shown_ids = [item['market_id'] for item in result['items']]
-            impression_tracker.log_impressions(user_key, shown_ids)
+            impression_tracker.log_impressions_async(user_key, shown_ids)
             
             logger.info(f"BRain v1 feed: user={user_key}, geo={user_country}, items={len(all_markets)}, quotas={result['meta']['quotas_used']}")
             
@@ -888,7 +780,7 @@ def index():
         # If Joni market not in list, fetch it from database
         if not joni_market:
             try:
-                conn = sqlite3.connect('brain.db')
+                conn = db_pool.connect('brain.db')
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 cursor.execute("""
@@ -942,7 +834,7 @@ def index():
         # If Yaniv market not in list, fetch it from database
         if not yaniv_market:
             try:
-                conn = sqlite3.connect('brain.db')
+                conn = db_pool.connect('brain.db')
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 cursor.execute("""
@@ -995,7 +887,7 @@ def index():
         
         # Fetch markets from database if not in current list
         nigeria_all_ids = ['nigeria-afcon-2027'] + nigeria_sports_ids + nigeria_nonsports_ids
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -1140,7 +1032,7 @@ def feed_mobile():
                 # If Joni market not in list, fetch it from database
                 if not joni_market:
                     try:
-                        conn = sqlite3.connect('brain.db')
+                        conn = db_pool.connect('brain.db')
                         conn.row_factory = sqlite3.Row
                         cursor = conn.cursor()
                         cursor.execute("""
@@ -1194,7 +1086,7 @@ def feed_mobile():
                 # If Yaniv market not in list, fetch it from database
                 if not yaniv_market:
                     try:
-                        conn = sqlite3.connect('brain.db')
+                        conn = db_pool.connect('brain.db')
                         conn.row_factory = sqlite3.Row
                         cursor = conn.cursor()
                         cursor.execute("""
@@ -1247,7 +1139,7 @@ def feed_mobile():
                 
                 # Fetch markets from database if not in current list
                 nigeria_all_ids = ['nigeria-afcon-2027'] + nigeria_sports_ids + nigeria_nonsports_ids
-                conn = sqlite3.connect('brain.db')
+                conn = db_pool.connect('brain.db')
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
                 
@@ -1292,7 +1184,7 @@ def feed_mobile():
             
             # Log impressions server-side
             shown_ids = [item['market_id'] for item in result['items']]
-            impression_tracker.log_impressions(user_key, shown_ids)
+            impression_tracker.log_impressions_async(user_key, shown_ids)
             
             logger.info(f"BRain v1 mobile feed: user={user_key}, geo={user_country}, items={len(all_markets)}")
             
@@ -1396,64 +1288,25 @@ def all_markets():
                              category_filter=category_filter)
 
 
-@app.route('/api/markets/feed', methods=['POST'])
+@app.route('/api/markets/feed', methods=['GET', 'POST'])
+@http_cache.cached(catalog_validator, max_age=10)
 def api_markets_feed():
-    """API: Get paginated markets feed with category filtering"""
+    """API: Get paginated markets feed with category filtering (GET is cacheable)"""
     try:
-        data = request.json or {}
+        if request.method == 'GET':
+            data = request.args
+            offset = data.get('offset', 0, type=int)
+            limit = data.get('limit', 60, type=int)
+        else:
+            data = request.json or {}
+            offset = data.get('offset', 0)
+            limit = data.get('limit', 60)
         user_key = data.get('user_key')
         category = data.get('category')  # None = all markets
-        offset = data.get('offset', 0)
-        limit = data.get('limit', 60)
         
-        # Get ALL markets from database
-        conn = brain._get_conn()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Filter by category if specified
-        if category and category != 'all':
-            cursor.execute("""
-                SELECT * FROM markets 
-                WHERE status = 'open' AND category = ?
-                ORDER BY created_at DESC
-            """, (category,))
-            all_markets = [dict(row) for row in cursor.fetchall()]
-        else:
-            # For "all" category, implement round-robin distribution for diversity
-            cursor.execute("""
-                SELECT * FROM markets 
-                WHERE status = 'open'
-                ORDER BY created_at DESC
-            """)
-            all_markets_raw = [dict(row) for row in cursor.fetchall()]
-            
-            # Group by category
-            from collections import defaultdict
-            markets_by_category = defaultdict(list)
-            for market in all_markets_raw:
-                markets_by_category[market['category']].append(market)
-            
-            # Round-robin distribution for perfect diversity
-            all_markets = []
-            categories = list(markets_by_category.keys())
-            max_per_category = max(len(markets) for markets in markets_by_category.values())
-            
-            for i in range(max_per_category):
-                for cat in categories:
-                    if i < len(markets_by_category[cat]):
-                        all_markets.append(markets_by_category[cat][i])
-        
-        conn.close()
-        
-        # FILTER OUT YANIV MARKET: Hidden from All Markets page (API endpoint)
-        # Only accessible via main feed with ?yaniv=1 parameter
-        yaniv_market_id = 'yaniv-rain-march-2026'
-        all_markets = [m for m in all_markets if m.get('market_id') != yaniv_market_id]
-        
-        # Paginate
-        total = len(all_markets)
-        paginated = all_markets[offset:offset + limit]
+        # Materialized round-robin / per-category sequences (markets_feed.py);
+        # Yaniv market is excluded there (only reachable via ?yaniv=1)
+        paginated, total = markets_feed.get_page(category, offset, limit)
         has_more = offset + limit < total
         
         logger.info(f"Markets feed: category={category}, offset={offset}, limit={limit}, total={total}, returned={len(paginated)}")
@@ -1509,9 +1362,22 @@ def market_detail(market_id):
         return "Error loading market", 500
 
 @app.route('/api/homepage')
+@http_cache.cached(max_age=10)
 def api_homepage():
-    """API: Get homepage feed"""
-    return jsonify(brain.get_homepage_feed())
+    """API: Get homepage feed (local mode: precomputed body + ETag, 304 if unchanged)"""
+    if RAIN_DIRECT and rain_client:
+        return jsonify(brain.get_homepage_feed())
+    
+    try:
+        layout = homepage_layout.get()
+    except Exception as e:
+        logger.error(f"Error getting homepage feed: {e}", exc_info=True)
+        return jsonify({'hero': [], 'grid': [], 'stream': []})
+    
+    # If-None-Match is answered by http_cache (aware of the -gzip/-br variants)
+    response = app.response_class(layout.body, mimetype='application/json')
+    response.set_etag(layout.etag)
+    return response
 
 @app.route('/api/markets/<market_id>')
 def api_market(market_id):
@@ -1582,7 +1448,8 @@ def track_interaction():
     Track user interaction event
     """
     try:
-        data = request.get_json()
+        # navigator.sendBeacon posts JSON as text/plain
+        data = request.get_json(force=True, silent=True) or {}
         
         # Get or create user_key (use IP as fallback for now)
         user_key = data.get('user_key') or request.headers.get('X-User-Key') or request.remote_addr
@@ -1596,30 +1463,34 @@ def track_interaction():
         if not market_id or not event_type:
             return jsonify({"error": "market_id and event_type required"}), 400
         
-        # Get geo location from IP
         client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
         if client_ip:
             # X-Forwarded-For can be comma-separated list, get first IP
             client_ip = client_ip.split(',')[0].strip()
-        geo_country = get_country_from_ip(client_ip)
-        
-        # Record interaction
-        interaction_id = tracker.record_interaction(
-            user_key=user_key,
-            market_id=market_id,
-            event_type=event_type,
-            dwell_ms=dwell_ms,
-            section=section,
-            position=position,
-            geo_country=geo_country
-        )
+        
+        # Queue for the background writer (geo lookup happens there)
+        accepted = event_queue.submit({
+            'user_key': user_key,
+            'market_id': market_id,
+            'event_type': event_type,
+            'dwell_ms': dwell_ms,
+            'section': section,
+            'position': position,
+            'client_ip': client_ip
+        })
+        
+        if not accepted:
+            logger.warning(f"Tracking queue full, dropped {event_type} on {market_id}")
+            response = jsonify({"error": "Tracking queue full, retry later"})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         
         logger.info(f"Tracked: {event_type} on {market_id} by {user_key}")
         
         return jsonify({
             "success": True,
-            "interaction_id": interaction_id
-        })
+            "queued": True
+        }), 202
     
     except Exception as e:
         logger.error(f"Track error: {e}")
@@ -1635,31 +1506,41 @@ def track_batch():
         user_key = data.get('user_key') or request.remote_addr
         events = data.get('events', [])
         
-        # Get geo location once for batch
         client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
         if client_ip:
             client_ip = client_ip.split(',')[0].strip()
-        geo_country = get_country_from_ip(client_ip)
         
-        interaction_ids = []
-        for event in events:
-            interaction_id = tracker.record_interaction(
-                user_key=user_key,
-                market_id=event.get('market_id'),
-                event_type=event.get('event_type'),
-                dwell_ms=event.get('dwell_ms'),
-                section=event.get('section'),
-                position=event.get('position'),
-                geo_country=geo_country
-            )
-            interaction_ids.append(interaction_id)
+        # Queue for the background writer (geo lookup happens there, once per flush)
+        valid = [
+            {
+                'user_key': user_key,
+                'market_id': event.get('market_id'),
+                'event_type': event.get('event_type'),
+                'dwell_ms': event.get('dwell_ms'),
+                'section': event.get('section'),
+                'position': event.get('position'),
+                'client_ip': client_ip
+            }
+            for event in events
+            if event.get('market_id') and event.get('event_type')
+        ]
+        accepted = event_queue.submit_many(valid)
+        dropped = len(valid) - accepted
         
-        logger.info(f"Tracked batch: {len(events)} events by {user_key}")
+        if valid and not accepted:
+            logger.warning(f"Tracking queue full, dropped batch of {len(valid)} events")
+            response = jsonify({"error": "Tracking queue full, retry later"})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        
+        logger.info(f"Tracked batch: {accepted} events by {user_key}")
         
         return jsonify({
             "success": True,
-            "interaction_ids": interaction_ids
-        })
+            "queued": accepted,
+            "dropped": dropped,
+            "invalid": len(events) - len(valid)
+        }), 202
     
     except Exception as e:
         logger.error(f"Batch track error: {e}")
@@ -1690,6 +1571,81 @@ def admin_evolution(user_key, topic_type, topic_value):
     history = tracker.get_score_evolution(user_key, topic_type, topic_value)
     return jsonify(history)
 
+@app.route('/api/admin/event-queue')
+def admin_event_queue():
+    """Get tracking write-behind queue depth, drops and flush timings (monitoring)"""
+    return jsonify(event_queue.stats())
+
+@app.route('/api/admin/feed-cache')
+def admin_feed_cache():
+    """Get composed-feed cache hit rate, size and invalidations (monitoring)"""
+    return jsonify({**feed_cache.stats(), 'snapshots': feed_snapshots.stats()})
+
+@app.route('/api/admin/geoip')
+def admin_geoip():
+    """Get geo-IP database range counts and lookup cache hit rate (monitoring)"""
+    return jsonify(geoip.stats())
+
+@app.route('/api/admin/homepage-layout')
+def admin_homepage_layout():
+    """Get precomputed homepage layout version, ETag and build time (monitoring)"""
+    return jsonify(homepage_layout.stats())
+
+@app.route('/api/admin/search')
+def admin_search():
+    """Get market search query counts, latency and FTS availability (monitoring)"""
+    return jsonify(market_search.stats())
+
+@app.route('/api/admin/related-markets')
+def admin_related_markets():
+    """Get related-markets index size, build/update cost and source (monitoring)"""
+    return jsonify(related_markets.stats())
+
+@app.route('/api/admin/probability-series')
+def admin_probability_series():
+    """Get chart history reads per tier (raw / 1m / 1h / 1d) (monitoring)"""
+    return jsonify(probability_series.stats())
+
+@app.route('/api/admin/markets-feed')
+def admin_markets_feed():
+    """Get All Markets sequence size, rebuilds and item refreshes (monitoring)"""
+    return jsonify(markets_feed.stats())
+
+@app.route('/api/admin/http-cache')
+def admin_http_cache():
+    """Get 304 counts, compression ratio and encoded-body cache use (monitoring)"""
+    return jsonify(http_cache.stats())
+
+@app.route('/api/admin/rain-client')
+def admin_rain_client():
+    """Get Rain client cache hit rate, coalescing and circuit breaker state (monitoring)"""
+    if not rain_client:
+        return jsonify({'enabled': False})
+    return jsonify(rain_client.stats())
+
+@app.route('/api/admin/rain-sync')
+def admin_rain_sync():
+    """Get Rain mirror lag, watermarks and write counts (monitoring)"""
+    if not (USE_RAIN_API and RAIN_SYNC_ENABLED):
+        return jsonify({'enabled': False})
+    return jsonify(rain_sync.stats())
+
+@app.route('/api/admin/impressions')
+def admin_impressions():
+    """Get impressions logged/deduped and impression writer queue health (monitoring)"""
+    return jsonify(impression_tracker.stats())
+
+@app.route('/api/admin/db-pool')
+def admin_db_pool():
+    """Get SQLite connection pool size, reuse rate and pragma profile (monitoring)"""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/admin/catalog')
+def admin_catalog():
+    """Get in-memory market catalog version and age (monitoring)"""
+    market_catalog.get_snapshot()
+    return jsonify(market_catalog.stats())
+
 @app.route('/brain-viewer')
 @app.route('/brain-viewer/<path:subpath>')
 def brain_viewer(subpath=''):
@@ -1758,7 +1714,7 @@ def api_trade():
             }), 400
         
         # Get market probability from database
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         cursor.execute("SELECT probability, title FROM markets WHERE market_id = ?", (market_id,))
         row = cursor.fetchone()
@@ -1883,6 +1839,8 @@ def api_brain_feed():
     }
     
     Returns ranked feed + logs impressions server-side
+    Pass meta.cursor_next back as "cursor" for the next page (null when done);
+    410 {"cursor_expired": true} means the cursor's snapshot is gone (start over)
     """
     # Check if BRain v1 is enabled
     if not BRAIN_V1_ENABLED:
@@ -1913,19 +1871,27 @@ def api_brain_feed():
         limit = data.get('limit', 30)
         exclude_ids = data.get('exclude_market_ids', [])
         debug = data.get('debug', False)
+        cursor = data.get('cursor')
         
-        # Compose feed
-        result = feed_composer.compose_feed(
-            user_key=user_key,
-            geo_bucket=geo_country,
-            limit=limit,
-            exclude_ids=exclude_ids,
-            debug=debug
-        )
+        # Compose feed (or the next page of a previous one)
+        try:
+            result = feed_composer.compose_feed(
+                user_key=user_key,
+                geo_bucket=geo_country,
+                limit=limit,
+                exclude_ids=exclude_ids,
+                debug=debug,
+                cursor=cursor,
+                paginate=True
+            )
+        except CursorExpired as e:
+            return jsonify({'error': str(e), 'cursor_expired': True}), 410
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Log impressions server-side
         shown_market_ids = [item['market_id'] for item in result['items']]
-        impression_tracker.log_impressions(user_key, shown_market_ids)
+        impression_tracker.log_impressions_async(user_key, shown_market_ids)
         
         app.logger.info(f"[BRain v1] Feed: user={user_key}, geo={geo_country}, items={len(result['items'])}")
         
@@ -1953,9 +1919,8 @@ def api_brain_user(user_key):
     
     try:
         from session_manager import session_manager
-        import sqlite3
         
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         
         # Get long-term scores
@@ -1993,22 +1958,24 @@ def api_brain_user(user_key):
         """, (user_key, cutoff_30d))
         interactions_30d = cursor.fetchone()[0]
         
-        # Get recently shown markets
+        # Get recently shown markets (24h counts are windowed by the tracker)
         cursor.execute("""
-            SELECT market_id, impressions_24h, last_shown_at
+            SELECT market_id
             FROM user_market_impressions
             WHERE user_key = ?
             ORDER BY last_shown_at DESC
             LIMIT 20
         """, (user_key,))
         
+        shown_ids = [row[0] for row in cursor.fetchall()]
+        impressions = impression_tracker.get_impression_data(user_key, shown_ids)
         recent_shown = [
             {
-                'market_id': row[0],
-                'impressions_24h': row[1],
-                'last_shown_at': row[2]
+                'market_id': market_id,
+                'impressions_24h': impressions[market_id]['impressions_24h'],
+                'last_shown_at': impressions[market_id]['last_shown_at']
             }
-            for row in cursor.fetchall()
+            for market_id in shown_ids
         ]
         
         conn.close()
@@ -2032,6 +1999,7 @@ def api_brain_user(user_key):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/brain/trending', methods=['GET'])
+@http_cache.cached(trending_validator, max_age=30)
 def api_brain_trending():
     """
     BRain v1 - Get trending markets
@@ -2056,7 +2024,7 @@ def api_brain_trending():
         else:
             geo_bucket = 'GLOBAL'
         
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -2161,7 +2129,7 @@ def waitlist_submit():
             # Add current timestamp
             WAITLIST_RATE_LIMIT[ip_address].append(current_time)
         
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         
         # Check for duplicates (skip for test email)
@@ -2239,10 +2207,11 @@ def waitlist_submit():
 
 
 @app.route('/api/waitlist/percentages')
+@http_cache.cached(max_age=10)
 def waitlist_percentages():
     """Get current belief percentages (for displaying on buttons)"""
     try:
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         
         # Get belief counts (all submissions including test)
@@ -2287,7 +2256,7 @@ def waitlist_percentages():
 def waitlist_stats():
     """Get waitlist statistics (for admin/monitoring)"""
     try:
-        conn = sqlite3.connect('brain.db')
+        conn = db_pool.connect('brain.db')
         cursor = conn.cursor()
         
         # Total submissions (excluding test)
@@ -2358,6 +2327,8 @@ if __name__ == '__main__':
         else:
             print("❌ Rain API client not initialized")
             exit(1)
+        if RAIN_SYNC_ENABLED:
+            print(f"🔁 Mirroring Rain into {DB_PATH} (rain_sync.py); requests read locally")
     else:
         print("📊 Data source: Local SQLite database")
         if not os.path.exists(DB_PATH):
@@ -2374,5 +2345,8 @@ if __name__ == '__main__':
     print(f"🚀 Server: http://{host}:{port}")
     print("")
     
+    # systemd stops us with SIGTERM: exit normally so queued tracking events flush
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     app.run(host=host, port=port, debug=debug)
 
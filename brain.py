@@ -6,13 +6,15 @@ import sqlite3
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 
+from db_pool import db_pool
+
 class BRain:
     def __init__(self, db_path='brain.db'):
         self.db_path = db_path
     
     def _get_conn(self):
         """Get database connection"""
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
     def calculate_belief_intensity(self, market: Dict) -> float:
         """
@@ -3,13 +3,17 @@ BRain v1 - Scoring System
 Implements NEW vs KNOWN user detection, component scoring, penalties, and bonuses
 Per Roy's spec: balances relevance, freshness, trends, non-repetition
 """
-import sqlite3
 import json
 import math
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from collections import defaultdict
 
+from db_pool import db_pool
+from tracking_engine import RAW_SCORE_SQL, live_topic_score
+from user_context import UserContext
+from velocity_computer import load_probability_anchors, load_velocity_rollups
+
 DB_PATH = 'brain.db'
 
 class BRainV1Scorer:
@@ -25,7 +29,7 @@ class BRainV1Scorer:
         self.config = config
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
     def sigmoid(self, x: float) -> float:
         """Sigmoid normalization: 1 / (1 + exp(-x))"""
@@ -47,6 +51,14 @@ class BRainV1Scorer:
         conn = self._get_conn()
         cursor = conn.cursor()
         
+        count = self._count_interactions_30d(cursor, user_key)
+        conn.close()
+        
+        threshold = self.config['user_types']['new_user_threshold']
+        return count < threshold
+    
+    def _count_interactions_30d(self, cursor, user_key: str) -> int:
+        """Non-impression interactions in the last 30 days"""
         cutoff = (datetime.now() - timedelta(days=30)).isoformat()
         
         cursor.execute("""
@@ -57,11 +69,7 @@ class BRainV1Scorer:
               AND ts > ?
         """, (user_key, cutoff))
         
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        threshold = self.config['user_types']['new_user_threshold']
-        return count < threshold
+        return cursor.fetchone()[0]
     
     def calculate_lt_score(self, market: Dict, user_key: str) -> float:
         """
@@ -74,20 +82,32 @@ class BRainV1Scorer:
         cursor = conn.cursor()
         
         # Get user's long-term scores
-        cursor.execute("""
-            SELECT topic_type, topic_value, score
+        user_scores = self._load_user_scores(cursor, user_key)
+        
+        conn.close()
+        
+        return self._lt_score(market, user_scores)
+    
+    def _load_user_scores(self, cursor, user_key: str) -> Dict[str, Dict[str, float]]:
+        """Get user's long-term topic scores normalized to 0-1: {topic_type: {value: score}}"""
+        cursor.execute(f"""
+            SELECT topic_type, topic_value, score, {RAW_SCORE_SQL}, last_updated
             FROM user_topic_scores
             WHERE user_key = ?
         """, (user_key,))
         
+        now = datetime.now()
+        
         user_scores = defaultdict(dict)
         for row in cursor.fetchall():
-            topic_type, topic_value, score = row
+            topic_type, topic_value, score, raw_score, last_updated = row
+            score = live_topic_score(score, raw_score, last_updated, now)  # Decay to now
             user_scores[topic_type][topic_value] = score / 100.0  # Normalize
         
-        conn.close()
-        
-        # Calculate similarity
+        return user_scores
+    
+    def _lt_score(self, market: Dict, user_scores: Dict[str, Dict[str, float]]) -> float:
+        """LT similarity from preloaded user scores"""
         score = 0.0
         
         # Category match
@@ -119,6 +139,11 @@ class BRainV1Scorer:
         
         # Get session weights
         session = session_manager.get_session_weights(user_key)
+        
+        return self._st_score(market, session)
+    
+    def _st_score(self, market: Dict, session: Dict) -> float:
+        """ST similarity from preloaded session weights"""
         category_weights = session['category_weights']
         tag_weights = session['tag_weights']
         
@@ -167,12 +192,6 @@ class BRainV1Scorer:
         """, (market_id,))
         
         row_global = cursor.fetchone()
-        if row_global:
-            trades_global = row_global[0] or 0
-            views_global = row_global[1] or 0
-        else:
-            trades_global = 0
-            views_global = 0
         
         # Get local velocity
         cursor.execute("""
@@ -182,6 +201,20 @@ class BRainV1Scorer:
         """, (market_id, geo_bucket))
         
         row_local = cursor.fetchone()
+        
+        conn.close()
+        
+        return self._trend_score(row_global, row_local)
+    
+    def _trend_score(self, row_global: Optional[Tuple], row_local: Optional[Tuple]) -> float:
+        """Trend score from (trades_1h, views_1h) rows (None = no rollup)"""
+        if row_global:
+            trades_global = row_global[0] or 0
+            views_global = row_global[1] or 0
+        else:
+            trades_global = 0
+            views_global = 0
+        
         if row_local:
             trades_local = row_local[0] or 0
             views_local = row_local[1] or 0
@@ -189,8 +222,6 @@ class BRainV1Scorer:
             trades_local = 0
             views_local = 0
         
-        conn.close()
-        
         # Calculate TG and TL
         TG = self.sigmoid(0.7 * self.log1p(trades_global) + 0.3 * self.log1p(views_global))
         TL = self.sigmoid(0.7 * self.log1p(trades_local) + 0.3 * self.log1p(views_local))
@@ -242,6 +273,11 @@ class BRainV1Scorer:
         Trend = self.calculate_trend_score(market, geo_bucket)
         Fresh = self.calculate_fresh_score(market)
         
+        return self._combine_components(is_new, LT, ST, Trend, Fresh)
+    
+    def _combine_components(self, is_new: bool, LT: float, ST: float,
+                            Trend: float, Fresh: float) -> Dict:
+        """Weighted base score from already-computed components"""
         # Apply weights based on user type
         if is_new:
             weights = self.config['scoring']['new_user']
@@ -344,17 +380,33 @@ class BRainV1Scorer:
         cursor = conn.cursor()
         
         # Get odds change
-        cursor.execute("""
-            SELECT odds_change_1h
-            FROM market_velocity_rollups
-            WHERE market_id = ? AND geo_bucket = ?
-        """, (market_id, geo_bucket))
-        
-        row = cursor.fetchone()
-        odds_change_1h = row[0] if row else 0.0
+        anchors = load_probability_anchors(cursor, [market_id])
+        if anchors is not None:
+            odds_change_1h = self._odds_change_1h(market, anchors)
+        else:
+            cursor.execute("""
+                SELECT odds_change_1h
+                FROM market_velocity_rollups
+                WHERE market_id = ? AND geo_bucket = ?
+            """, (market_id, geo_bucket))
+            
+            row = cursor.fetchone()
+            odds_change_1h = row[0] if row else 0.0
         
         conn.close()
         
+        return self._changed_from_odds(market, odds_change_1h)
+    
+    def _odds_change_1h(self, market: Dict, anchors: Dict[str, Dict[str, Optional[float]]]) -> float:
+        """|probability now - 1h ago| from load_probability_anchors() (0.0 if unknown)"""
+        prob_1h_ago = anchors.get(market['market_id'], {}).get('1h')
+        probability = market.get('probability')
+        if prob_1h_ago is None or probability is None:
+            return 0.0
+        return abs(probability - prob_1h_ago)
+    
+    def _changed_from_odds(self, market: Dict, odds_change_1h: float) -> Tuple[bool, Dict]:
+        """is_changed() from a preloaded odds_change_1h"""
         # Check odds change threshold
         changed_config = self.config['changed_logic']
         odds_changed = odds_change_1h >= changed_config['odds_change_threshold']
@@ -396,6 +448,18 @@ class BRainV1Scorer:
         
         # Calculate base score
         base_result = self.calculate_base_score(market, user_key, geo_bucket, is_new)
+        
+        return self._apply_adjustments(
+            market, is_new, base_result, impression_data,
+            lambda: self.is_changed(market, geo_bucket)
+        )
+    
+    def _apply_adjustments(self, market: Dict, is_new: bool, base_result: Dict,
+                           impression_data: Optional[Dict], changed_lookup) -> Dict:
+        """
+        Penalties, bonuses and reason tags on top of a base score
+        changed_lookup() -> (is_changed, details); only called if not hidden
+        """
         base_score = base_result['base_score']
         components = base_result['components']
         
@@ -433,7 +497,7 @@ class BRainV1Scorer:
         freq_mult = self.calculate_freq_mult(impression_data.get('impressions_24h', 0))
         
         # Check if changed
-        is_changed, changed_details = self.is_changed(market, geo_bucket)
+        is_changed, changed_details = changed_lookup()
         
         # Apply "changed" softening
         changed_config = self.config['changed_logic']
@@ -494,6 +558,136 @@ class BRainV1Scorer:
                 'changed_details': changed_details
             }
         }
+    
+    def build_user_context(self, user_key: str, geo_bucket: str,
+                           impression_data: Optional[Dict[str, Dict]] = None) -> UserContext:
+        """
+        Load everything per-user the pipeline needs, once per request
+        
+        impression_data: override the impression map (default: all of the
+        user's user_market_impressions rows)
+        """
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        
+        threshold = self.config['user_types']['new_user_threshold']
+        is_new = self._count_interactions_30d(cursor, user_key) < threshold
+        topic_scores = self._load_user_scores(cursor, user_key)
+        
+        conn.close()
+        
+        try:
+            from session_manager import session_manager
+            session = session_manager.get_session_weights(user_key)
+        except ImportError:
+            session = None
+        
+        if impression_data is None:
+            from impression_tracker import impression_tracker
+            impression_data = impression_tracker.get_user_impressions(user_key)
+        
+        return UserContext(user_key, geo_bucket, is_new, topic_scores, session,
+                           impression_data, self.hidden_market_ids(impression_data))
+    
+    def hidden_market_ids(self, impression_data: Dict[str, Dict]) -> Set[str]:
+        """Markets hidden within hide_suppression_days, from an impression map"""
+        # Same cutoff + comparison as the SQL filter it replaces
+        hide_days = self.config['penalties']['hide_suppression_days']
+        cutoff_hide = (datetime.now() - timedelta(days=hide_days)).isoformat()
+        return {
+            market_id for market_id, imp in impression_data.items()
+            if imp.get('last_hidden_at') and str(imp['last_hidden_at']) > cutoff_hide
+        }
+    
+    def calculate_relevance(self, market: Dict, ctx: UserContext) -> Tuple[float, float]:
+        """(LT, ST) similarity from a prebuilt UserContext"""
+        LT = self._lt_score(market, ctx.topic_scores)
+        ST = self._st_score(market, ctx.session) if ctx.session is not None else 0.0
+        return LT, ST
+    
+    def score_batch(self, markets: List[Dict], user_key: str, geo_bucket: str,
+                    impression_data: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+        """
+        Score a whole candidate pool in one pass
+        
+        Same result as calculate_final_score() per market, but the user profile
+        (NEW/KNOWN, topic scores, session weights) and velocity rollups are
+        loaded once for the pool instead of once per market.
+        compose_feed runs the same two steps itself, caching the first.
+        
+        impression_data: {market_id: impression dict} (get_impression_data format)
+        Returns: {market_id: score result}
+        """
+        if not markets:
+            return {}
+        
+        ctx = self.build_user_context(user_key, geo_bucket, impression_data or {})
+        base_scores = self.base_scores_with_context(markets, ctx)
+        return {
+            market['market_id']: self.adjust_with_context(market, base_scores[market['market_id']], ctx)
+            for market in markets
+        }
+    
+    def base_scores_with_context(self, markets: List[Dict],
+                                 ctx: UserContext) -> Dict[str, Tuple[Dict, Tuple[bool, Dict]]]:
+        """
+        Batch scoring, step 1: the impression-independent part of
+        calculate_final_score() for a whole candidate pool (cacheable)
+        
+        The user profile comes from ctx and velocity rollups/probability
+        anchors are loaded once for the pool instead of once per market.
+        Step 2 is adjust_with_context() per market.
+        
+        Returns: {market_id: (base_result, (is_changed, changed_details))}
+        """
+        if not markets:
+            return {}
+        
+        market_ids = list({m['market_id'] for m in markets})
+        geo_bucket = ctx.geo_bucket
+        is_new = ctx.is_new
+        
+        # Velocity rollups and probability anchors for the pool (once)
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        velocity = load_velocity_rollups(cursor, market_ids, geo_bucket)
+        anchors = load_probability_anchors(cursor, market_ids)
+        conn.close()
+        
+        results = {}
+        for market in markets:
+            market_id = market['market_id']
+            row_global = velocity.get((market_id, 'GLOBAL'))
+            row_local = velocity.get((market_id, geo_bucket))
+            
+            LT, ST = self.calculate_relevance(market, ctx)
+            if is_new:
+                LT = 0.0
+            Trend = self._trend_score(row_global, row_local)
+            Fresh = self.calculate_fresh_score(market)
+            
+            base_result = self._combine_components(is_new, LT, ST, Trend, Fresh)
+            if anchors is not None:
+                odds_change_1h = self._odds_change_1h(market, anchors)
+            else:
+                odds_change_1h = row_local[2] if row_local else 0.0
+            
+            results[market_id] = (base_result, self._changed_from_odds(market, odds_change_1h))
+        
+        return results
+    
+    def adjust_with_context(self, market: Dict, base: Tuple[Dict, Tuple[bool, Dict]],
+                            ctx: UserContext) -> Dict:
+        """
+        Batch scoring, step 2: final score (same result as
+        calculate_final_score()) from a base_scores_with_context() entry +
+        ctx's impressions
+        """
+        base_result, changed = base
+        return self._apply_adjustments(
+            market, ctx.is_new, base_result, ctx.impression(market['market_id']),
+            lambda: changed
+        )
 
 # Global instance
 brain_v1_scorer = BRainV1Scorer()
@@ -1,207 +1,284 @@
 #!/usr/bin/env python3
 """
-Compute trending scores (24h rolling window)
+Compute trending scores (1h / 24h / 7d rolling windows, global + per country)
 Run this every 30 minutes via cron or manually
+
+One grouped pass over user_interactions feeds every window and scope. The
+new rows are written into a shadow table and swapped in with one short
+transaction, so readers see either the previous cache or the new one, never
+a half-empty one.
 """
-import sqlite3
 import math
-from datetime import datetime, timedelta
+import time
 from collections import defaultdict
+from datetime import datetime, timedelta
+
+from db_pool import db_pool
 
 DB_PATH = 'brain.db'
 
-def compute_trending_scores(scope='global', window_hours=24):
+# window label -> hours
+WINDOWS = {'1h': 1, '24h': 24, '7d': 168}
+
+# Global: top 50 max, score >= 0.1 beyond the first 20
+GLOBAL_LIMIT = 50
+GLOBAL_MIN_SCORE = 0.1
+GLOBAL_ALWAYS = 20
+
+# Localized: top 20 per country max, score >= 0.15 beyond the first 10,
+# and at least 2 users in that country (requires more signal)
+LOCAL_LIMIT = 20
+LOCAL_MIN_SCORE = 0.15
+LOCAL_ALWAYS = 10
+LOCAL_MIN_USERS = 2
+
+IGNORED_COUNTRIES = ('UNKNOWN', 'LOCAL', '')
+
+SHADOW_TABLE = 'trending_cache_next'
+
+# Same columns as trending_cache in schema.sql
+SHADOW_DDL = f"""
+    CREATE TABLE {SHADOW_TABLE} (
+        market_id TEXT,
+        scope TEXT, -- 'global', 'local:US', 'local:IL', etc.
+        score REAL,
+        rank INTEGER,
+        window TEXT DEFAULT '24h', -- '1h', '24h', '7d'
+        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (market_id, scope, window)
+    )
+"""
+
+EVENT_WEIGHT_SQL = """
+    CASE event_type
+        WHEN 'participate' THEN 6.0
+        WHEN 'share' THEN 4.0
+        WHEN 'comment' THEN 4.5
+        WHEN 'click' THEN 2.0
+        WHEN 'view_market' THEN 2.0
+        WHEN 'dwell_30+' THEN 2.0
+        WHEN 'dwell_5+' THEN 1.0
+        ELSE 1.0
+    END
+"""
+
+
+def _cutoff_param(label: str) -> str:
+    """Named SQL parameter for a window's cutoff ('24h' -> 'since_24h')"""
+    return f'since_{label}'
+
+
+def _scan_interactions(cursor, now):
     """
-    Compute trending scores: 85% interaction interest + 15% volume
+    Users and total weight per market (global) and per (country, market),
+    for every window, from one grouped pass over user_interactions
+    Returns: ({window: {'global': {market_id: (users, weight)},
+                        'local': {(geo_country, market_id): (users, weight)}}},
+              interactions scanned)
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    print(f"🔥 Computing trending scores for {scope} (last {window_hours}h)...")
-    
-    cutoff = (datetime.now() - timedelta(hours=window_hours)).isoformat()
-    
-    # 1. Get interaction-based interest scores
-    cursor.execute("""
-        SELECT 
-            ui.market_id,
-            COUNT(DISTINCT ui.user_key) as unique_users,
-            SUM(CASE ui.event_type
-                WHEN 'participate' THEN 6.0
-                WHEN 'share' THEN 4.0
-                WHEN 'comment' THEN 4.5
-                WHEN 'click' THEN 2.0
-                WHEN 'view_market' THEN 2.0
-                WHEN 'dwell_30+' THEN 2.0
-                WHEN 'dwell_5+' THEN 1.0
-                ELSE 1.0
-            END) as total_weight
-        FROM user_interactions ui
-        WHERE ui.ts > ?
-        GROUP BY ui.market_id
-    """, (cutoff,))
-    
-    interest_scores = {}
+    labels = sorted(WINDOWS, key=WINDOWS.get)
+    params = {
+        _cutoff_param(label): (now - timedelta(hours=WINDOWS[label])).isoformat()
+        for label in labels
+    }
+    params.update({f'ignored_{i}': country for i, country in enumerate(IGNORED_COUNTRIES)})
+    ignored = ', '.join(f':ignored_{i}' for i in range(len(IGNORED_COUNTRIES)))
+
+    # One row per (market, user, country): the weight each window sees
+    per_user = ',\n'.join(
+        f"SUM(CASE WHEN ts > :{_cutoff_param(label)} THEN w END) AS w_{i}"
+        for i, label in enumerate(labels)
+    )
+    # ...rolled up globally (distinct users) and per country
+    global_columns = ',\n'.join(
+        f"COUNT(DISTINCT CASE WHEN w_{i} IS NOT NULL THEN user_key END), SUM(w_{i})"
+        for i in range(len(labels))
+    )
+    local_columns = ',\n'.join(f"COUNT(w_{i}), SUM(w_{i})" for i in range(len(labels)))
+
+    cursor.execute(f"""
+        WITH per_user AS MATERIALIZED (
+            SELECT market_id, user_key, geo_country, COUNT(*) AS n,
+                   {per_user}
+            FROM (
+                SELECT market_id, user_key, geo_country, ts, {EVENT_WEIGHT_SQL} AS w
+                FROM user_interactions
+                WHERE ts > :{_cutoff_param(labels[-1])}
+            )
+            GROUP BY market_id, user_key, geo_country
+        )
+        SELECT market_id, NULL, SUM(n), {global_columns}
+        FROM per_user
+        GROUP BY market_id
+        UNION ALL
+        SELECT market_id, geo_country, SUM(n), {local_columns}
+        FROM per_user
+        WHERE geo_country IS NOT NULL AND geo_country NOT IN ({ignored})
+        GROUP BY geo_country, market_id
+    """, params)
+
+    scores = {label: {'global': {}, 'local': {}} for label in labels}
+    scanned = 0
     for row in cursor.fetchall():
-        market_id, unique_users, total_weight = row
-        # Average weight per user who interacted
-        avg_interest = total_weight / max(unique_users, 1)
-        interest_scores[market_id] = avg_interest
-    
-    # 2. Get volume-based scores
+        market_id, geo_country, count = row[:3]
+        if geo_country is None:
+            scanned += count
+        for i, label in enumerate(labels):
+            users, weight = row[3 + 2 * i], row[4 + 2 * i]
+            if not users:
+                continue
+            if geo_country is None:
+                scores[label]['global'][market_id] = (users, weight)
+            else:
+                scores[label]['local'][(geo_country, market_id)] = (users, weight)
+    return scores, scanned
+
+
+def _volume_scores(cursor):
+    """log(1 + volume_24h) of open markets, normalized to 0-1"""
     cursor.execute("""
         SELECT market_id, volume_24h
         FROM markets
         WHERE status = 'open'
     """)
-    
-    volume_scores = {}
-    for row in cursor.fetchall():
-        market_id, volume = row
-        # Log scale
-        volume_scores[market_id] = math.log(1 + (volume or 0))
-    
-    # 3. Normalize both to 0-1 scale
-    if interest_scores:
-        max_interest = max(interest_scores.values())
-        interest_scores = {k: v/max_interest for k, v in interest_scores.items()}
-    
+    volume_scores = {market_id: math.log(1 + (volume or 0)) for market_id, volume in cursor.fetchall()}
     if volume_scores:
         max_volume = max(volume_scores.values())
         volume_scores = {k: v/max_volume if max_volume > 0 else 0 for k, v in volume_scores.items()}
-    
-    # 4. Combine: 85% interest + 15% volume
-    all_market_ids = set(interest_scores.keys()) | set(volume_scores.keys())
-    
-    trending_scores = {}
-    for market_id in all_market_ids:
-        interest = interest_scores.get(market_id, 0.0)
-        volume = volume_scores.get(market_id, 0.0)
-        trending_score = 0.85 * interest + 0.15 * volume
-        trending_scores[market_id] = trending_score
-    
-    # 5. Filter to only truly trending markets
-    # Only include markets with meaningful activity (score > 0.1) or top 50
-    sorted_trending = sorted(trending_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # Take top 50 markets OR all markets with score > 0.1, whichever is smaller
-    min_threshold = 0.1
-    filtered_trending = []
-    for market_id, score in sorted_trending[:50]:  # Top 50 max
-        if score >= min_threshold or len(filtered_trending) < 20:  # Always include top 20
-            filtered_trending.append((market_id, score))
-    
-    # 6. Clear old cache and insert new scores
-    cursor.execute("""
-        DELETE FROM trending_cache
-        WHERE scope = ? AND window = ?
-    """, (scope, f'{window_hours}h'))
-    
-    for market_id, score in filtered_trending:
-        cursor.execute("""
-            INSERT INTO trending_cache (market_id, scope, score, window, computed_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (market_id, scope, score, f'{window_hours}h', datetime.now().isoformat()))
-    
-    conn.commit()
-    conn.close()
-    
-    print(f"✅ Computed {len(trending_scores)} raw scores, stored {len(filtered_trending)} trending markets")
-    print(f"📈 Top 5 trending markets:")
-    
-    for market_id, score in filtered_trending[:5]:
-        print(f"  {market_id}: {score:.3f}")
-
-def compute_localized_trending(window_hours=24):
+    return volume_scores
+
+
+def _top(scores, limit, min_score, always):
+    """Top `limit` by score, keeping only those >= min_score after the first `always`"""
+    ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+    kept = []
+    for market_id, score in ranked[:limit]:
+        if score >= min_score or len(kept) < always:
+            kept.append((market_id, score))
+    return kept
+
+
+def _global_trending(interest, volume_scores):
+    """85% interaction interest + 15% volume"""
+    # Average weight per user who interacted, normalized to 0-1
+    interest_scores = {
+        market_id: weight / max(users, 1) for market_id, (users, weight) in interest.items()
+    }
+    if interest_scores:
+        max_interest = max(interest_scores.values())
+        interest_scores = {k: v/max_interest for k, v in interest_scores.items()}
+
+    trending_scores = {
+        market_id: 0.85 * interest_scores.get(market_id, 0.0) + 0.15 * volume_scores.get(market_id, 0.0)
+        for market_id in set(interest_scores) | set(volume_scores)
+    }
+    return _top(trending_scores, GLOBAL_LIMIT, GLOBAL_MIN_SCORE, GLOBAL_ALWAYS)
+
+
+def _localized_trending(interest):
     """
-    Compute localized trending scores per country
-    When people from the same area like something, make it trending in that area
+    Interest per country: when people from the same area like something,
+    make it trending in that area
+    Returns: {geo_country: [(market_id, score), ...]}
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    print(f"🌍 Computing localized trending scores (last {window_hours}h)...")
-    
-    cutoff = (datetime.now() - timedelta(hours=window_hours)).isoformat()
-    
-    # Get interactions grouped by geo_country
-    cursor.execute("""
-        SELECT 
-            ui.geo_country,
-            ui.market_id,
-            COUNT(DISTINCT ui.user_key) as unique_users,
-            SUM(CASE ui.event_type
-                WHEN 'participate' THEN 6.0
-                WHEN 'share' THEN 4.0
-                WHEN 'comment' THEN 4.5
-                WHEN 'click' THEN 2.0
-                WHEN 'view_market' THEN 2.0
-                WHEN 'dwell_30+' THEN 2.0
-                WHEN 'dwell_5+' THEN 1.0
-                ELSE 1.0
-            END) as total_weight
-        FROM user_interactions ui
-        WHERE ui.ts > ? 
-          AND ui.geo_country IS NOT NULL 
-          AND ui.geo_country NOT IN ('UNKNOWN', 'LOCAL', '')
-        GROUP BY ui.geo_country, ui.market_id
-        HAVING COUNT(DISTINCT ui.user_key) >= 2
-    """, (cutoff,))
-    
-    # Group by country
     country_scores = defaultdict(dict)
-    for row in cursor.fetchall():
-        geo_country, market_id, unique_users, total_weight = row
-        avg_interest = total_weight / max(unique_users, 1)
-        country_scores[geo_country][market_id] = avg_interest
-    
-    # Normalize per country and store (only top trending)
-    total_localized = 0
-    min_threshold = 0.15  # Higher threshold for localized (requires more signal)
-    
+    for (geo_country, market_id), (users, weight) in interest.items():
+        if users >= LOCAL_MIN_USERS:
+            country_scores[geo_country][market_id] = weight / users
+
+    local = {}
     for geo_country, market_scores in country_scores.items():
-        if not market_scores:
-            continue
-        
         # Normalize to 0-1 within this country
         max_score = max(market_scores.values())
-        normalized_scores = {k: v/max_score for k, v in market_scores.items()}
-        
-        # Filter to top 20 per country or score > threshold
-        sorted_local = sorted(normalized_scores.items(), key=lambda x: x[1], reverse=True)
-        filtered_local = []
-        for market_id, score in sorted_local[:20]:  # Top 20 per country max
-            if score >= min_threshold or len(filtered_local) < 10:  # Always include top 10
-                filtered_local.append((market_id, score))
-        
-        # Delete old localized scores for this country
-        cursor.execute("""
-            DELETE FROM trending_cache
-            WHERE scope = ? AND window = ?
-        """, (f'local:{geo_country}', f'{window_hours}h'))
-        
-        # Insert new localized scores
-        for market_id, score in filtered_local:
-            cursor.execute("""
-                INSERT INTO trending_cache (market_id, scope, score, window, computed_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (market_id, f'local:{geo_country}', score, f'{window_hours}h', datetime.now().isoformat()))
-            total_localized += 1
-    
+        normalized = {k: v/max_score for k, v in market_scores.items()}
+        local[geo_country] = _top(normalized, LOCAL_LIMIT, LOCAL_MIN_SCORE, LOCAL_ALWAYS)
+    return local
+
+
+def _swap_in(conn, cache_rows):
+    """Write the shadow table, then replace trending_cache with it atomically"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+    cursor.execute(SHADOW_DDL)
+    cursor.executemany(f"""
+        INSERT INTO {SHADOW_TABLE} (market_id, scope, score, rank, window, computed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, cache_rows)
     conn.commit()
-    conn.close()
-    
-    print(f"✅ Computed localized trending for {len(country_scores)} countries ({total_localized} scores)")
-    
-    # Show top countries
-    sorted_countries = sorted(country_scores.items(), key=lambda x: len(x[1]), reverse=True)[:5]
-    for geo_country, market_scores in sorted_countries:
-        top_market = sorted(market_scores.items(), key=lambda x: x[1], reverse=True)[0]
-        print(f"  {geo_country}: {len(market_scores)} trending markets (top: {top_market[0]})")
+
+    # Readers (WAL) keep the old table until this commits
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("DROP TABLE IF EXISTS trending_cache")
+        cursor.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO trending_cache")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trending_scope ON trending_cache(scope, rank)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def compute_all_trending():
+    """
+    Compute global and localized trending for every window and swap them in
+    Returns: run stats (duration, rows scanned/written per window)
+    """
+    start = time.time()
+    now = datetime.now()
+    computed_at = now.isoformat()
+
+    conn = db_pool.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+
+        print(f"🔥 Computing trending scores ({', '.join(WINDOWS)}; global + localized)...")
+
+        window_scores, scanned = _scan_interactions(cursor, now)
+        volume_scores = _volume_scores(cursor)
+
+        cache_rows = []
+        report = {}
+        for window, interest in window_scores.items():
+            global_trending = _global_trending(interest['global'], volume_scores)
+            for rank, (market_id, score) in enumerate(global_trending, 1):
+                cache_rows.append((market_id, 'global', score, rank, window, computed_at))
+
+            local = _localized_trending(interest['local'])
+            local_count = 0
+            for geo_country, trending in local.items():
+                for rank, (market_id, score) in enumerate(trending, 1):
+                    cache_rows.append((market_id, f'local:{geo_country}', score, rank, window, computed_at))
+                local_count += len(trending)
+
+            report[window] = {
+                'markets': len(interest['global']),
+                'global_rows': len(global_trending),
+                'countries': len(local),
+                'local_rows': local_count,
+                'top': global_trending[:5]
+            }
+
+        _swap_in(conn, cache_rows)
+    finally:
+        conn.close()
+
+    duration_ms = (time.time() - start) * 1000
+    print(f"✅ Stored {len(cache_rows)} trending rows in {duration_ms:.0f}ms "
+          f"({scanned} interactions scanned)")
+    for window, stats in report.items():
+        print(f"  {window}: {stats['global_rows']} global, {stats['local_rows']} localized "
+              f"across {stats['countries']} countries ({stats['markets']} markets with activity)")
+        for market_id, score in stats.pop('top'):
+            print(f"    {market_id}: {score:.3f}")
+
+    return {
+        'computed_at': computed_at,
+        'duration_ms': round(duration_ms, 2),
+        'interactions_scanned': scanned,
+        'rows_written': len(cache_rows),
+        'windows': report
+    }
+
 
 if __name__ == '__main__':
-    # Compute global trending
-    compute_trending_scores()
-    
-    # Compute localized trending
-    compute_localized_trending()
+    compute_all_trending()
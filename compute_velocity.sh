@@ -18,8 +18,14 @@ print(f"[Velocity] Recorded {prob_result['recorded']} probabilities")
 # Compute all rollups
 result = velocity_computer.compute_all_rollups()
 
+print(f"[Velocity] Ingested {result['events_ingested']} events ({result['mode']})")
 print(f"[Velocity] Updated {result['updated_count']} rollups across {result['geo_buckets']} geo buckets")
 print(f"[Velocity] Duration: {result['duration_ms']:.0f}ms")
+
+# Trim the market catalog change log
+from market_catalog import market_catalog
+pruned = market_catalog.prune_change_log()
+print(f"[Velocity] Pruned {pruned} catalog change log rows")
 EOF
 
 echo "[$(date)] Velocity computation complete" >> /tmp/velocity_compute.log
@@ -8,12 +8,19 @@ import os
 USE_RAIN_API = os.getenv('USE_RAIN_API', 'false').lower() == 'true'
 RAIN_API_URL = os.getenv('RAIN_API_URL', 'http://localhost:5000/api/v1')
 
+# With USE_RAIN_API: mirror Rain into brain.db (rain_sync.py) and serve every
+# request locally; false = call Rain on each request (previous behaviour)
+RAIN_SYNC_ENABLED = os.getenv('RAIN_SYNC_ENABLED', 'true').lower() == 'true'
+
 # BRain v1 personalization toggle
 BRAIN_V1_ENABLED = os.getenv('BRAIN_V1_ENABLED', 'true').lower() == 'true'  # Set to False to rollback to v159
 
 # Database fallback
 DB_PATH = os.path.join(os.path.dirname(__file__), 'brain.db')
 
+# Offline geo-IP database (built by import_geoip.py)
+GEOIP_DB_PATH = os.getenv('GEOIP_DB_PATH', os.path.join(os.path.dirname(__file__), 'geoip.dat'))
+
 # Application settings
 DEBUG = os.getenv('DEBUG', 'false').lower() == 'true'
 HOST = os.getenv('HOST', '0.0.0.0')
@@ -0,0 +1,223 @@
+"""
+BRain - SQLite Connection Pool
+Shared connection provider for every brain.db accessor
+
+Modules keep their `_get_conn()` / `conn.close()` shape: db_pool.connect()
+hands out a pooled connection and close() returns it to the pool instead of
+closing it. Connections are opened once with the pragma profile below (WAL so
+readers don't block behind the tracking writer, synchronous=NORMAL, mmap,
+larger page cache, busy_timeout) and keep their prepared-statement cache
+across requests.
+
+A connection is checked out by one thread at a time. Idle connections are
+shared between threads, so thread-per-request servers (Flask dev server)
+reuse them too; each gunicorn worker process gets its own pool.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# Applied to every new connection (journal_mode is persistent per database)
+PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 268435456),   # 256MB
+    ('cache_size', -16000),     # 16MB
+    ('busy_timeout', 5000),     # ms
+    ('temp_store', 'MEMORY'),
+]
+
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 256
+
+# Idle connections kept per database; extra returns are really closed
+MAX_IDLE = 8
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() gives it back to the pool"""
+
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            super().close()
+            return
+        pool._release(self)
+
+    def _close(self):
+        """Really close the underlying connection"""
+        super().close()
+
+    def __del__(self):
+        # Dropped without close() (e.g. an exception skipped it): sqlite
+        # closes the handle, the pool only fixes its bookkeeping
+        pool = getattr(self, '_pool', None)
+        if pool is not None and self._checked_out:
+            pool._leaked(self)
+
+
+class ConnectionPool:
+    def __init__(self, max_idle: int = MAX_IDLE):
+        self.max_idle = max_idle
+
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+        # {abs db path: [idle PooledConnection]}
+        self._idle: Dict[str, list] = {}
+
+        # Monitoring counters
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.discarded = 0
+        self.leaked = 0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def connect(self, db_path: str = DB_PATH) -> PooledConnection:
+        """
+        Check out a connection to db_path
+
+        Returns: connection with default settings (no row_factory, implicit
+        transactions); call close() when done to return it
+        """
+        key = os.path.abspath(db_path)
+        self._check_fork()
+
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                self.reused += 1
+            self.in_use += 1
+            if self.in_use > self.max_in_use:
+                self.max_in_use = self.in_use
+
+        if conn is None:
+            try:
+                conn = self._open(key)
+            except Exception:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+            with self._lock:
+                self.opened += 1
+
+        conn._checked_out = True
+        return conn
+
+    def _open(self, key: str) -> PooledConnection:
+        conn = sqlite3.connect(
+            key,
+            factory=PooledConnection,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False
+        )
+        for name, value in PRAGMAS:
+            try:
+                conn.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.Error as e:
+                logger.warning(f"DB pool: PRAGMA {name} failed on {key}: {e}")
+
+        conn._pool = self
+        conn._pool_key = key
+        conn._pool_pid = self._pid
+        conn._checked_out = False
+        return conn
+
+    def _release(self, conn: PooledConnection):
+        """Reset a returned connection and put it back (or close it)"""
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+
+        reusable = conn._pool_pid == os.getpid()
+        if reusable:
+            try:
+                # Same semantics as closing: uncommitted work is discarded
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.row_factory = None
+                conn.text_factory = str
+                conn.isolation_level = ''
+            except sqlite3.Error as e:
+                logger.warning(f"DB pool: discarding connection: {e}")
+                reusable = False
+
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+            idle = self._idle.setdefault(conn._pool_key, [])
+            if reusable and len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+            if reusable:
+                self.closed += 1
+            else:
+                self.discarded += 1
+
+        # Connections inherited across fork() belong to the parent: drop,
+        # never close them here
+        if reusable:
+            conn._close()
+
+    def _leaked(self, conn: PooledConnection):
+        conn._checked_out = False
+        with self._lock:
+            if conn._pool_pid == self._pid:
+                self.in_use = max(0, self.in_use - 1)
+            self.leaked += 1
+
+    def _check_fork(self):
+        """After fork (gunicorn preload), start from an empty pool"""
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        with self._lock:
+            if pid == self._pid:
+                return
+            self._pid = pid
+            self._idle = {}
+            self.in_use = 0
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on return)"""
+        self._check_fork()
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn._close()
+                with self._lock:
+                    self.closed += 1
+
+    def stats(self) -> Dict:
+        """Pool size and reuse counters for monitoring"""
+        with self._lock:
+            checkouts = self.opened + self.reused
+            return {
+                'databases': {key: len(conns) for key, conns in self._idle.items()},
+                'idle': sum(len(conns) for conns in self._idle.values()),
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'max_idle': self.max_idle,
+                'opened': self.opened,
+                'reused': self.reused,
+                'closed': self.closed,
+                'discarded': self.discarded,
+                'leaked': self.leaked,
+                'reuse_rate': round(self.reused / checkouts, 4) if checkouts else 0.0,
+                'pragmas': dict(PRAGMAS),
+                'cached_statements': CACHED_STATEMENTS
+            }
+
+
+# Global instance
+db_pool = ConnectionPool()
@@ -9,6 +9,7 @@ import sqlite3
 import json
 from datetime import datetime
 import os
+from market_search import build_match_query
 
 app = Flask(__name__)
 DB_PATH = 'brain.db'
@@ -347,6 +348,11 @@ def get_tables():
     conn.close()
     return tables
 
+def has_market_search(cursor):
+    """Whether the market_search FTS table exists"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='market_search'")
+    return cursor.fetchone() is not None
+
 def get_table_data(table, search=None, limit=100):
     """Get data from a specific table"""
     conn = get_db()
@@ -370,7 +376,19 @@ def get_table_data(table, search=None, limit=100):
         query = f"SELECT * FROM {table}"
         columns = table_columns
     
-    if search:
+    if search and table == 'markets' and has_market_search(cursor):
+        # Full-text index (migrations/004) for the text columns; ids,
+        # categories and status aren't indexed, so match those directly
+        search_conditions = ["market_id LIKE ?", "category LIKE ?", "status = ?"]
+        params = [f"%{search}%", f"%{search}%", search]
+        match = build_match_query(search)
+        if match is not None:
+            search_conditions.append(
+                "market_id IN (SELECT market_id FROM market_search WHERE market_search MATCH ?)")
+            params.append(match)
+        query += " WHERE " + " OR ".join(search_conditions)
+        cursor.execute(f"{query} LIMIT {limit}", params)
+    elif search:
         # Simple search across all columns
         search_conditions = [f"{col} LIKE ?" for col in columns if col != 'market_question']
         if has_market_id and table != 'markets':
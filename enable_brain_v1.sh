@@ -41,11 +41,9 @@ echo "   ✅ Crontab backed up to $BACKUP_FILE"
 # Add BRain v1 jobs if not present
 (crontab -l 2>/dev/null | grep -v "compute_velocity.sh" | grep -v "impression_tracker" | grep -v "session_manager"; \
  echo "*/5 * * * * /home/ubuntu/.openclaw/workspace/currents-full-local/compute_velocity.sh"; \
- echo "0 4 * * * cd /home/ubuntu/.openclaw/workspace/currents-full-local && python3 -c 'from impression_tracker import impression_tracker; impression_tracker.cleanup_old_impressions()'"; \
  echo "0 3 * * * cd /home/ubuntu/.openclaw/workspace/currents-full-local && python3 -c 'from session_manager import session_manager; session_manager.cleanup_expired_sessions()'") | crontab -
 
 echo "   ✅ Added velocity computation (every 5 min)"
-echo "   ✅ Added impression cleanup (daily 4am)"
 echo "   ✅ Added session cleanup (daily 3am)"
 
 # Step 4: Run velocity computation once
@@ -93,7 +91,7 @@ echo "  • BRain v1: ENABLED (via BRAIN_V1_ENABLED=true)"
 echo "  • Personalization: NEW SYSTEM (v160)"
 echo "  • API endpoints: /api/brain/feed, /api/brain/user, /api/brain/trending"
 echo "  • Tracking: integrated with BRain v1"
-echo "  • Cron jobs: velocity computation, impression cleanup, session cleanup"
+echo "  • Cron jobs: velocity computation, session cleanup"
 echo ""
 echo "To rollback:"
 echo "  bash rollback_to_v159.sh"
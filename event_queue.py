@@ -0,0 +1,310 @@
+"""
+BRain - Write-Behind Event Queue
+Takes /api/track and /api/track/batch events off the request path
+
+Requests only validate and enqueue; a background writer thread drains the
+bounded queue and writes each flush (interactions, topic scores, impressions,
+session state) in ONE transaction via TrackingEngine.record_interactions_bulk_on_cursor.
+When the queue is full, events are dropped and counted instead of blocking
+the request (back-pressure is visible in stats() and as 503s on /api/track).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from feed_cache import feed_cache
+
+logger = logging.getLogger(__name__)
+
+# Queue capacity (events); beyond this new events are dropped
+QUEUE_MAXSIZE = 10000
+
+# Max events written per transaction
+MAX_BATCH = 500
+
+# Max time (seconds) an event waits before its flush starts
+FLUSH_INTERVAL = 0.5
+
+_STOP = object()
+
+
+class EventQueue:
+    def __init__(self, engine=None, maxsize: int = QUEUE_MAXSIZE,
+                 max_batch: int = MAX_BATCH, flush_interval: float = FLUSH_INTERVAL):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.geo_resolver: Optional[Callable[[str], str]] = None
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._atexit_registered = False
+
+        # Monitoring counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.last_flush_size = 0
+
+    def _get_engine(self):
+        if self.engine is None:
+            from tracking_engine import tracker
+            self.engine = tracker
+        return self.engine
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self, geo_resolver: Optional[Callable[[str], str]] = None):
+        """
+        Start the writer thread (idempotent)
+
+        geo_resolver: ip -> country code, called on the writer thread for
+        events enqueued with client_ip instead of geo_country
+        """
+        with self._start_lock:
+            if geo_resolver is not None:
+                self.geo_resolver = geo_resolver
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._thread = threading.Thread(
+                target=self._run, name='event-queue-writer', daemon=True
+            )
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything still queued and stop the writer"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+
+        # Bypass maxsize: shutdown must not be dropped
+        with self._queue.mutex:
+            self._queue.queue.append(_STOP)
+            self._queue.not_empty.notify()
+
+        thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ------------------------------------------------------------------
+    # Producer side (request thread)
+    # ------------------------------------------------------------------
+
+    def submit(self, event: Dict) -> bool:
+        """
+        Enqueue one event without blocking
+
+        event: {user_key, market_id, event_type, dwell_ms?, section?, position?,
+                geo_country? | client_ip?}
+        Returns: False if the queue is full (event dropped)
+        """
+        if not self.running:
+            self.start()
+
+        event.setdefault('ts', datetime.now())
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+
+        with self._stats_lock:
+            self.enqueued += 1
+            depth = self._queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def submit_many(self, events: List[Dict]) -> int:
+        """Enqueue several events; returns how many were accepted"""
+        accepted = 0
+        for event in events:
+            if self.submit(event):
+                accepted += 1
+        return accepted
+
+    def stats(self) -> Dict:
+        """Queue depth, throughput and drop counters for monitoring"""
+        with self._stats_lock:
+            return {
+                'running': self.running,
+                'depth': self._queue.qsize(),
+                'capacity': self._queue.maxsize,
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'written': self.written,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_size': self.last_flush_size,
+                'last_flush_ms': round(self.last_flush_ms, 2)
+            }
+
+    # ------------------------------------------------------------------
+    # Consumer side (writer thread)
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            batch = []
+            stopping = False
+
+            # Block for the first event, then gather more until the batch
+            # is full or the flush interval has passed
+            item = self._queue.get()
+            deadline = time.time() + self.flush_interval
+
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+                if stopping or len(batch) >= self.max_batch:
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Drain whatever arrived before the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.max_batch):
+                self._flush(batch[start:start + self.max_batch])
+
+            if stopping:
+                return
+
+    def _flush(self, batch: List[Dict]):
+        """Write one batch in a single transaction (one savepoint per event)"""
+        if not batch:
+            return
+
+        start = time.time()
+        engine = self._get_engine()
+        written = failed = 0
+
+        # Resolve geo before taking the write lock (the resolver may do I/O)
+        self._resolve_geo(batch)
+
+        conn = None
+        try:
+            conn = engine._get_conn()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # One bulk write per (user, geo); a group that fails is retried
+            # event by event so one bad event can't drop its neighbours
+            groups = self._group(batch)
+            for (user_key, geo_country), events in groups.items():
+                cursor.execute("SAVEPOINT event_group")
+                try:
+                    engine.record_interactions_bulk_on_cursor(
+                        cursor, user_key, events, geo_country
+                    )
+                    cursor.execute("RELEASE SAVEPOINT event_group")
+                    written += len(events)
+                    continue
+                except Exception:
+                    cursor.execute("ROLLBACK TO SAVEPOINT event_group")
+                    cursor.execute("RELEASE SAVEPOINT event_group")
+
+                for event in events:
+                    cursor.execute("SAVEPOINT event")
+                    try:
+                        engine.record_interactions_bulk_on_cursor(
+                            cursor, user_key, [event], geo_country
+                        )
+                        cursor.execute("RELEASE SAVEPOINT event")
+                        written += 1
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT event")
+                        cursor.execute("RELEASE SAVEPOINT event")
+                        failed += 1
+                        logger.warning(f"Event queue: dropped bad event {event.get('event_type')} "
+                                       f"on {event.get('market_id')}: {e}")
+
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Event queue: flush of {len(batch)} events failed: {e}")
+            written, failed = 0, len(batch)
+            groups = {}
+        finally:
+            if conn is not None:
+                conn.close()
+
+        # Only once committed, so a rebuild can't cache the pre-event state
+        for (user_key, _), events in groups.items():
+            feed_cache.invalidate_events(user_key, [e['event_type'] for e in events])
+
+        with self._stats_lock:
+            self.written += written
+            self.failed += failed
+            self.flushes += 1
+            self.last_flush_size = len(batch)
+            self.last_flush_ms = (time.time() - start) * 1000
+
+    def _group(self, batch: List[Dict]) -> Dict[tuple, List[Dict]]:
+        """Events by (user_key, geo_country), keeping arrival order within a user"""
+        groups = {}
+        for event in batch:
+            key = (event['user_key'], event.get('geo_country'))
+            groups.setdefault(key, []).append(event)
+        return groups
+
+    def _resolve_geo(self, batch: List[Dict]):
+        """Fill geo_country from client_ip (once per distinct IP per flush)"""
+        if self.geo_resolver is None:
+            return
+
+        geo_cache = {}
+        for event in batch:
+            client_ip = event.get('client_ip')
+            if event.get('geo_country') is not None or not client_ip:
+                continue
+
+            if client_ip not in geo_cache:
+                try:
+                    geo_cache[client_ip] = self.geo_resolver(client_ip)
+                except Exception as e:
+                    logger.warning(f"Event queue: geo lookup failed for {client_ip}: {e}")
+                    geo_cache[client_ip] = 'UNKNOWN'
+            event['geo_country'] = geo_cache[client_ip]
+
+
+# Global instance
+event_queue = EventQueue()
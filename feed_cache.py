@@ -0,0 +1,518 @@
+"""
+BRain v1 - Composed Feed Cache
+Short-TTL cache of the impression-independent part of compose_feed per
+(user_key, geo_bucket): the user context, candidate pools and base scores
+(LT/ST/Trend/Fresh + "changed"). A refresh only reloads the user's
+impressions and re-applies hidden/cooldown/frequency/owned on top.
+
+An entry is dropped when:
+- it is older than FEED_CACHE_TTL seconds
+- the catalog version moved since it was built
+- the user clicked, hid or participated (tracking writers call
+  invalidate_events() after commit)
+Size is bounded by an estimate of each entry's memory, evicting LRU first.
+
+FeedSnapshotStore keeps the ranked item sequence behind a served page so
+/api/brain/feed cursors can page through it without rescoring. With
+migrations/010 snapshots live in brain.db and work on every gunicorn
+worker; without it they stay in this process's memory.
+"""
+import base64
+import json
+import logging
+import secrets
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from db_pool import db_pool
+from market_catalog import market_catalog
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# Seconds a composed ranking stays valid
+FEED_CACHE_TTL = 60
+
+# Approximate memory budget for all entries (bytes)
+FEED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Events that change what the user should see right away
+INVALIDATING_EVENTS = frozenset({'click', 'hide', 'participate'})
+
+# Invalidation marks kept for in-flight builds (pruned past this many users)
+MAX_INVALIDATION_MARKS = 10000
+
+# Seconds a ranked snapshot stays pageable after its last page
+SNAPSHOT_TTL = 15 * 60
+
+# Approximate memory budget for all snapshots (bytes)
+SNAPSHOT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class CursorExpired(Exception):
+    """A feed cursor's snapshot expired or is unknown: start again from page 1"""
+
+
+def encode_cursor(snapshot_id: str, offset: int) -> str:
+    """Opaque pagination cursor for position `offset` of a snapshot"""
+    raw = json.dumps({'s': snapshot_id, 'o': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    (snapshot_id, offset) from encode_cursor()
+    Raises: ValueError if the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        snapshot_id, offset = data['s'], data['o']
+    except (TypeError, ValueError, KeyError, AttributeError) as e:
+        raise ValueError(f"Invalid feed cursor: {e}")
+
+    if not isinstance(snapshot_id, str) or not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid feed cursor")
+    return snapshot_id, offset
+
+
+def _deep_size(value) -> int:
+    """sys.getsizeof of a value plus everything in its dicts/lists/tuples"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(v) for v in value)
+    return size
+
+
+def _estimate_size(entry: Dict) -> int:
+    """
+    Rough bytes held by one entry: the channel lists plus each candidate
+    market copy once (channels share them), scores and topic scores
+    """
+    size = sys.getsizeof(entry)
+
+    markets = {}
+    for channel_markets in entry['candidates'].values():
+        size += sys.getsizeof(channel_markets)
+        for market in channel_markets:
+            markets[id(market)] = market
+    size += sum(_deep_size(market) for market in markets.values())
+
+    base_scores = entry['base_scores']
+    size += sys.getsizeof(base_scores)
+    for base_result, (_, changed_details) in base_scores.values():
+        size += sys.getsizeof(base_result) + sys.getsizeof(base_result['components'])
+        size += sys.getsizeof(changed_details)
+
+    ctx = entry['ctx']
+    size += sys.getsizeof(ctx.topic_scores)
+    for values in ctx.topic_scores.values():
+        size += sys.getsizeof(values)
+
+    return size
+
+
+class FeedCache:
+    def __init__(self, ttl: float = FEED_CACHE_TTL, max_bytes: int = FEED_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # {(user_key, geo_bucket): (entry, size, expires_at)}, LRU order
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # {user_key: monotonic time of last invalidation}
+        self._invalidated_at: Dict[str, float] = {}
+
+        # Monitoring counters
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale_catalog = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def begin(self) -> float:
+        """Token for a build about to start (pass to put())"""
+        return time.monotonic()
+
+    def get(self, user_key: str, geo_bucket: str, catalog_version: int) -> Optional[Dict]:
+        """
+        Cached ranking for (user, geo), or None (miss)
+
+        catalog_version: current catalog version; older entries are dropped
+        """
+        key = (user_key, geo_bucket)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+
+            entry, size, expires_at = cached
+            if expires_at <= now or entry['catalog_version'] != catalog_version:
+                if expires_at <= now:
+                    self.expired += 1
+                else:
+                    self.stale_catalog += 1
+                self._drop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, user_key: str, geo_bucket: str, entry: Dict, started_at: float):
+        """
+        Store a ranking built from state read after started_at (from begin())
+
+        Skipped if the user was invalidated while it was being built, so a
+        click/hide landing mid-build can't be masked for a whole TTL
+        """
+        key = (user_key, geo_bucket)
+        size = _estimate_size(entry)
+
+        with self._lock:
+            if self._invalidated_at.get(user_key, 0.0) >= started_at or size > self.max_bytes:
+                self.rejected += 1
+                return
+
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (entry, size, time.monotonic() + self.ttl)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_key: str) -> int:
+        """Drop every cached ranking for a user; returns entries dropped"""
+        with self._lock:
+            self._mark_invalidated(user_key)
+
+            keys = [key for key in self._entries if key[0] == user_key]
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def invalidate_events(self, user_key: str, event_types: Iterable[str]) -> int:
+        """invalidate_user() if any of the user's new events is a click/hide/participate"""
+        if INVALIDATING_EVENTS.isdisjoint(event_types):
+            return 0
+        return self.invalidate_user(user_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and memory use for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'expired': self.expired,
+                'stale_catalog': self.stale_catalog,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'rejected': self.rejected
+            }
+
+    def _drop(self, key: Tuple[str, str]):
+        """Remove one entry (caller holds the lock)"""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _mark_invalidated(self, user_key: str):
+        """Remember the invalidation for builds in flight (caller holds the lock)"""
+        now = time.monotonic()
+        self._invalidated_at[user_key] = now
+
+        # Marks only matter to builds started before them; old ones can go
+        if len(self._invalidated_at) > MAX_INVALIDATION_MARKS:
+            cutoff = now - self.ttl
+            self._invalidated_at = {
+                user: ts for user, ts in self._invalidated_at.items() if ts >= cutoff
+            }
+
+
+def _dump_snapshot(snapshot: Dict) -> bytes:
+    """
+    Snapshot -> zlib'd JSON for feed_snapshots; items keep everything but
+    their market, which is re-read from the catalog by _load_snapshot()
+    """
+    sequence, pending = snapshot['sequence'], snapshot['pending']
+    first = sequence[0] if sequence else pending[0] if pending else None
+    data = {
+        'geo_bucket': snapshot['geo_bucket'],
+        'limit': snapshot['limit'],
+        'hidden_ids': sorted(snapshot['hidden_ids']),
+        'market_fields': sorted(first['market']) if first else [],
+        'sequence': [_strip_market(item) for item in sequence],
+        'pending': [_strip_market(item) for item in pending]
+    }
+    return zlib.compress(json.dumps(data, separators=(',', ':'), default=str).encode())
+
+
+def _strip_market(item: Dict) -> Dict:
+    return {key: value for key, value in item.items() if key != 'market'}
+
+
+def _load_snapshot(user_key: str, payload: bytes) -> Dict:
+    """
+    _dump_snapshot() payload -> snapshot, markets from the current catalog
+    
+    Served positions must not shift, so a sequence item whose market left
+    the catalog keeps its slot with market None (the composer skips it);
+    such pending items are dropped
+    """
+    data = json.loads(zlib.decompress(payload))
+    market_ids = {item['market_id'] for key in ('sequence', 'pending') for item in data[key]}
+    markets = {
+        market['market_id']: market for market in
+        market_catalog.get_snapshot().get_many(market_ids, data['market_fields'] or None)
+    }
+    
+    for item in data['sequence']:
+        item['market'] = markets.get(item['market_id'])
+    pending = []
+    for item in data['pending']:
+        item['market'] = markets.get(item['market_id'])
+        if item['market'] is not None:
+            pending.append(item)
+    
+    return {
+        'user_key': user_key,
+        'geo_bucket': data['geo_bucket'],
+        'limit': data['limit'],
+        'hidden_ids': set(data['hidden_ids']),
+        'sequence': data['sequence'],
+        'pending': pending
+    }
+
+
+class FeedSnapshotStore:
+    """
+    Ranked feed snapshots for cursor pagination
+
+    A snapshot is {user_key, geo_bucket, sequence, pending, ...}: `sequence`
+    is the served order so far (page 1 first); `pending` holds the remaining
+    scored items, turned into more sequence by the composer on demand.
+
+    With migrations/010 snapshots are rows of feed_snapshots, shared by
+    every worker process: get() loads one, update() writes it back after a
+    page. Without it they are kept in memory (LRU within max_bytes), and a
+    cursor reaching another worker finds nothing.
+    """
+
+    def __init__(self, ttl: float = SNAPSHOT_TTL, max_bytes: int = SNAPSHOT_MAX_BYTES,
+                 db_path: str = DB_PATH):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._has_table: Optional[bool] = None
+
+        # In-memory fallback: {snapshot_id: (snapshot, size, expires_at)}, LRU order
+        self._snapshots: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Monitoring counters
+        self.created = 0
+        self.pages = 0
+        self.missing = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _get_conn(self):
+        return db_pool.connect(self.db_path)
+
+    def _shared(self, cursor) -> bool:
+        """Whether migrations/010 is applied (checked once per process)"""
+        if self._has_table is None:
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'feed_snapshots'
+            """)
+            self._has_table = cursor.fetchone() is not None
+            if not self._has_table:
+                logger.warning("feed_snapshots missing (apply migrations/010_feed_snapshots.sql); "
+                               "feed cursors only work on the worker that issued them")
+        return self._has_table
+
+    def save(self, snapshot: Dict) -> str:
+        """Store a snapshot; returns its id"""
+        snapshot_id = secrets.token_urlsafe(9)
+        snapshot['lock'] = threading.Lock()
+
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            if self._shared(cursor):
+                now = time.time()
+                # Abandoned scrolls: expires_at is pushed back on every page
+                cursor.execute("DELETE FROM feed_snapshots WHERE expires_at <= ?", (now,))
+                expired = cursor.rowcount
+                cursor.execute("""
+                    INSERT INTO feed_snapshots (snapshot_id, user_key, payload, expires_at)
+                    VALUES (?, ?, ?, ?)
+                """, (snapshot_id, snapshot['user_key'], _dump_snapshot(snapshot), now + self.ttl))
+                conn.commit()
+                with self._lock:
+                    self.expired += expired
+                    self.created += 1
+                return snapshot_id
+        finally:
+            conn.close()
+
+        size = self._estimate_size(snapshot)
+        now = time.monotonic()
+
+        with self._lock:
+            # Every access pushes its snapshot to the end with a fresh TTL,
+            # so the expired ones (abandoned scrolls) are all at the front
+            while self._snapshots:
+                oldest, (_, _, expires_at) = next(iter(self._snapshots.items()))
+                if expires_at > now:
+                    break
+                self._drop(oldest)
+                self.expired += 1
+
+            self._snapshots[snapshot_id] = (snapshot, size, now + self.ttl)
+            self._bytes += size
+            self.created += 1
+
+            while self._bytes > self.max_bytes and len(self._snapshots) > 1:
+                oldest = next(iter(self._snapshots))
+                self._drop(oldest)
+                self.evictions += 1
+
+        return snapshot_id
+
+    def get(self, snapshot_id: str, user_key: str) -> Optional[Dict]:
+        """Snapshot for this user (None if expired, evicted or someone else's)"""
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            if self._shared(cursor):
+                cursor.execute("""
+                    SELECT user_key, payload, expires_at FROM feed_snapshots WHERE snapshot_id = ?
+                """, (snapshot_id,))
+                row = cursor.fetchone()
+                if row is None or row[2] <= time.time() or row[0] != user_key:
+                    with self._lock:
+                        self.missing += 1
+                    return None
+                snapshot = _load_snapshot(user_key, row[1])
+                snapshot['lock'] = threading.Lock()
+                with self._lock:
+                    self.pages += 1
+                return snapshot
+        finally:
+            conn.close()
+
+        now = time.monotonic()
+
+        with self._lock:
+            stored = self._snapshots.get(snapshot_id)
+            if stored is None or stored[2] <= now or stored[0]['user_key'] != user_key:
+                if stored is not None and stored[2] <= now:
+                    self._drop(snapshot_id)
+                    self.expired += 1
+                self.missing += 1
+                return None
+
+            # Paging keeps a snapshot alive
+            snapshot, size, _ = stored
+            self._snapshots[snapshot_id] = (snapshot, size, now + self.ttl)
+            self._snapshots.move_to_end(snapshot_id)
+            self.pages += 1
+            return snapshot
+
+    def update(self, snapshot_id: str, snapshot: Dict):
+        """
+        Write a snapshot back after a page was served from it (its sequence
+        may have grown) and push back its expiry; in-memory snapshots are
+        updated in place already
+        """
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            if self._shared(cursor):
+                cursor.execute("""
+                    UPDATE feed_snapshots SET payload = ?, expires_at = ? WHERE snapshot_id = ?
+                """, (_dump_snapshot(snapshot), time.time() + self.ttl, snapshot_id))
+                conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict:
+        shared = {}
+        if self._has_table:
+            conn = self._get_conn()
+            try:
+                count, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM feed_snapshots"
+                ).fetchone()
+            finally:
+                conn.close()
+            shared = {'shared_snapshots': count, 'shared_bytes': size}
+
+        with self._lock:
+            return {
+                'shared': bool(self._has_table),
+                **shared,
+                'snapshots': len(self._snapshots),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'created': self.created,
+                'pages': self.pages,
+                'missing': self.missing,
+                'expired': self.expired,
+                'evictions': self.evictions
+            }
+
+    def _drop(self, snapshot_id: str):
+        """Remove one snapshot (caller holds the lock)"""
+        _, size, _ = self._snapshots.pop(snapshot_id)
+        self._bytes -= size
+
+    def _estimate_size(self, snapshot: Dict) -> int:
+        """
+        Rough bytes: every item with its market copy, nested lists and
+        option dicts (leaf strings shared with the catalog are counted too,
+        so this errs high)
+        """
+        size = sys.getsizeof(snapshot)
+        for key in ('sequence', 'pending'):
+            items = snapshot[key]
+            size += sys.getsizeof(items) + sum(_deep_size(item) for item in items)
+        return size + sys.getsizeof(snapshot['hidden_ids'])
+
+
+# Global instances
+feed_cache = FeedCache()
+feed_snapshots = FeedSnapshotStore()
@@ -3,15 +3,27 @@ BRain v1 - Feed Composer
 Implements quota-based candidate generation and diversity post-processing
 Per Roy's spec: controls local/global balance, prevents echo chambers
 """
-import sqlite3
 import json
 import random
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict, Counter
 
+from db_pool import db_pool
+from feed_cache import CursorExpired, decode_cursor, encode_cursor, feed_cache, feed_snapshots
+from market_catalog import market_catalog
+from velocity_computer import load_velocity_rollups
+from user_context import UserContext
+
 DB_PATH = 'brain.db'
 
+# Market columns carried on candidates (tags are always included)
+CANDIDATE_FIELDS = (
+    'market_id', 'title', 'description', 'category', 'probability',
+    'volume_24h', 'volume_total', 'image_url', 'created_at',
+    'resolution_date', 'editorial_description'
+)
+
 class FeedComposer:
     def __init__(self, db_path=DB_PATH, config=None):
         self.db_path = db_path
@@ -24,10 +36,11 @@ class FeedComposer:
         self.config = config
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
     def generate_candidates(self, user_key: str, geo_bucket: str, 
-                           exclude_ids: Optional[List[str]] = None) -> Dict[str, List[Dict]]:
+                           exclude_ids: Optional[List[str]] = None,
+                           ctx: Optional[UserContext] = None) -> Dict[str, List[Dict]]:
         """
         Generate candidate pools for each channel
         
@@ -43,73 +56,28 @@ class FeedComposer:
         if exclude_ids is None:
             exclude_ids = []
         
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        
-        # Base exclusions: hidden, ended, already excluded
-        exclude_where = "status = 'open'"
-        if exclude_ids:
-            placeholders = ','.join(['?' for _ in exclude_ids])
-            exclude_where += f" AND market_id NOT IN ({placeholders})"
+        if ctx is None:
+            from brain_v1_scorer import brain_v1_scorer
+            ctx = brain_v1_scorer.build_user_context(user_key, geo_bucket)
         
         # Also exclude recently hidden markets
-        hide_days = self.config['penalties']['hide_suppression_days']
-        cutoff_hide = (datetime.now() - timedelta(days=hide_days)).isoformat()
-        
-        cursor.execute(f"""
-            SELECT market_id FROM user_market_impressions
-            WHERE user_key = ? AND last_hidden_at > ?
-        """, (user_key, cutoff_hide))
-        hidden_ids = [row[0] for row in cursor.fetchall()]
-        
-        all_exclude = exclude_ids + hidden_ids
+        all_exclude = list(exclude_ids) + list(ctx.hidden_ids)
         
-        # Fetch all candidates
+        # Fetch all candidates from the in-memory catalog (open markets by volume_total)
         pool_size = sum(self.config['candidate_pool'].values())
-        cursor.execute(f"""
-            SELECT 
-                m.market_id, m.title, m.description, m.category, m.probability,
-                m.volume_24h, m.volume_total, m.image_url, m.created_at, 
-                m.resolution_date, m.editorial_description
-            FROM markets m
-            WHERE {exclude_where}
-            ORDER BY m.volume_total DESC
-            LIMIT ?
-        """, all_exclude + [pool_size * 2])  # Get extra for filtering
-        
-        all_markets = []
-        for row in cursor.fetchall():
-            market = {
-                'market_id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'category': row[3],
-                'probability': row[4],
-                'volume_24h': row[5],
-                'volume_total': row[6],
-                'image_url': row[7],
-                'created_at': row[8],
-                'resolution_date': row[9],
-                'editorial_description': row[10],
-                'tags': []
-            }
-            
-            # Fetch tags
-            cursor.execute("""
-                SELECT tag FROM market_tags WHERE market_id = ? ORDER BY tag
-            """, (market['market_id'],))
-            market['tags'] = [t[0] for t in cursor.fetchall()]
-            
-            all_markets.append(market)
-        
-        conn.close()
+        all_markets = market_catalog.get_snapshot().open_markets(
+            order_by='volume_total',
+            limit=pool_size * 2,  # Get extra for filtering
+            exclude_ids=all_exclude,
+            fields=CANDIDATE_FIELDS
+        )
         
         # Now partition into channels
         candidates = {}
         
         # 1. Personal candidates (120)
         candidates['personal'] = self._get_personal_candidates(
-            all_markets, user_key, self.config['candidate_pool']['personal']
+            all_markets, ctx, self.config['candidate_pool']['personal']
         )
         
         # 2. Trending global (80)
@@ -134,7 +102,7 @@ class FeedComposer:
         
         return candidates
     
-    def _get_personal_candidates(self, markets: List[Dict], user_key: str, limit: int) -> List[Dict]:
+    def _get_personal_candidates(self, markets: List[Dict], ctx: UserContext, limit: int) -> List[Dict]:
         """Get candidates by LT + ST similarity with category diversity"""
         from brain_v1_scorer import brain_v1_scorer
         from collections import Counter
@@ -142,8 +110,7 @@ class FeedComposer:
         # Score by LT + ST only (no penalties yet)
         scored = []
         for market in markets:
-            lt_score = brain_v1_scorer.calculate_lt_score(market, user_key)
-            st_score = brain_v1_scorer.calculate_st_score(market, user_key)
+            lt_score, st_score = brain_v1_scorer.calculate_relevance(market, ctx)
             relevance = 0.6 * lt_score + 0.4 * st_score
             scored.append((relevance, market))
         
@@ -172,16 +139,14 @@ class FeedComposer:
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        # Get velocity data
+        # Velocity data for the whole pool in one query
+        rows = load_velocity_rollups(cursor, [m['market_id'] for m in markets], geo_bucket)
+        
+        conn.close()
+        
         market_velocities = {}
         for market in markets:
-            cursor.execute("""
-                SELECT trades_1h, views_1h
-                FROM market_velocity_rollups
-                WHERE market_id = ? AND geo_bucket = ?
-            """, (market['market_id'], geo_bucket))
-            
-            row = cursor.fetchone()
+            row = rows.get((market['market_id'], geo_bucket))
             if row:
                 trades = row[0] or 0
                 views = row[1] or 0
@@ -189,8 +154,6 @@ class FeedComposer:
                 velocity = 0.7 * trades + 0.3 * views
                 market_velocities[market['market_id']] = velocity
         
-        conn.close()
-        
         # Sort by velocity
         scored = [(market_velocities.get(m['market_id'], 0), m) for m in markets]
         scored.sort(key=lambda x: x[0], reverse=True)
@@ -280,31 +243,69 @@ class FeedComposer:
     
     def compose_feed(self, user_key: str, geo_bucket: str, limit: int = 30,
                     exclude_ids: Optional[List[str]] = None, 
-                    debug: bool = False) -> Dict:
+                    debug: bool = False, cursor: Optional[str] = None,
+                    paginate: bool = False) -> Dict:
         """
         Main feed composition with quotas + diversity
         
+        cursor: meta.cursor_next of a previous page; the next page comes from
+        that page's stored ranking (no rescoring).
+        Raises ValueError for a malformed cursor, CursorExpired if its
+        snapshot is gone (a fresh page 1 could repeat what the client has).
+        paginate: store the rest of the ranking and return meta.cursor_next;
+        off for server renders, which never page
+        
         Returns: {items: [...], meta: {...}}
         """
         from brain_v1_scorer import brain_v1_scorer
-        from impression_tracker import impression_tracker
         
-        # 1. Generate candidates
-        candidates = self.generate_candidates(user_key, geo_bucket, exclude_ids)
+        if cursor:
+            snapshot_id, offset = decode_cursor(cursor)
+            snapshot = feed_snapshots.get(snapshot_id, user_key)
+            if snapshot is None:
+                raise CursorExpired("Feed cursor expired; request page 1 again")
+            return self._page_from_snapshot(snapshot_id, snapshot, offset, limit, exclude_ids)
+        
+        # 1. Candidate pools + impression-independent scores: cached per
+        #    (user, geo), otherwise load user state, generate and score once
+        ranking, ctx = self._get_ranking(user_key, geo_bucket)
+        candidates = ranking['candidates']
+        base_scores = ranking['base_scores']
+        
+        if exclude_ids:
+            exclude = set(exclude_ids)
+            pool_ids = {m['market_id'] for channel_markets in candidates.values()
+                        for m in channel_markets}
+            candidates = {
+                channel: [m for m in channel_markets if m['market_id'] not in exclude]
+                for channel, channel_markets in candidates.items()
+            }
+            
+            # The cached pool was cut before exclusions: if they ate into it,
+            # regenerate with them so the next markets backfill (not cached)
+            remaining = pool_ids - exclude - ctx.hidden_ids
+            if len(remaining) < limit * 2 and not exclude.isdisjoint(pool_ids):
+                candidates, base_scores = self._refill_candidates(
+                    user_key, geo_bucket, exclude_ids, ctx, base_scores
+                )
         
         # 2. Allocate quotas
         quotas = self.allocate_quotas(limit)
         
-        # 3. Get impression data for all candidates (batch)
-        all_candidate_ids = []
+        # 3. Hidden/cooldown/frequency/owned from the latest impressions
+        scores = {}
         for channel_markets in candidates.values():
-            all_candidate_ids.extend([m['market_id'] for m in channel_markets])
-        
-        impression_data = impression_tracker.get_impression_data(user_key, all_candidate_ids)
-        
-        # 4. Score and rank each channel
+            for market in channel_markets:
+                market_id = market['market_id']
+                if market_id not in scores:
+                    scores[market_id] = brain_v1_scorer.adjust_with_context(
+                        market, base_scores[market_id], ctx
+                    )
+        
+        # 4. Rank each channel
         channel_items = {}
         quotas_used = {}
+        all_scored = {}  # every eligible item, for later pages
         
         for channel, channel_candidates in candidates.items():
             quota = quotas.get(channel, 0)
@@ -312,10 +313,8 @@ class FeedComposer:
             # Score all candidates in this channel
             scored = []
             for market in channel_candidates:
-                imp_data = impression_data.get(market['market_id'])
-                score_result = brain_v1_scorer.calculate_final_score(
-                    market, user_key, geo_bucket, imp_data
-                )
+                imp_data = ctx.impression(market['market_id'])
+                score_result = scores[market['market_id']]
                 
                 # Skip if hidden or scored too low
                 if score_result['score'] < 0.01:
@@ -339,6 +338,7 @@ class FeedComposer:
                     }
                 
                 scored.append(item)
+                all_scored.setdefault(market['market_id'], item)
             
             # Sort by score and take top N per quota
             scored.sort(key=lambda x: x['score'], reverse=True)
@@ -358,20 +358,176 @@ class FeedComposer:
         merged.sort(key=lambda x: x['score'], reverse=True)
         
         # 6. Apply diversity post-processing
-        final_items = self._apply_diversity(merged[:limit * 2], limit)  # Get extra for diversity filtering
+        final_items = self._apply_diversity(merged[:limit * 2], limit, ctx)  # Get extra for diversity filtering
+        
+        page = final_items[:limit]
         
-        # 7. Build response
+        # 7. Snapshot the rest of the ranking for cursor pagination
+        cursor_next = None
+        if paginate and page:
+            page_ids = {item['market_id'] for item in page}
+            pending = [item for market_id, item in all_scored.items() if market_id not in page_ids]
+            pending.sort(key=lambda x: x['score'], reverse=True)
+            
+            if pending:
+                snapshot_id = feed_snapshots.save({
+                    'user_key': user_key,
+                    'geo_bucket': geo_bucket,
+                    'limit': limit,
+                    'hidden_ids': ctx.hidden_ids,
+                    'sequence': list(page),
+                    'pending': pending
+                })
+                cursor_next = encode_cursor(snapshot_id, len(page))
+        
+        # 8. Build response
         return {
-            'items': final_items[:limit],
+            'items': page,
             'meta': {
                 'geo_bucket': geo_bucket,
                 'quotas_used': quotas_used,
                 'exploration_rate': quotas.get('exploration', 0) / limit if limit > 0 else 0,
-                'cursor_next': None  # For pagination (future)
+                'cursor_next': cursor_next
             }
         }
     
-    def _apply_diversity(self, items: List[Dict], limit: int) -> List[Dict]:
+    def _page_from_snapshot(self, snapshot_id: str, snapshot: Dict, offset: int,
+                            limit: int, exclude_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Next page of a stored ranking, starting at `offset` of its sequence
+        
+        Items in exclude_ids are skipped (not re-served later either), so a
+        client can pass what it already has without losing its place; so are
+        items whose market left the catalog since the snapshot was stored
+        """
+        exclude = set(exclude_ids or ())
+        items = []
+        
+        with snapshot['lock']:
+            sequence = snapshot['sequence']
+            position = offset
+            
+            while len(items) < limit:
+                if position >= len(sequence) and not self._extend_snapshot(snapshot):
+                    break
+                item = sequence[position]
+                position += 1
+                if item['market_id'] not in exclude and item['market'] is not None:
+                    items.append(item)
+            
+            has_more = position < len(sequence) or bool(snapshot['pending'])
+        
+        feed_snapshots.update(snapshot_id, snapshot)
+        
+        channels = Counter(item['channel'] for item in items)
+        
+        return {
+            'items': items,
+            'meta': {
+                'geo_bucket': snapshot['geo_bucket'],
+                'quotas_used': dict(channels),
+                'exploration_rate': channels['exploration'] / len(items) if items else 0,
+                'cursor_next': encode_cursor(snapshot_id, position) if has_more else None
+            }
+        }
+    
+    def _extend_snapshot(self, snapshot: Dict) -> bool:
+        """
+        Append one more diversified page from snapshot['pending'] to its
+        sequence (caller holds snapshot['lock']); False when exhausted
+        """
+        pending = snapshot['pending']
+        if not pending:
+            return False
+        
+        limit = snapshot['limit']
+        ctx = UserContext(snapshot['user_key'], snapshot['geo_bucket'], False, {}, None,
+                          {}, snapshot['hidden_ids'])
+        page = self._apply_diversity(pending[:limit * 2], limit, ctx)
+        
+        if not page:
+            # Diversity rules can't place anything more: serve the rest by score
+            page = [item for item in pending if item['market_id'] not in snapshot['hidden_ids']]
+            pending.clear()
+        else:
+            placed = {item['market_id'] for item in page}
+            pending[:] = [item for item in pending if item['market_id'] not in placed]
+        
+        snapshot['sequence'].extend(page)
+        return bool(page)
+    
+    def _get_ranking(self, user_key: str, geo_bucket: str) -> Tuple[Dict, UserContext]:
+        """
+        Candidate pools + base scores for (user, geo), from feed_cache if fresh
+        
+        Returns: ({ctx, candidates, base_scores, catalog_version}, ctx with
+        this request's impressions)
+        """
+        from brain_v1_scorer import brain_v1_scorer
+        from impression_tracker import impression_tracker
+        
+        catalog_version = market_catalog.get_snapshot().version
+        
+        ranking = feed_cache.get(user_key, geo_bucket, catalog_version)
+        if ranking is not None:
+            impressions = impression_tracker.get_user_impressions(user_key)
+            ctx = ranking['ctx'].with_impressions(
+                impressions, brain_v1_scorer.hidden_market_ids(impressions)
+            )
+            return ranking, ctx
+        
+        started_at = feed_cache.begin()
+        
+        # Load user state once (new/known, LT scores, session, impressions, hidden)
+        ctx = brain_v1_scorer.build_user_context(user_key, geo_bucket)
+        
+        # Generate candidates (exclude_ids are applied per request, not cached)
+        candidates = self.generate_candidates(user_key, geo_bucket, None, ctx)
+        
+        # Score every unique candidate once (markets repeat across channels)
+        unique_candidates = {}
+        for channel_markets in candidates.values():
+            for market in channel_markets:
+                unique_candidates.setdefault(market['market_id'], market)
+        
+        ranking = {
+            'ctx': ctx.with_impressions({}, set()),  # impressions are reloaded per hit
+            'candidates': candidates,
+            'base_scores': brain_v1_scorer.base_scores_with_context(
+                list(unique_candidates.values()), ctx
+            ),
+            'catalog_version': catalog_version
+        }
+        feed_cache.put(user_key, geo_bucket, ranking, started_at)
+        
+        return ranking, ctx
+    
+    def _refill_candidates(self, user_key: str, geo_bucket: str, exclude_ids: List[str],
+                           ctx: UserContext, base_scores: Dict) -> Tuple[Dict, Dict]:
+        """
+        Candidate pools generated with exclude_ids applied before the pool
+        limit, plus base scores for markets the cached ranking didn't score
+        
+        Returns: (candidates, base_scores)
+        """
+        from brain_v1_scorer import brain_v1_scorer
+        
+        candidates = self.generate_candidates(user_key, geo_bucket, exclude_ids, ctx)
+        
+        unscored = {}
+        for channel_markets in candidates.values():
+            for market in channel_markets:
+                if market['market_id'] not in base_scores:
+                    unscored.setdefault(market['market_id'], market)
+        
+        if unscored:
+            base_scores = dict(base_scores)
+            base_scores.update(brain_v1_scorer.base_scores_with_context(list(unscored.values()), ctx))
+        
+        return candidates, base_scores
+    
+    def _apply_diversity(self, items: List[Dict], limit: int,
+                         ctx: Optional[UserContext] = None) -> List[Dict]:
         """
         Apply diversity guardrails with category interleaving
         
@@ -381,9 +537,13 @@ class FeedComposer:
         3. Max 25% from same tag cluster (top tag)
         
         Strategy: Interleave categories to spread diversity throughout feed
+        Markets the user hid (ctx.hidden_ids) are never placed, even by the fallbacks
         
         Returns: diversified list
         """
+        if ctx is not None and ctx.hidden_ids:
+            items = [item for item in items if item['market_id'] not in ctx.hidden_ids]
+        
         if not items:
             return []
         
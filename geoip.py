@@ -0,0 +1,218 @@
+"""
+BRain - Offline Geo-IP Lookup
+IP -> ISO country code from a local range database, no network calls
+
+geoip.dat (built by import_geoip.py from CSV range dumps) holds sorted,
+non-overlapping [start, end] ranges as fixed-size big-endian records, so a
+lookup is a binary search over the memory-mapped file (pages are shared by
+every gunicorn worker through the OS page cache). A bounded LRU sits in front.
+The file is re-mapped when import_geoip.py replaces it.
+
+File layout:
+    header:  MAGIC (8 bytes) + <II (IPv4 range count, IPv6 range count)
+    IPv4:    start (4 bytes BE) + end (4 bytes BE) + country (2 bytes ASCII)
+    IPv6:    start (16 bytes BE) + end (16 bytes BE) + country (2 bytes ASCII)
+"""
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import GEOIP_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CURGEO1\x00'
+HEADER = struct.Struct('<II')
+HEADER_SIZE = len(MAGIC) + HEADER.size
+
+# Bytes per address / per record, by IP version
+ADDRESS_WIDTH = {4: 4, 6: 16}
+RECORD_SIZE = {4: 4 + 4 + 2, 6: 16 + 16 + 2}
+
+# Cached lookups per process
+GEO_LRU_SIZE = 65536
+
+# How often (seconds) a lookup may stat the file for a replacement
+RELOAD_CHECK_INTERVAL = 60
+
+
+def build_database(ranges: Iterable[Tuple[int, int, int, str]], path: str = GEOIP_DB_PATH) -> Dict:
+    """
+    Write a geo database file from (version, start, end, country) ranges
+
+    Ranges are sorted, overlaps trimmed (earlier start wins) and adjacent
+    ranges of the same country merged. The file is written next to `path`
+    and renamed over it, so running workers never see a partial file.
+
+    Returns: {'ipv4': range count, 'ipv6': range count}
+    """
+    tables = {4: [], 6: []}
+    for version, start, end, country in sorted(ranges):
+        table = tables[version]
+        if table:
+            last = table[-1]
+            if start <= last[1]:
+                # Overlap: keep the earlier range, trim this one
+                if end <= last[1]:
+                    continue
+                start = last[1] + 1
+            if start == last[1] + 1 and country == last[2]:
+                last[1] = end
+                continue
+        table.append([start, end, country])
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(tables[4]), len(tables[6])))
+        for version in (4, 6):
+            width = ADDRESS_WIDTH[version]
+            for start, end, country in tables[version]:
+                f.write(start.to_bytes(width, 'big'))
+                f.write(end.to_bytes(width, 'big'))
+                f.write(country.encode('ascii'))
+    os.replace(tmp_path, path)
+
+    return {'ipv4': len(tables[4]), 'ipv6': len(tables[6])}
+
+
+class GeoIPDatabase:
+    def __init__(self, path: str = GEOIP_DB_PATH, cache_size: int = GEO_LRU_SIZE):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._mm: Optional[mmap.mmap] = None
+        self._tables: Dict[int, Tuple[int, int]] = {}  # {version: (offset, count)}
+        self._file_id = None
+        self._next_check = 0.0
+        self._missing_logged = False
+
+        self._cached_lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """Country code for an IPv4/IPv6 address (None if unknown or invalid)"""
+        if time.time() >= self._next_check:
+            self._maybe_reload()
+        return self._cached_lookup(ip_address)
+
+    @property
+    def loaded(self) -> bool:
+        """Whether a database file is mapped (checks for a new one when due)"""
+        if time.time() >= self._next_check:
+            self._maybe_reload()
+        return self._mm is not None
+
+    def _lookup(self, ip_address: str) -> Optional[str]:
+        mm, tables = self._mm, self._tables
+        if mm is None:
+            return None
+
+        try:
+            address = ipaddress.ip_address(ip_address.strip())
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        table = tables.get(address.version)
+        if not table:
+            return None
+        offset, count = table
+        width = ADDRESS_WIDTH[address.version]
+        record = RECORD_SIZE[address.version]
+        key = address.packed
+
+        # Last range whose start <= key (big-endian bytes compare as numbers)
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = offset + mid * record
+            if mm[pos:pos + width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        pos = offset + (lo - 1) * record
+        if key > mm[pos + width:pos + 2 * width]:
+            return None
+        return mm[pos + 2 * width:pos + 2 * width + 2].decode('ascii')
+
+    def _maybe_reload(self):
+        """(Re)map the file if it appeared or was replaced since the last check"""
+        with self._lock:
+            now = time.time()
+            if now < self._next_check:
+                return
+            self._next_check = now + RELOAD_CHECK_INTERVAL
+
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                if not self._missing_logged:
+                    logger.error(f"Geo-IP database {self.path} not found; run import_geoip.py "
+                                 f"(until then every lookup misses, with no network fallback)")
+                    self._missing_logged = True
+                return
+
+            file_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if file_id == self._file_id:
+                return
+
+            try:
+                mm, tables = self._map(self.path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Geo-IP database {self.path} unreadable: {e}")
+                return
+
+            # Old map is released once in-flight lookups drop their reference
+            self._mm, self._tables = mm, tables
+            self._file_id = file_id
+            self._missing_logged = False
+            self._cached_lookup.cache_clear()
+            logger.info(f"Geo-IP database loaded: {tables[4][1]} IPv4 / "
+                        f"{tables[6][1]} IPv6 ranges")
+
+    def _map(self, path: str) -> Tuple[mmap.mmap, Dict[int, Tuple[int, int]]]:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mm) < HEADER_SIZE or mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            raise ValueError("not a geo-IP database file")
+
+        count4, count6 = HEADER.unpack_from(mm, len(MAGIC))
+        offset6 = HEADER_SIZE + count4 * RECORD_SIZE[4]
+        if len(mm) != offset6 + count6 * RECORD_SIZE[6]:
+            mm.close()
+            raise ValueError("truncated geo-IP database file")
+
+        return mm, {4: (HEADER_SIZE, count4), 6: (offset6, count6)}
+
+    def stats(self) -> Dict:
+        """Range counts and LRU hit rate for monitoring"""
+        info = self._cached_lookup.cache_info()
+        lookups = info.hits + info.misses
+        tables = self._tables
+        return {
+            'path': self.path,
+            'loaded': self._mm is not None,
+            'ipv4_ranges': tables[4][1] if tables else 0,
+            'ipv6_ranges': tables[6][1] if tables else 0,
+            'cache_size': info.currsize,
+            'cache_max': info.maxsize,
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            'hit_rate': round(info.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global instance
+geoip = GeoIPDatabase()
@@ -0,0 +1,200 @@
+"""
+BRain - Precomputed Homepage Layout
+Hero / grid / stream for the anonymous homepage, built once per catalog
+snapshot instead of on every request
+
+A background thread watches the market catalog and rebuilds the layout when
+a new snapshot appears (market data changed). Requests get the current
+HomepageLayout from memory, including its pre-serialized JSON body and an
+ETag, so /api/homepage never touches SQLite or re-ranks markets.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from brain_algorithm import calculate_belief_intensity
+from market_catalog import market_catalog
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) the refresher checks the catalog for new market data
+LAYOUT_REFRESH_INTERVAL = 2.0
+
+# Slots (hero = first market, grid = next GRID_COUNT, stream = the rest)
+GRID_COUNT = 12
+STREAM_END = 40
+
+# Hero is the top market from these categories, if any (Roy's feedback)
+VISUAL_CATEGORIES = ('Sports', 'Entertainment', 'Technology', 'Crypto')
+
+# Options shown on multi-option cards
+TOP_OPTIONS = 5
+
+
+class HomepageLayout:
+    """
+    One materialized homepage (hero/grid/stream are shared by requests: read
+    them through as_dict() to get copies)
+    """
+
+    def __init__(self, catalog_version: int, hero: List[Dict], grid: List[Dict],
+                 stream: List[Dict]):
+        self.catalog_version = catalog_version
+        self.hero = hero
+        self.grid = grid
+        self.stream = stream
+        self.built_at = time.time()
+
+        self.body = json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'),
+                               default=str).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+    def as_dict(self) -> Dict[str, List[Dict]]:
+        """hero / grid / stream with copied market dicts, safe for callers to edit"""
+        return {
+            'hero': [dict(m) for m in self.hero],
+            'grid': [dict(m) for m in self.grid],
+            'stream': [dict(m) for m in self.stream]
+        }
+
+
+def build_layout(snapshot) -> HomepageLayout:
+    """Rank open markets by belief intensity and fill hero / grid / stream"""
+    markets = snapshot.open_markets(order_by=None)
+
+    for market in markets:
+        market['belief_intensity'] = calculate_belief_intensity(market)
+        options = market.pop('options')
+        market.pop('taxonomy')
+
+        # Add options if multi-option market
+        if market.get('market_type') == 'multiple' and options:
+            market['top_options'] = [
+                {
+                    'market_id': market['market_id'],
+                    'option_id': opt['option_id'],
+                    'option_text': opt['option_text'],
+                    'probability': opt['probability']
+                }
+                for opt in options[:TOP_OPTIONS]
+            ]
+
+    # Sort by belief intensity (stable: ties keep catalog order)
+    markets.sort(key=lambda x: x['belief_intensity'], reverse=True)
+
+    # Hero: highest-belief-intensity visual market
+    hero_index = next(
+        (i for i, m in enumerate(markets) if m['category'] in VISUAL_CATEGORIES), None
+    )
+    if hero_index:
+        markets.insert(0, markets.pop(hero_index))
+
+    # ALWAYS ensure at least one multi-option market in hero or grid (for testing)
+    if len(markets) > 9 and not any(m.get('market_type') == 'multiple' for m in markets[:9]):
+        multi_index = next(
+            (i for i in range(9, len(markets)) if markets[i].get('market_type') == 'multiple'), None
+        )
+        if multi_index is not None:
+            # Move it to position 8 (last slot of the original 3x3 grid)
+            markets.insert(8, markets.pop(multi_index))
+
+    if markets:
+        logger.info(f"🎨 Homepage layout v{snapshot.version}: hero {markets[0]['title'][:40]} "
+                    f"({markets[0]['category']}), {len(markets)} open markets")
+
+    return HomepageLayout(
+        snapshot.version,
+        hero=markets[0:1],
+        grid=markets[1:1 + GRID_COUNT],
+        stream=markets[1 + GRID_COUNT:STREAM_END]
+    )
+
+
+class HomepageLayoutCache:
+    def __init__(self, catalog=market_catalog, refresh_interval: float = LAYOUT_REFRESH_INTERVAL):
+        self.catalog = catalog
+        self.refresh_interval = refresh_interval
+
+        self._layout: Optional[HomepageLayout] = None
+        self._snapshot = None  # catalog snapshot the layout was built from
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Monitoring counters
+        self.builds = 0
+        self.last_build_ms = 0.0
+
+    def get(self) -> HomepageLayout:
+        """
+        Current layout
+
+        Built inline on first use, and checked inline if the refresher isn't
+        running (e.g. a forked worker); otherwise pure memory access.
+        """
+        layout = self._layout
+        if layout is None or not self.running:
+            self.refresh(block=layout is None)
+            layout = self._layout
+        return layout
+
+    def refresh(self, block: bool = True):
+        """Rebuild if the catalog has a newer snapshot than the layout"""
+        if not self._lock.acquire(blocking=block):
+            return  # another thread is already refreshing
+        try:
+            snapshot = self.catalog.get_snapshot(max_staleness=self.refresh_interval)
+            if snapshot is self._snapshot and self._layout is not None:
+                return
+
+            start = time.time()
+            self._layout = build_layout(snapshot)
+            self._snapshot = snapshot
+            self.builds += 1
+            self.last_build_ms = (time.time() - start) * 1000
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """Start the background refresher (idempotent)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='homepage-layout', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Homepage layout refresh failed: {e}", exc_info=True)
+            self._stop.wait(self.refresh_interval)
+
+    def stats(self) -> Dict:
+        """Layout version, age and build cost for monitoring"""
+        layout = self._layout
+        return {
+            'running': self.running,
+            'built': layout is not None,
+            'catalog_version': layout.catalog_version if layout else None,
+            'etag': layout.etag if layout else None,
+            'age_seconds': round(time.time() - layout.built_at, 3) if layout else None,
+            'bytes': len(layout.body) if layout else 0,
+            'builds': self.builds,
+            'last_build_ms': round(self.last_build_ms, 2)
+        }
+
+
+# Global instance
+homepage_layout = HomepageLayoutCache()
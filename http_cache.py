@@ -0,0 +1,256 @@
+"""
+BRain - HTTP Caching
+ETags, conditional GET, Cache-Control and compression for the JSON APIs
+
+- @cached(validator, max_age) on the hot public endpoints: the ETag comes
+  from a cheap version (catalog / trending rollups) plus the request URL, so
+  a matching If-None-Match is answered with 304 before the view touches
+  SQLite or re-serializes anything
+- every other GET under /api/ gets a content-hash ETag (a 304 still saves
+  the transfer) and `private, no-cache` unless the view set Cache-Control
+- text/JSON bodies above COMPRESS_MIN_BYTES are sent br (when the optional
+  brotli package is installed) or gzip, per Accept-Encoding. Each encoding
+  has its own strong ETag ("<tag>-gzip"), and encoded bodies are cached
+  per ETag so an unchanged payload is compressed once
+
+init_app(app) installs the response hook (covers blueprints too).
+"""
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import current_app, request
+
+from market_catalog import market_catalog
+from velocity_computer import velocity_computer
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Smaller bodies aren't worth the CPU (and barely shrink)
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json', 'text/html', 'text/plain', 'text/css',
+    'text/javascript', 'application/javascript'
+})
+
+# Encoded bodies kept, keyed by (etag, encoding)
+ENCODED_CACHE_SIZE = 256
+
+# GET /api/* without an explicit policy: revalidate every time
+DEFAULT_API_CACHE_CONTROL = 'private, no-cache'
+
+_ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def catalog_validator() -> Optional[str]:
+    """Catalog snapshot version (None on an unversioned DB)"""
+    version = market_catalog.version()
+    return None if version is None else f'catalog:{version}'
+
+
+def trending_validator() -> Optional[str]:
+    """Velocity rollup tick + catalog version (trending rows carry titles)"""
+    catalog = catalog_validator()
+    rollups = velocity_computer.rollup_version()
+    if catalog is None or rollups is None:
+        return None
+    return f'{catalog}|rollups:{rollups}'
+
+
+def _tag(*parts) -> str:
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:20]
+
+
+def _variants(tag: str):
+    return [tag] + [f'{tag}-{encoding}' for encoding in _ENCODINGS]
+
+
+def _negotiate() -> Optional[str]:
+    """Best encoding the client accepts (br preferred on equal q), or None"""
+    accept = request.accept_encodings
+    best, best_q = None, 0.0
+    for encoding in _ENCODINGS:
+        q = accept.quality(encoding)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class HttpCache:
+    def __init__(self):
+        self._encoded: 'OrderedDict[tuple, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Monitoring counters
+        self.not_modified = 0
+        self.short_circuited = 0
+        self.compressed = 0
+        self.encoded_cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        app.after_request(self._finalize)
+
+    def cached(self, validator: Optional[Callable[[], Optional[str]]] = None,
+               max_age: int = 10):
+        """
+        Public, version-validated GET endpoint
+
+        validator: returns a version string the response is a pure function
+        of (together with the URL), or None to fall back to a content hash
+        """
+        cache_control = f'public, max-age={max_age}'
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(*args, **kwargs)
+
+                tag = None
+                if validator is not None:
+                    try:
+                        version = validator()
+                    except Exception as e:
+                        logger.warning(f"ETag validator failed for {request.path}: {e}")
+                        version = None
+                    if version is not None:
+                        tag = _tag(request.full_path, version)
+                        matched = self._matching(tag)
+                        if matched:
+                            self.short_circuited += 1
+                            return self._not_modified(matched, cache_control)
+
+                response = view(*args, **kwargs)
+                if not hasattr(response, 'headers'):
+                    return response  # (body, status) tuples: errors, left as is
+
+                if response.status_code == 200:
+                    if tag is not None:
+                        response.set_etag(tag)
+                    if 'Cache-Control' not in response.headers:
+                        response.headers['Cache-Control'] = cache_control
+                return response
+            return wrapper
+        return decorator
+
+    def _matching(self, tag: str) -> Optional[str]:
+        """The variant of `tag` named in If-None-Match, if any"""
+        if_none_match = request.if_none_match
+        if not if_none_match:
+            return None
+        if if_none_match.star_tag:
+            return tag
+        for variant in _variants(tag):
+            if if_none_match.contains_weak(variant):
+                return variant
+        return None
+
+    def _not_modified(self, etag: str, cache_control: Optional[str]):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept-Encoding')
+        self.not_modified += 1
+        return response
+
+    def _finalize(self, response):
+        """after_request: default validators/policy for GET /api/*, then compress"""
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+
+        body = response.get_data()
+        is_api_read = request.method in ('GET', 'HEAD') and request.path.startswith('/api/')
+
+        if is_api_read:
+            tag, _ = response.get_etag()
+            if tag is None:
+                tag = hashlib.sha1(body).hexdigest()[:20]
+                response.set_etag(tag)
+            if 'Cache-Control' not in response.headers:
+                response.headers['Cache-Control'] = DEFAULT_API_CACHE_CONTROL
+            matched = self._matching(tag)
+            if matched:
+                # In place, so headers other hooks added (CORS) survive
+                response.status_code = 304
+                response.set_data(b'')
+                response.set_etag(matched)
+                response.vary.add('Accept-Encoding')
+                self.not_modified += 1
+                return response
+
+        if len(body) < COMPRESS_MIN_BYTES or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _negotiate()
+        if encoding is None:
+            return response
+
+        tag, _ = response.get_etag()
+        encoded = self._encoded_body(tag, body, encoding)
+        response.set_data(encoded)
+        response.headers['Content-Encoding'] = encoding
+        if tag is not None:
+            response.set_etag(f'{tag}-{encoding}')
+        return response
+
+    def _encoded_body(self, tag: Optional[str], body: bytes, encoding: str) -> bytes:
+        key = (tag, encoding)
+        if tag is not None:
+            with self._lock:
+                encoded = self._encoded.get(key)
+                if encoded is not None:
+                    self._encoded.move_to_end(key)
+                    self.encoded_cache_hits += 1
+                    return encoded
+
+        encoded = _encode(body, encoding)
+        self.compressed += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(encoded)
+
+        if tag is not None:
+            with self._lock:
+                self._encoded[key] = encoded
+                while len(self._encoded) > ENCODED_CACHE_SIZE:
+                    self._encoded.popitem(last=False)
+        return encoded
+
+    def stats(self) -> Dict:
+        """304s, compression ratio and encoded-body cache use for monitoring"""
+        return {
+            'encodings': list(_ENCODINGS),
+            'not_modified': self.not_modified,
+            'short_circuited': self.short_circuited,
+            'compressed': self.compressed,
+            'encoded_cache_hits': self.encoded_cache_hits,
+            'encoded_cache_size': len(self._encoded),
+            'compression_ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None
+        }
+
+
+# Global instance
+http_cache = HttpCache()
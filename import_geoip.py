@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Build the offline geo-IP database (geoip.dat) from CSV range dumps
+
+Usage:
+    python3 import_geoip.py <ranges.csv> [<ranges.csv> ...]
+
+Accepted row formats (header rows and blank/reserved countries are skipped):
+    start_ip,end_ip,country[,...]      DB-IP / ipinfo country CSV
+    ip_from,ip_to,country[,...]        IP2Location LITE DB1 (integer addresses)
+    network,country[,...]              CIDR per row (e.g. 1.0.0.0/24,AU)
+IPv4 and IPv6 rows can be mixed. The new file replaces the old one
+atomically; running app processes pick it up within a minute.
+"""
+import csv
+import ipaddress
+import sys
+import time
+
+from config import GEOIP_DB_PATH
+from geoip import build_database
+
+# Placeholders used by the dumps for "no country"
+SKIP_COUNTRIES = {'', '-', 'ZZ', 'XX'}
+
+
+def _parse_address(value: str):
+    """ipaddress object from dotted/colon notation or a plain integer"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return ipaddress.IPv4Address(number) if number <= 0xFFFFFFFF else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+def parse_row(row):
+    """(version, start, end, country) for one CSV row, or None to skip it"""
+    if not row:
+        return None
+
+    if '/' in row[0]:
+        network = ipaddress.ip_network(row[0].strip(), strict=False)
+        start, end = network.network_address, network.broadcast_address
+        country = row[1] if len(row) > 1 else ''
+    else:
+        if len(row) < 3:
+            return None
+        start, end = _parse_address(row[0]), _parse_address(row[1])
+        country = row[2]
+
+    country = country.strip().upper()
+    if country in SKIP_COUNTRIES or len(country) != 2 or not country.isalpha():
+        return None
+    if start.version != end.version or int(end) < int(start):
+        return None
+
+    return start.version, int(start), int(end), country
+
+
+def load_ranges(path: str):
+    """All ranges in one CSV file; returns (ranges, skipped rows)"""
+    ranges = []
+    skipped = 0
+
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_no, row in enumerate(csv.reader(f), 1):
+            try:
+                parsed = parse_row(row)
+            except ValueError:
+                # Header line, comments or garbage
+                parsed = None
+            if parsed is None:
+                skipped += 1
+                continue
+            ranges.append(parsed)
+
+    return ranges, skipped
+
+
+def main(paths):
+    start = time.time()
+    ranges = []
+
+    for path in paths:
+        file_ranges, skipped = load_ranges(path)
+        ranges.extend(file_ranges)
+        print(f"📥 {path}: {len(file_ranges)} ranges ({skipped} rows skipped)")
+
+    if not ranges:
+        print("❌ No ranges found; geo database not written")
+        return 1
+
+    counts = build_database(ranges, GEOIP_DB_PATH)
+    print(f"✅ Wrote {GEOIP_DB_PATH}: {counts['ipv4']} IPv4 + {counts['ipv6']} IPv6 ranges "
+          f"in {time.time() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+    sys.exit(main(sys.argv[1:]))
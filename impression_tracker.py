@@ -1,20 +1,168 @@
 """
 BRain v1 - Impression Tracker
 Handles impression logging with frequency caps and cooldown tracking
+
+Impressions are written in bulk (one executemany per table) and deduped: a
+market shown again to the same user within DEDUPE_WINDOW is not counted
+again, so quick refreshes don't inflate impressions_24h or velocity views.
+log_impressions_async() takes the write off the request path: a writer
+thread merges everything queued within FLUSH_INTERVAL into one transaction.
+
+impressions_24h / impressions_7d come from a per-(user, market) ring of
+hourly counts (migrations/009), so they are exact (to the hour) whenever
+they are read, with no reset job. Until that migration is applied the stored
+counters are incremented in place and cleanup_old_impressions() resets them.
 """
-import sqlite3
+import atexit
+import logging
+import queue
 import json
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from db_pool import db_pool
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = 'brain.db'
 
+# Re-showing a market to the same user within this window isn't a new impression
+DEDUPE_WINDOW = timedelta(minutes=5)
+
+# Write-behind queue capacity (feed renders); when full, writes go inline
+QUEUE_MAXSIZE = 2000
+
+# Max time (seconds) a queued render waits before its flush starts
+FLUSH_INTERVAL = 0.5
+
+# Hourly impression ring: one byte per hour for 7 days
+RING_HOURS = 24 * 7
+RING_MAX_COUNT = 255
+
+_STOP = object()
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_hour(ts: datetime) -> int:
+    return int((ts - _EPOCH).total_seconds() // 3600)
+
+
+def _ring_sum(ring: bytes, first_hour: int, last_hour: int) -> int:
+    """Sum of the ring slots for hours first_hour..last_hour"""
+    if last_hour < first_hour:
+        return 0
+    if last_hour - first_hour + 1 >= RING_HOURS:
+        return sum(ring)
+    a, b = first_hour % RING_HOURS, last_hour % RING_HOURS
+    if a <= b:
+        return sum(ring[a:b + 1])
+    return sum(ring[a:]) + sum(ring[:b + 1])
+
+
+def window_counts(ring: Optional[bytes], end_hour: Optional[int],
+                  now: Optional[datetime] = None) -> Tuple[int, int]:
+    """
+    (impressions in the last 24h, in the last 7d) at `now` from an hourly ring
+    ending at epoch hour end_hour
+    """
+    if not ring or end_hour is None:
+        return 0, 0
+    now_hour = _epoch_hour(now or datetime.now())
+    first_7d = max(now_hour, end_hour) - RING_HOURS + 1
+    first_24h = max(now_hour - 23, first_7d)
+    return _ring_sum(ring, first_24h, end_hour), _ring_sum(ring, first_7d, end_hour)
+
+
+def _add_to_ring(ring: Optional[bytes], end_hour: Optional[int],
+                 hour: int) -> Tuple[bytes, int]:
+    """Count one impression at `hour`; returns the new (ring, end_hour)"""
+    if not ring or end_hour is None or len(ring) != RING_HOURS:
+        ring, end_hour = bytes(RING_HOURS), hour
+    ring = bytearray(ring)
+    
+    if hour > end_hour:
+        # Slide forward: clear the hours the ring skipped
+        if hour - end_hour >= RING_HOURS:
+            ring = bytearray(RING_HOURS)
+        else:
+            for h in range(end_hour + 1, hour + 1):
+                ring[h % RING_HOURS] = 0
+        end_hour = hour
+    elif hour <= end_hour - RING_HOURS:
+        return bytes(ring), end_hour  # older than the ring
+    
+    slot = hour % RING_HOURS
+    if ring[slot] < RING_MAX_COUNT:
+        ring[slot] += 1
+    return bytes(ring), end_hour
+
+
+def _legacy_ring(impressions_24h: int, impressions_7d: int,
+                 last_shown_at) -> Tuple[Optional[bytes], Optional[int]]:
+    """
+    Ring for a row written before migrations/009: the 24h count at
+    last_shown_at, the rest of the 7d count a day earlier
+    """
+    last_shown = _parse_ts(last_shown_at)
+    if last_shown is None or not (impressions_7d or impressions_24h):
+        return None, None
+    end_hour = _epoch_hour(last_shown)
+    ring = bytearray(RING_HOURS)
+    ring[end_hour % RING_HOURS] = min(impressions_24h or 0, RING_MAX_COUNT)
+    earlier = max((impressions_7d or 0) - (impressions_24h or 0), 0)
+    ring[(end_hour - 24) % RING_HOURS] = min(earlier, RING_MAX_COUNT)
+    return bytes(ring), end_hour
+
+
+def _parse_ts(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
 class ImpressionTracker:
-    def __init__(self, db_path=DB_PATH):
+    def __init__(self, db_path=DB_PATH, flush_interval: float = FLUSH_INTERVAL):
         self.db_path = db_path
+        self.flush_interval = flush_interval
+        
+        self._queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._atexit_registered = False
+        self._has_rings: Optional[bool] = None
+        
+        # Monitoring counters
+        self.logged = 0
+        self.deduped = 0
+        self.enqueued = 0
+        self.inline_writes = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.last_flush_size = 0
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
+    
+    def _rings_available(self, cursor) -> bool:
+        """Whether migrations/009 is applied (checked once per process)"""
+        if self._has_rings is None:
+            cursor.execute("PRAGMA table_info(user_market_impressions)")
+            self._has_rings = any(row[1] == 'impression_hours' for row in cursor.fetchall())
+            if not self._has_rings:
+                logger.warning("user_market_impressions.impression_hours missing (apply "
+                               "migrations/009_impression_hour_buckets.sql); using the stored counters")
+        return self._has_rings
     
     def log_impressions(self, user_key: str, market_ids: List[str], 
                        timestamp: Optional[datetime] = None) -> int:
@@ -22,7 +170,7 @@ class ImpressionTracker:
         Log impressions for a batch of markets shown to user
         Updates impressions_24h, impressions_7d, last_shown_at
         
-        Returns: number of impressions logged
+        Returns: number of impressions logged (after dedupe)
         """
         if not market_ids:
             return 0
@@ -33,48 +181,292 @@ class ImpressionTracker:
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        # Batch upsert impressions
-        logged_count = 0
-        for market_id in market_ids:
-            cursor.execute("""
+        # Read-modify-write of the rings: hold the write lock throughout
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            logged_count = self._write_impressions(cursor, [(user_key, market_ids, timestamp)])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return logged_count
+    
+    def log_impressions_async(self, user_key: str, market_ids: List[str]) -> None:
+        """
+        log_impressions() behind the request: queued for the writer thread
+        Written inline if the writer isn't running or the queue is full
+        """
+        if not market_ids:
+            return
+        
+        timestamp = datetime.now()
+        if self.running:
+            try:
+                self._queue.put_nowait((user_key, list(market_ids), timestamp))
+                with self._stats_lock:
+                    self.enqueued += 1
+                return
+            except queue.Full:
+                pass
+        
+        with self._stats_lock:
+            self.inline_writes += 1
+        self.log_impressions(user_key, market_ids, timestamp)
+    
+    def _write_impressions(self, cursor, renders: List[Tuple[str, List[str], datetime]]) -> int:
+        """
+        Bulk-write impressions inside the caller's transaction (caller commits)
+        
+        renders: [(user_key, market_ids, timestamp)], oldest first
+        Returns: number of impressions logged (after dedupe)
+        """
+        # Showings of each (user, market) in these renders, deduped
+        shown = defaultdict(list)
+        dropped = 0
+        for user_key, market_ids, timestamp in renders:
+            for market_id in market_ids:
+                times = shown[(user_key, market_id)]
+                if times and timestamp - times[-1] < DEDUPE_WINDOW:
+                    dropped += 1
+                    continue
+                times.append(timestamp)
+        
+        by_user = defaultdict(list)
+        for user_key, market_id in shown:
+            by_user[user_key].append(market_id)
+        
+        use_rings = self._rings_available(cursor)
+        
+        # Current rings (one read per user), then one row per (user, market)
+        rows = []
+        interactions = []
+        for user_key, market_ids in by_user.items():
+            current = self._load_rings(cursor, user_key, market_ids, use_rings)
+            for market_id in market_ids:
+                ring, end_hour, last_shown = current.get(market_id, (None, None, None))
+                added = 0
+                for timestamp in shown[(user_key, market_id)]:
+                    # ...minus showings within the window of the stored one
+                    if last_shown is not None and timestamp - last_shown < DEDUPE_WINDOW:
+                        dropped += 1
+                        continue
+                    if use_rings:
+                        ring, end_hour = _add_to_ring(ring, end_hour, _epoch_hour(timestamp))
+                    last_shown = timestamp
+                    interactions.append((user_key, market_id, timestamp))
+                    added += 1
+                
+                if not added:
+                    continue
+                if use_rings:
+                    count_24h, count_7d = window_counts(ring, end_hour, last_shown)
+                    rows.append((user_key, market_id, count_24h, count_7d,
+                                 ring, end_hour, last_shown, last_shown))
+                else:
+                    rows.append((user_key, market_id, added, added, last_shown, last_shown))
+        
+        if rows and not use_rings:
+            cursor.executemany("""
                 INSERT INTO user_market_impressions 
                     (user_key, market_id, impressions_24h, impressions_7d, 
                      last_shown_at, updated_at)
-                VALUES (?, ?, 1, 1, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?)
                 ON CONFLICT(user_key, market_id) DO UPDATE SET
-                    impressions_24h = impressions_24h + 1,
-                    impressions_7d = impressions_7d + 1,
-                    last_shown_at = ?,
-                    updated_at = ?
-            """, (user_key, market_id, timestamp, timestamp, timestamp, timestamp))
-            logged_count += 1
-        
-        # Also log as 'impression' events in user_interactions for velocity tracking
-        for market_id in market_ids:
-            cursor.execute("""
+                    impressions_24h = impressions_24h + excluded.impressions_24h,
+                    impressions_7d = impressions_7d + excluded.impressions_7d,
+                    last_shown_at = excluded.last_shown_at,
+                    updated_at = excluded.updated_at
+            """, rows)
+        elif rows:
+            cursor.executemany("""
+                INSERT INTO user_market_impressions 
+                    (user_key, market_id, impressions_24h, impressions_7d, 
+                     impression_hours, impression_hour, last_shown_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_key, market_id) DO UPDATE SET
+                    impressions_24h = excluded.impressions_24h,
+                    impressions_7d = excluded.impressions_7d,
+                    impression_hours = excluded.impression_hours,
+                    impression_hour = excluded.impression_hour,
+                    last_shown_at = excluded.last_shown_at,
+                    updated_at = excluded.updated_at
+            """, rows)
+        
+        if interactions:
+            # Also log as 'impression' events in user_interactions for velocity tracking
+            cursor.executemany("""
                 INSERT INTO user_interactions
                     (user_key, market_id, event_type, ts)
                 VALUES (?, ?, 'impression', ?)
-            """, (user_key, market_id, timestamp))
+            """, interactions)
         
-        conn.commit()
-        conn.close()
+        with self._stats_lock:
+            self.logged += len(interactions)
+            self.deduped += dropped
         
-        return logged_count
+        return len(interactions)
+    
+    def _load_rings(self, cursor, user_key: str, market_ids: List[str],
+                    use_rings: bool = True) -> Dict[str, Tuple[Optional[bytes], Optional[int], Optional[datetime]]]:
+        """
+        {market_id: (ring, end_hour, last_shown_at)} for rows that exist
+        Without migrations/009 the ring is always (None, None)
+        """
+        current = {}
+        ring_columns = self._ring_columns(use_rings)
+        # SQLite variable limit: chunk the IN (...) list
+        for i in range(0, len(market_ids), 500):
+            chunk = market_ids[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            cursor.execute(f"""
+                SELECT market_id, {ring_columns},
+                       impressions_24h, impressions_7d, last_shown_at
+                FROM user_market_impressions
+                WHERE user_key = ? AND market_id IN ({placeholders})
+            """, [user_key] + chunk)
+            
+            for market_id, ring, end_hour, count_24h, count_7d, last_shown_at in cursor.fetchall():
+                if ring is None and use_rings:
+                    ring, end_hour = _legacy_ring(count_24h, count_7d, last_shown_at)
+                current[market_id] = (ring, end_hour, _parse_ts(last_shown_at))
+        
+        return current
+    
+    # ------------------------------------------------------------------
+    # Write-behind writer
+    # ------------------------------------------------------------------
+    
+    def start(self):
+        """Start the impression writer thread (idempotent)"""
+        with self._start_lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._run, name='impression-writer', daemon=True)
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+    
+    def stop(self, timeout: float = 10.0):
+        """Flush everything still queued and stop the writer"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        
+        # Bypass maxsize: shutdown must not be dropped
+        with self._queue.mutex:
+            self._queue.queue.append(_STOP)
+            self._queue.not_empty.notify()
+        
+        thread.join(timeout)
+        self._thread = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def _run(self):
+        while True:
+            # Block for the first render, then gather the rest of the interval
+            item = self._queue.get()
+            deadline = time.time() + self.flush_interval
+            batch = []
+            stopping = False
+            
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            
+            if stopping:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            
+            self._flush(batch)
+            
+            if stopping:
+                return
+    
+    def _flush(self, batch: List[Tuple[str, List[str], datetime]]):
+        """Write queued renders in one transaction"""
+        if not batch:
+            return
+        
+        start = time.time()
+        conn = None
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            self._write_impressions(cursor, batch)
+            conn.commit()
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            logger.error(f"Impression writer: flush of {len(batch)} renders failed: {e}")
+            with self._stats_lock:
+                self.failed += len(batch)
+        finally:
+            if conn is not None:
+                conn.close()
+        
+        with self._stats_lock:
+            self.flushes += 1
+            self.last_flush_size = len(batch)
+            self.last_flush_ms = (time.time() - start) * 1000
+    
+    def stats(self) -> Dict:
+        """Impressions logged/deduped and writer queue health for monitoring"""
+        with self._stats_lock:
+            return {
+                'running': self.running,
+                'depth': self._queue.qsize(),
+                'capacity': self._queue.maxsize,
+                'dedupe_window_seconds': DEDUPE_WINDOW.total_seconds(),
+                'logged': self.logged,
+                'deduped': self.deduped,
+                'enqueued': self.enqueued,
+                'inline_writes': self.inline_writes,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_size': self.last_flush_size,
+                'last_flush_ms': round(self.last_flush_ms, 2)
+            }
     
     def update_interaction_timestamp(self, user_key: str, market_id: str,
                                      interaction_type: str,
-                                     timestamp: Optional[datetime] = None):
+                                     timestamp: Optional[datetime] = None,
+                                     cursor=None):
         """
         Update last_clicked_at, last_traded_at, or last_hidden_at
         
         interaction_type: 'click', 'trade', 'hide'
+        cursor: run inside the caller's transaction (caller commits)
         """
         if timestamp is None:
             timestamp = datetime.now()
         
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        owns_conn = cursor is None
+        if owns_conn:
+            conn = self._get_conn()
+            cursor = conn.cursor()
         
         column_map = {
             'click': 'last_clicked_at',
@@ -84,7 +476,8 @@ class ImpressionTracker:
         
         column = column_map.get(interaction_type)
         if not column:
-            conn.close()
+            if owns_conn:
+                conn.close()
             return
         
         # Update or insert
@@ -97,8 +490,9 @@ class ImpressionTracker:
                 updated_at = ?
         """, (user_key, market_id, timestamp, timestamp, timestamp, timestamp))
         
-        conn.commit()
-        conn.close()
+        if owns_conn:
+            conn.commit()
+            conn.close()
     
     def get_impression_data(self, user_key: str, market_ids: List[str]) -> Dict[str, Dict]:
         """
@@ -111,39 +505,87 @@ class ImpressionTracker:
         
         conn = self._get_conn()
         cursor = conn.cursor()
+        use_rings = self._rings_available(cursor)
         
         placeholders = ','.join(['?' for _ in market_ids])
         cursor.execute(f"""
             SELECT market_id, impressions_24h, impressions_7d,
-                   last_shown_at, last_clicked_at, last_traded_at, last_hidden_at
+                   last_shown_at, last_clicked_at, last_traded_at, last_hidden_at,
+                   {self._ring_columns(use_rings)}
             FROM user_market_impressions
             WHERE user_key = ? AND market_id IN ({placeholders})
         """, [user_key] + market_ids)
         
+        results = self._rows_to_impressions(cursor.fetchall(), use_rings)
+        
+        conn.close()
+        return results
+    
+    def get_user_impressions(self, user_key: str) -> Dict[str, Dict]:
+        """
+        Get impression data for every market this user has a row for
+        One query per request instead of one per candidate batch
+        
+        Returns: {market_id: {impressions_24h, impressions_7d, last_shown_at, ...}}
+        """
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        use_rings = self._rings_available(cursor)
+        
+        cursor.execute(f"""
+            SELECT market_id, impressions_24h, impressions_7d,
+                   last_shown_at, last_clicked_at, last_traded_at, last_hidden_at,
+                   {self._ring_columns(use_rings)}
+            FROM user_market_impressions
+            WHERE user_key = ?
+        """, (user_key,))
+        
+        results = self._rows_to_impressions(cursor.fetchall(), use_rings)
+        
+        conn.close()
+        return results
+    
+    @staticmethod
+    def _ring_columns(use_rings: bool) -> str:
+        return 'impression_hours, impression_hour' if use_rings else 'NULL, NULL'
+    
+    def _rows_to_impressions(self, rows, use_rings: bool = True) -> Dict[str, Dict]:
+        now = datetime.now()
         results = {}
-        for row in cursor.fetchall():
+        for row in rows:
+            if use_rings:
+                ring, end_hour = row[7], row[8]
+                if ring is None:
+                    ring, end_hour = _legacy_ring(row[1], row[2], row[3])
+                impressions_24h, impressions_7d = window_counts(ring, end_hour, now)
+            else:
+                impressions_24h, impressions_7d = row[1], row[2]
             results[row[0]] = {
-                'impressions_24h': row[1],
-                'impressions_7d': row[2],
+                'impressions_24h': impressions_24h,
+                'impressions_7d': impressions_7d,
                 'last_shown_at': row[3],
                 'last_clicked_at': row[4],
                 'last_traded_at': row[5],
                 'last_hidden_at': row[6]
             }
-        
-        conn.close()
         return results
     
     def cleanup_old_impressions(self, days: int = 7):
         """
-        Reset impression counters for data older than N days
-        Run this as a daily maintenance job
+        No-op once migrations/009 is applied: counters are windowed when read
+        Without it, resets the stored counters for data older than N days
+        (run as a daily maintenance job)
         """
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        cutoff_24h = (datetime.now() - timedelta(hours=24)).isoformat()
-        cutoff_7d = (datetime.now() - timedelta(days=7)).isoformat()
+        if self._rings_available(cursor):
+            conn.close()
+            return 0
+        
+        # last_shown_at is stored via the datetime adapter: bind datetimes, not isoformat
+        cutoff_24h = datetime.now() - timedelta(hours=24)
+        cutoff_7d = datetime.now() - timedelta(days=7)
         
         # Reset 24h counters
         cursor.execute("""
@@ -151,6 +593,7 @@ class ImpressionTracker:
             SET impressions_24h = 0
             WHERE last_shown_at < ?
         """, (cutoff_24h,))
+        changes = cursor.rowcount
         
         # Reset 7d counters
         cursor.execute("""
@@ -158,13 +601,9 @@ class ImpressionTracker:
             SET impressions_7d = 0
             WHERE last_shown_at < ?
         """, (cutoff_7d,))
+        changes += cursor.rowcount
         
         conn.commit()
-        
-        # Get counts
-        cursor.execute("SELECT changes()")
-        changes = cursor.fetchone()[0]
-        
         conn.close()
         return changes
 
@@ -0,0 +1,371 @@
+"""
+BRain - Market Catalog
+Process-wide, versioned, immutable snapshot of markets + tags + options + taxonomy
+Shared by FeedComposer, PersonalizationEngine and BRain so ranking never re-reads
+markets/market_tags per request
+
+Refresh is incremental: catalog_version / catalog_changes (migrations/002) are
+maintained by triggers, so we only reload markets that changed since our version.
+If the migration is not applied we fall back to a periodic full reload.
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional
+
+from db_pool import db_pool
+
+DB_PATH = 'brain.db'
+
+# How often (seconds) a request is allowed to hit SQLite to check the version
+VERSION_CHECK_INTERVAL = 2.0
+
+# Without the versioning migration, do a full reload at most this often
+FULL_RELOAD_INTERVAL = 60.0
+
+# SQLite variable limit safety for IN (...) lookups
+_CHUNK_SIZE = 500
+
+
+def _chunks(items: List[str], size: int = _CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _volume_sort_key(market: Dict, field: str):
+    value = market.get(field)
+    # NULLs sort last, same as ORDER BY ... DESC in SQLite
+    return (value is not None, value or 0)
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the market catalog at a given version
+
+    Markets are stored once and handed out as shallow copies so callers can
+    annotate them (scores, belief_intensity, ...) without touching the snapshot.
+    """
+
+    def __init__(self, version: int, markets: Dict[str, Dict], loaded_at: float):
+        self.version = version
+        self.loaded_at = loaded_at
+        self.markets = MappingProxyType(markets)
+
+        open_markets = [m for m in markets.values() if m.get('status') == 'open']
+        self._open_by_volume_total = tuple(
+            m['market_id'] for m in
+            sorted(open_markets, key=lambda m: _volume_sort_key(m, 'volume_total'), reverse=True)
+        )
+        self._open_ids = tuple(m['market_id'] for m in open_markets)
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.loaded_at
+
+    def __len__(self):
+        return len(self.markets)
+
+    def __contains__(self, market_id):
+        return market_id in self.markets
+
+    @staticmethod
+    def _copy(market: Dict, fields: Optional[Iterable[str]] = None) -> Dict:
+        if fields is None:
+            copy = dict(market)
+        else:
+            copy = {f: market.get(f) for f in fields}
+        copy['tags'] = list(market['tags'])
+        if fields is None:
+            copy['taxonomy'] = list(market['taxonomy'])
+            copy['options'] = [dict(opt) for opt in market['options']]
+        return copy
+
+    def get(self, market_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """Get a copy of one market (or None)"""
+        market = self.markets.get(market_id)
+        if market is None:
+            return None
+        return self._copy(market, fields)
+
+    def get_many(self, market_ids: Iterable[str], fields: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Get copies of several markets, preserving order and skipping unknown IDs"""
+        return [self._copy(self.markets[mid], fields) for mid in market_ids if mid in self.markets]
+
+    def open_markets(self, order_by: Optional[str] = 'volume_total',
+                     limit: Optional[int] = None,
+                     exclude_ids: Optional[Iterable[str]] = None,
+                     fields: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        Open markets as copies
+
+        order_by: 'volume_total' (precomputed), any other market column, or None
+        fields: restrict the copy to these columns (tags always included)
+        """
+        exclude = set(exclude_ids) if exclude_ids else None
+
+        if order_by == 'volume_total':
+            ids = self._open_by_volume_total
+        elif order_by is None:
+            ids = self._open_ids
+        else:
+            ids = tuple(
+                m['market_id'] for m in
+                sorted((self.markets[mid] for mid in self._open_ids),
+                       key=lambda m: _volume_sort_key(m, order_by), reverse=True)
+            )
+
+        result = []
+        for market_id in ids:
+            if exclude and market_id in exclude:
+                continue
+            result.append(self._copy(self.markets[market_id], fields))
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+
+class MarketCatalog:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._versioned = True  # False when migration 002 is missing
+
+        # Monitoring counters
+        self.full_reloads = 0
+        self.incremental_refreshes = 0
+        self.last_refresh_ms = 0.0
+
+    def _get_conn(self):
+        return db_pool.connect(self.db_path)
+
+    def get_snapshot(self, max_staleness: float = VERSION_CHECK_INTERVAL) -> CatalogSnapshot:
+        """
+        Get the current snapshot, refreshing it if the DB version moved
+
+        At most one version check per `max_staleness` seconds per process;
+        concurrent callers keep using the previous snapshot while one refreshes.
+        """
+        snapshot = self._snapshot
+        now = time.time()
+
+        if snapshot is not None and now - self._last_check < max_staleness:
+            return snapshot
+
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._refresh()
+                return self._snapshot
+
+        if self._lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+
+        return self._snapshot
+
+    def refresh(self, force_full: bool = False) -> CatalogSnapshot:
+        """Refresh now (e.g. right after a bulk import)"""
+        with self._lock:
+            self._refresh(force_full=force_full)
+            return self._snapshot
+
+    def version(self) -> Optional[int]:
+        """
+        Current snapshot version (same staleness as get_snapshot), or None on
+        an unversioned DB, where the version never moves
+        """
+        snapshot = self.get_snapshot()
+        return snapshot.version if self._versioned else None
+
+    def stats(self) -> Dict:
+        """Snapshot version + age for monitoring"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {'loaded': False}
+
+        return {
+            'loaded': True,
+            'version': snapshot.version,
+            'loaded_at': datetime.fromtimestamp(snapshot.loaded_at).isoformat(),
+            'age_seconds': round(snapshot.age_seconds, 3),
+            'market_count': len(snapshot),
+            'open_count': len(snapshot._open_ids),
+            'versioned': self._versioned,
+            'full_reloads': self.full_reloads,
+            'incremental_refreshes': self.incremental_refreshes,
+            'last_refresh_ms': round(self.last_refresh_ms, 2)
+        }
+
+    def prune_change_log(self, keep_versions: int = 100000) -> int:
+        """
+        Delete old catalog_changes rows (maintenance job)
+        Processes lagging further behind than this simply do a full reload
+        """
+        conn = self._get_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+                DELETE FROM catalog_changes
+                WHERE version <= (SELECT version FROM catalog_version WHERE id = 1) - ?
+            """, (keep_versions,))
+        except sqlite3.OperationalError:
+            conn.close()
+            return 0
+
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _refresh(self, force_full: bool = False):
+        start = time.time()
+        self._last_check = start
+
+        conn = self._get_conn()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        try:
+            # Read version + data in one read transaction so they agree
+            cursor.execute("BEGIN")
+
+            db_version = self._read_version(cursor)
+            snapshot = self._snapshot
+
+            if db_version is None:
+                # Unversioned DB: periodic full reload only
+                if snapshot is not None and not force_full and \
+                        start - snapshot.loaded_at < FULL_RELOAD_INTERVAL:
+                    return
+                markets = self._load_markets(cursor)
+                self._snapshot = CatalogSnapshot(0, markets, start)
+                self.full_reloads += 1
+
+            elif snapshot is None or force_full or not self._versioned:
+                markets = self._load_markets(cursor)
+                self._snapshot = CatalogSnapshot(db_version, markets, start)
+                self._versioned = True
+                self.full_reloads += 1
+
+            elif db_version != snapshot.version:
+                cursor.execute("SELECT MIN(version) FROM catalog_changes")
+                oldest = cursor.fetchone()[0]
+
+                if db_version < snapshot.version or oldest is None or oldest > snapshot.version + 1:
+                    # Counter reset or change log pruned past us: reload everything
+                    markets = self._load_markets(cursor)
+                    self.full_reloads += 1
+                else:
+                    cursor.execute("""
+                        SELECT DISTINCT market_id FROM catalog_changes
+                        WHERE version > ? AND version <= ?
+                    """, (snapshot.version, db_version))
+                    changed_ids = [row[0] for row in cursor.fetchall()]
+
+                    markets = dict(snapshot.markets)
+                    for market_id in changed_ids:
+                        markets.pop(market_id, None)
+                    markets.update(self._load_markets(cursor, changed_ids))
+                    self.incremental_refreshes += 1
+
+                self._snapshot = CatalogSnapshot(db_version, markets, start)
+
+            else:
+                return
+
+            self.last_refresh_ms = (time.time() - start) * 1000
+
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def _read_version(self, cursor) -> Optional[int]:
+        try:
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+        except sqlite3.OperationalError:
+            self._versioned = False
+            return None
+
+        row = cursor.fetchone()
+        if row is None:
+            self._versioned = False
+            return None
+        return row[0]
+
+    def _load_markets(self, cursor, market_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Bulk-load markets with tags, options and taxonomy
+        4 queries total (per chunk of IDs when market_ids is given)
+        """
+        if market_ids is not None and not market_ids:
+            return {}
+
+        id_chunks = [None] if market_ids is None else list(_chunks(market_ids))
+
+        markets = {}
+        tags = defaultdict(list)
+        options = defaultdict(list)
+        taxonomy = defaultdict(list)
+
+        for chunk in id_chunks:
+            if chunk is None:
+                where, params = "", []
+            else:
+                where = f"WHERE market_id IN ({','.join('?' for _ in chunk)})"
+                params = chunk
+
+            cursor.execute(f"SELECT * FROM markets {where}", params)
+            for row in cursor.fetchall():
+                markets[row['market_id']] = dict(row)
+
+            cursor.execute(f"""
+                SELECT market_id, tag FROM market_tags {where}
+                ORDER BY market_id, tag
+            """, params)
+            for row in cursor.fetchall():
+                tags[row[0]].append(row[1])
+
+            try:
+                cursor.execute(f"""
+                    SELECT market_id, option_id, option_text, probability, position
+                    FROM market_options {where}
+                    ORDER BY market_id, probability DESC
+                """, params)
+                for row in cursor.fetchall():
+                    options[row[0]].append({
+                        'option_id': row[1],
+                        'option_text': row[2],
+                        'probability': row[3],
+                        'position': row[4]
+                    })
+            except sqlite3.OperationalError:
+                pass  # Older DBs without market_options
+
+            cursor.execute(f"""
+                SELECT market_id, taxonomy_path FROM market_taxonomy {where}
+                ORDER BY market_id, taxonomy_path
+            """, params)
+            for row in cursor.fetchall():
+                taxonomy[row[0]].append(row[1])
+
+        for market_id, market in markets.items():
+            market['tags'] = tuple(tags.get(market_id, ()))
+            market['options'] = tuple(MappingProxyType(opt) for opt in options.get(market_id, ()))
+            market['taxonomy'] = tuple(taxonomy.get(market_id, ()))
+
+        return markets
+
+# Global instance
+market_catalog = MarketCatalog()
@@ -0,0 +1,304 @@
+"""
+BRain - Market Search
+Full-text search over markets for /api/v1/search (and typeahead)
+
+Backed by the market_search FTS5 table (migrations/004), which triggers keep in
+sync with markets / market_tags / market_taxonomy. Matches are ranked by BM25
+(title weighted highest); the top RERANK_WINDOW are then blended with belief
+intensity so live, contested markets beat stale ones with the same wording.
+Beyond the window results keep plain BM25 order, so pagination stays stable.
+
+Very broad terms ("will", "th*") match most of the catalog, and BM25 has to
+score every match before sorting. Those queries only rank the newest
+*_CANDIDATES matches (FTS rowids grow with insertion, so a rowid floor bounds
+the work), which keeps typeahead in single-digit milliseconds at 100k markets.
+
+Without the migration we fall back to a LIKE scan over titles.
+"""
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from brain_algorithm import calculate_belief_intensity
+from db_pool import db_pool
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# bm25() weights per FTS column:
+# market_id, title, description, editorial_description, tags, taxonomy
+BM25_WEIGHTS = (0.0, 10.0, 2.0, 3.0, 5.0, 4.0)
+
+# Top BM25 matches re-ranked with belief intensity
+RERANK_WINDOW = 200
+RELEVANCE_WEIGHT = 0.75
+BELIEF_WEIGHT = 0.25
+
+# Typeahead re-ranks this many title matches
+SUGGEST_WINDOW = 32
+
+# Most matches BM25 will score per query (newest first beyond this)
+SEARCH_CANDIDATES = 10000
+SUGGEST_CANDIDATES = 1000
+
+# Search terms beyond this are ignored (keeps MATCH expressions bounded)
+MAX_TERMS = 8
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_RESULT_COLUMNS = """
+    m.market_id, m.title, m.category, m.market_type, m.probability,
+    m.volume_24h, m.volume_total, m.image_url, m.status, m.resolution_date
+"""
+
+
+def build_match_query(text: str, prefix: bool = True, column: Optional[str] = None) -> Optional[str]:
+    """
+    FTS5 MATCH expression for free user text, or None if it has no terms
+
+    Every term is quoted (so operators/punctuation in user input can't break
+    the query) and AND-ed; with prefix=True the last term matches as a prefix
+    (typeahead: "bitc" -> "bitc"*).
+    """
+    terms = _TOKEN_RE.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+
+    parts = [f'"{term}"' for term in terms]
+    if prefix:
+        parts[-1] += '*'
+
+    expression = ' '.join(parts)
+    if column:
+        expression = f'{column} : ({expression})'
+    return expression
+
+
+def _blend(rows: List[Dict], window: int) -> List[Dict]:
+    """
+    Re-rank the first `window` rows (BM25 order) by relevance + belief intensity
+
+    bm25() is negative (lower = better) and bunches up on small catalogs, so
+    relevance is min-max scaled within the window; belief intensity is
+    log-scaled (a few huge-volume markets would otherwise swamp relevance).
+    Both end up 0-1 before blending.
+    """
+    head, tail = rows[:window], rows[window:]
+    if not head:
+        return rows
+
+    relevances = [-row['rank'] for row in head]
+    low = min(relevances)
+    spread = (max(relevances) - low) or 1.0
+
+    for row in head:
+        row['belief_intensity'] = calculate_belief_intensity(row)
+    best_belief = math.log1p(max(max(row['belief_intensity'] for row in head), 0.0)) or 1.0
+
+    for row, relevance in zip(head, relevances):
+        row['search_score'] = round(
+            RELEVANCE_WEIGHT * (relevance - low) / spread +
+            BELIEF_WEIGHT * math.log1p(max(row['belief_intensity'], 0.0)) / best_belief, 4
+        )
+    head.sort(key=lambda row: row['search_score'], reverse=True)
+
+    for row in tail:
+        row['belief_intensity'] = calculate_belief_intensity(row)
+        row['search_score'] = None
+
+    return head + tail
+
+
+class MarketSearch:
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+
+        self._lock = threading.Lock()
+        self._fts_available: Optional[bool] = None
+
+        # Monitoring counters
+        self.searches = 0
+        self.suggests = 0
+        self.fallbacks = 0
+        self.bounded = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def _get_conn(self):
+        conn = db_pool.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def search(self, text: str, category: Optional[str] = None, limit: int = 20,
+               offset: int = 0, include_closed: bool = False) -> Dict:
+        """
+        Ranked markets matching `text`
+
+        Returns: {'results': [...], 'has_more': bool}; each result carries
+        belief_intensity and search_score (None past the re-rank window)
+        """
+        start = time.time()
+        match = build_match_query(text)
+        if match is None:
+            return {'results': [], 'has_more': False}
+
+        # One extra row tells us whether another page exists
+        fetch = max(RERANK_WINDOW, offset + limit + 1)
+
+        conn = self._get_conn()
+        try:
+            if self._has_fts(conn):
+                rows = self._fts_query(conn, match, category, include_closed, fetch,
+                                       SEARCH_CANDIDATES)
+                rows = _blend(rows, RERANK_WINDOW)
+            else:
+                rows = self._like_query(conn, text, category, include_closed, fetch)
+        finally:
+            conn.close()
+
+        page = rows[offset:offset + limit]
+        self._record(start, suggest=False)
+        return {'results': page, 'has_more': len(rows) > offset + limit}
+
+    def suggest(self, text: str, limit: int = 8, category: Optional[str] = None) -> List[Dict]:
+        """
+        Typeahead: open markets whose title matches `text` (last word as prefix)
+        Returns: [{'market_id', 'title', 'category'}]
+        """
+        start = time.time()
+        match = build_match_query(text, column='title')
+        if match is None:
+            return []
+
+        conn = self._get_conn()
+        try:
+            if self._has_fts(conn):
+                rows = self._fts_query(conn, match, category, False, max(SUGGEST_WINDOW, limit),
+                                       SUGGEST_CANDIDATES)
+                rows = _blend(rows, SUGGEST_WINDOW)
+            else:
+                rows = self._like_query(conn, text, category, False, limit)
+        finally:
+            conn.close()
+
+        self._record(start, suggest=True)
+        return [
+            {'market_id': row['market_id'], 'title': row['title'], 'category': row['category']}
+            for row in rows[:limit]
+        ]
+
+    def _fts_query(self, conn, match: str, category: Optional[str], include_closed: bool,
+                   limit: int, candidates: int) -> List[Dict]:
+        """
+        Top `limit` matches by BM25 (market filters applied in the same query),
+        among the newest `candidates` matches
+        """
+        cursor = conn.cursor()
+        where = ["market_search MATCH ?"]
+        params: List = [match]
+
+        # Rowid of the candidates-th newest match (none: fewer matches than that)
+        cursor.execute("""
+            SELECT rowid FROM market_search
+            WHERE market_search MATCH ?
+            ORDER BY rowid DESC
+            LIMIT 1 OFFSET ?
+        """, (match, candidates - 1))
+        floor = cursor.fetchone()
+        if floor is not None:
+            where.append("market_search.rowid >= ?")
+            params.append(floor[0])
+            self.bounded += 1
+
+        if not include_closed:
+            where.append("m.status = 'open'")
+        if category:
+            where.append("m.category = ?")
+            params.append(category)
+        params.append(limit)
+
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        cursor.execute(f"""
+            SELECT {_RESULT_COLUMNS}, bm25(market_search, {weights}) AS rank
+            FROM market_search
+            JOIN markets m ON m.market_id = market_search.market_id
+            WHERE {' AND '.join(where)}
+            ORDER BY rank
+            LIMIT ?
+        """, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _like_query(self, conn, text: str, category: Optional[str], include_closed: bool,
+                    limit: int) -> List[Dict]:
+        """Fallback without migrations/004: title substring, by volume"""
+        where = ["m.title LIKE ?"]
+        params: List = [f"%{text.strip()}%"]
+        if not include_closed:
+            where.append("m.status = 'open'")
+        if category:
+            where.append("m.category = ?")
+            params.append(category)
+        params.append(limit)
+
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {_RESULT_COLUMNS}
+            FROM markets m
+            WHERE {' AND '.join(where)}
+            ORDER BY m.volume_24h DESC
+            LIMIT ?
+        """, params)
+
+        rows = [dict(row) for row in cursor.fetchall()]
+        for row in rows:
+            row['belief_intensity'] = calculate_belief_intensity(row)
+            row['search_score'] = None
+        self.fallbacks += 1
+        return rows
+
+    def _has_fts(self, conn) -> bool:
+        """Whether migrations/004 is applied (checked once per process)"""
+        if self._fts_available is None:
+            with self._lock:
+                if self._fts_available is None:
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT 1 FROM sqlite_master
+                        WHERE type = 'table' AND name = 'market_search'
+                    """)
+                    self._fts_available = cursor.fetchone() is not None
+                    if not self._fts_available:
+                        logger.warning("market_search FTS table missing (apply "
+                                       "migrations/004_market_search.sql); using LIKE search")
+        return self._fts_available
+
+    def _record(self, start: float, suggest: bool):
+        elapsed_ms = (time.time() - start) * 1000
+        if suggest:
+            self.suggests += 1
+        else:
+            self.searches += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def stats(self) -> Dict:
+        """Query counts and latency for monitoring"""
+        queries = self.searches + self.suggests
+        return {
+            'fts_available': self._fts_available,
+            'searches': self.searches,
+            'suggests': self.suggests,
+            'fallbacks': self.fallbacks,
+            'bounded': self.bounded,
+            'avg_ms': round(self.total_ms / queries, 2) if queries else 0.0,
+            'max_ms': round(self.max_ms, 2)
+        }
+
+
+# Global instance
+market_search = MarketSearch()
@@ -0,0 +1,162 @@
+"""
+BRain - All Markets Feed
+Materialized ordering behind /api/markets/feed (the /markets infinite scroll)
+
+Open markets newest first, and for "all" a round-robin across categories
+(newest of each category, then second newest of each, ...) for diversity.
+The sequences are built from the market catalog snapshot and kept until a
+market is added, removed, closed or re-categorized; price/volume updates
+only refresh the affected items. A page is a slice of the sequence, carrying
+only the fields the /markets cards render.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from market_catalog import market_catalog
+
+# Fields returned per market (what markets.html / markets_mobile.html render)
+FEED_FIELDS = ('market_id', 'title', 'category', 'probability', 'image_url')
+
+# Hidden from All Markets (only reachable via the main feed with ?yaniv=1)
+HIDDEN_MARKET_IDS = frozenset({'yaniv-rain-march-2026'})
+
+
+def _order_key(market: Dict) -> Tuple:
+    """What the sequences depend on"""
+    return market.get('status'), market.get('category'), market.get('created_at')
+
+
+def _item(market: Dict) -> Dict:
+    return {field: market.get(field) for field in FEED_FIELDS}
+
+
+class MarketsFeedIndex:
+    """
+    Round-robin sequence + per-category sequences (market_id tuples) and the
+    compact items they point to
+    """
+
+    def __init__(self, markets):
+        self.built_at = time.time()
+        self.keys: Dict[str, Tuple] = {}
+        self.items: Dict[str, Dict] = {}
+
+        open_markets = []
+        for market_id, market in markets.items():
+            self.keys[market_id] = _order_key(market)
+            if market.get('status') == 'open' and market_id not in HIDDEN_MARKET_IDS:
+                open_markets.append(market)
+                self.items[market_id] = _item(market)
+
+        # ORDER BY created_at DESC (NULLs last), market_id: ties used to come
+        # back in whatever order the planner's index gave
+        open_markets.sort(key=lambda m: m['market_id'])
+        open_markets.sort(key=lambda m: m.get('created_at') or '', reverse=True)
+
+        by_category = defaultdict(list)
+        for market in open_markets:
+            by_category[market['category']].append(market['market_id'])
+        self.by_category: Dict[str, Tuple[str, ...]] = {
+            category: tuple(ids) for category, ids in by_category.items()
+        }
+
+        # Round-robin in order of each category's newest market
+        sequence = []
+        queues = list(self.by_category.values())
+        depth = max((len(ids) for ids in queues), default=0)
+        for i in range(depth):
+            for ids in queues:
+                if i < len(ids):
+                    sequence.append(ids[i])
+        self.sequence: Tuple[str, ...] = tuple(sequence)
+
+    def page(self, category: Optional[str], offset: int, limit: int) -> Tuple[List[Dict], int]:
+        """(items, total) for one page"""
+        if category:
+            ids = self.by_category.get(category, ())
+        else:
+            ids = self.sequence
+        items = self.items
+        return [items[market_id] for market_id in ids[offset:offset + limit]], len(ids)
+
+
+class MarketsFeed:
+    def __init__(self, catalog=market_catalog):
+        self.catalog = catalog
+
+        self._index: Optional[MarketsFeedIndex] = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+        # Monitoring counters
+        self.builds = 0
+        self.item_refreshes = 0
+        self.last_build_ms = 0.0
+
+    def get_page(self, category: Optional[str] = None, offset: int = 0,
+                 limit: int = 60) -> Tuple[List[Dict], int]:
+        """
+        One page of open markets
+        category: None/'all' for the round-robin sequence
+        Returns: (markets, total)
+        """
+        self.refresh(block=self._index is None)
+        if category == 'all':
+            category = None
+        return self._index.page(category, max(offset, 0), max(limit, 0))
+
+    def refresh(self, block: bool = True):
+        """Follow the catalog: rebuild on ordering changes, else refresh items"""
+        if not self._lock.acquire(blocking=block):
+            return  # another request is already refreshing
+        try:
+            snapshot = self.catalog.get_snapshot()
+            previous, index = self._snapshot, self._index
+            if snapshot is previous and index is not None:
+                return
+
+            if index is not None:
+                new_markets, old_markets = snapshot.markets, previous.markets
+                changed = [
+                    market for market_id, market in new_markets.items()
+                    if old_markets.get(market_id) is not market
+                ]
+                reorder = len(new_markets) != len(index.keys) or any(
+                    index.keys.get(market['market_id']) != _order_key(market) for market in changed
+                )
+                if not reorder:
+                    # Same sequences; swap in fresh items (atomic per key)
+                    for market in changed:
+                        if market['market_id'] in index.items:
+                            index.items[market['market_id']] = _item(market)
+                    self.item_refreshes += 1
+                    self._snapshot = snapshot
+                    return
+
+            start = time.time()
+            self._index = MarketsFeedIndex(snapshot.markets)
+            self._snapshot = snapshot
+            self.builds += 1
+            self.last_build_ms = (time.time() - start) * 1000
+        finally:
+            self._lock.release()
+
+    def stats(self) -> Dict:
+        """Sequence sizes and rebuild counts for monitoring"""
+        index = self._index
+        return {
+            'built': index is not None,
+            'markets': len(index.sequence) if index else 0,
+            'categories': len(index.by_category) if index else 0,
+            'catalog_version': self._snapshot.version if self._snapshot else None,
+            'age_seconds': round(time.time() - index.built_at, 1) if index else None,
+            'builds': self.builds,
+            'item_refreshes': self.item_refreshes,
+            'last_build_ms': round(self.last_build_ms, 2)
+        }
+
+
+# Global instance
+markets_feed = MarketsFeed()
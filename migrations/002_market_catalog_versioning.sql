@@ -0,0 +1,121 @@
+-- Market Catalog Versioning
+-- Date: 2026-10-18
+-- Purpose: Change counter + change log so the in-memory market catalog
+--          (market_catalog.py) can refresh incrementally instead of re-reading
+--          markets/market_tags on every request
+
+-- 1. catalog_version
+-- Single-row monotonically increasing change counter
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+
+-- 2. catalog_changes
+-- Which market changed at which version (pruned by MarketCatalog.prune_change_log)
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    version INTEGER NOT NULL,
+    market_id TEXT NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_version
+    ON catalog_changes(version);
+
+-- 3. Triggers: every write to markets / tags / options / taxonomy bumps the
+-- counter and records the affected market_id
+
+-- markets
+CREATE TRIGGER IF NOT EXISTS trg_catalog_markets_insert
+AFTER INSERT ON markets
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_markets_update
+AFTER UPDATE ON markets
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_markets_delete
+AFTER DELETE ON markets
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), OLD.market_id);
+END;
+
+-- market_tags
+CREATE TRIGGER IF NOT EXISTS trg_catalog_tags_insert
+AFTER INSERT ON market_tags
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_tags_update
+AFTER UPDATE ON market_tags
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_tags_delete
+AFTER DELETE ON market_tags
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), OLD.market_id);
+END;
+
+-- market_options
+CREATE TRIGGER IF NOT EXISTS trg_catalog_options_insert
+AFTER INSERT ON market_options
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_options_update
+AFTER UPDATE ON market_options
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_options_delete
+AFTER DELETE ON market_options
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), OLD.market_id);
+END;
+
+-- market_taxonomy
+CREATE TRIGGER IF NOT EXISTS trg_catalog_taxonomy_insert
+AFTER INSERT ON market_taxonomy
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), NEW.market_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_catalog_taxonomy_delete
+AFTER DELETE ON market_taxonomy
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    INSERT INTO catalog_changes (version, market_id)
+    VALUES ((SELECT version FROM catalog_version WHERE id = 1), OLD.market_id);
+END;
@@ -0,0 +1,32 @@
+-- Incremental Velocity Rollups
+-- Date: 2026-10-18
+-- Purpose: Per-minute ring buckets + high-water mark so VelocityComputer only
+--          reads user_interactions rows it has not seen yet, instead of
+--          rescanning 24h of events per market per geo bucket every tick
+
+-- 1. market_velocity_buckets
+-- Ring buffer: one slot per minute of the day (slot = minute % 1440) per
+-- (market, geo). `minute` is the epoch minute currently held by the slot;
+-- a newer minute overwrites the slot, so the table never needs pruning
+CREATE TABLE IF NOT EXISTS market_velocity_buckets (
+    market_id TEXT NOT NULL,
+    geo_bucket TEXT NOT NULL,  -- 'GLOBAL' or 'IL', 'US', etc.
+    slot INTEGER NOT NULL,     -- minute % 1440
+    minute INTEGER NOT NULL,   -- epoch minute
+    views INTEGER NOT NULL DEFAULT 0,
+    trades INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (market_id, geo_bucket, slot)
+);
+
+CREATE INDEX IF NOT EXISTS idx_velocity_buckets_minute
+    ON market_velocity_buckets(minute);
+
+-- 2. velocity_watermark
+-- Last ingested user_interactions.interaction_id and the minute the
+-- rollups were last advanced to
+CREATE TABLE IF NOT EXISTS velocity_watermark (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_interaction_id INTEGER NOT NULL DEFAULT 0,
+    last_minute INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
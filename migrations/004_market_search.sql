@@ -0,0 +1,165 @@
+-- Market Full-Text Search
+-- Date: 2026-10-18
+-- Purpose: FTS5 index over market text (title, description,
+--          editorial_description, tags, taxonomy) for /api/v1/search,
+--          kept in sync with markets / market_tags / market_taxonomy by triggers
+--          (market_search.py queries it)
+
+-- 1. market_search_ids
+-- Stable FTS rowid per market (markets' own rowid can change on VACUUM)
+CREATE TABLE IF NOT EXISTS market_search_ids (
+    docid INTEGER PRIMARY KEY AUTOINCREMENT,
+    market_id TEXT NOT NULL UNIQUE
+);
+
+-- 2. market_search
+-- One row per market; tags and taxonomy paths are space-joined.
+-- prefix='2 3' indexes short prefixes for typeahead
+CREATE VIRTUAL TABLE IF NOT EXISTS market_search USING fts5(
+    market_id UNINDEXED,
+    title,
+    description,
+    editorial_description,
+    tags,
+    taxonomy,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- 3. Backfill
+INSERT OR IGNORE INTO market_search_ids (market_id)
+SELECT market_id FROM markets;
+
+DELETE FROM market_search;
+
+INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+       (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+       (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+        FROM market_taxonomy WHERE market_id = m.market_id)
+FROM markets m
+JOIN market_search_ids s ON s.market_id = m.market_id;
+
+-- 4. Triggers: re-index the affected market from its source rows.
+-- Price/volume updates don't touch the index (UPDATE OF text columns only)
+
+-- markets
+CREATE TRIGGER IF NOT EXISTS trg_search_markets_insert
+AFTER INSERT ON markets
+BEGIN
+    INSERT OR IGNORE INTO market_search_ids (market_id) VALUES (NEW.market_id);
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = NEW.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_markets_update
+AFTER UPDATE OF market_id, title, description, editorial_description ON markets
+BEGIN
+    INSERT OR IGNORE INTO market_search_ids (market_id) VALUES (NEW.market_id);
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = OLD.market_id);
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = NEW.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_markets_delete
+AFTER DELETE ON markets
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = OLD.market_id);
+END;
+
+-- market_tags
+CREATE TRIGGER IF NOT EXISTS trg_search_tags_insert
+AFTER INSERT ON market_tags
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = NEW.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_tags_update
+AFTER UPDATE ON market_tags
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = OLD.market_id);
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = NEW.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_tags_delete
+AFTER DELETE ON market_tags
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = OLD.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = OLD.market_id;
+END;
+
+-- market_taxonomy
+CREATE TRIGGER IF NOT EXISTS trg_search_taxonomy_insert
+AFTER INSERT ON market_taxonomy
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = NEW.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_taxonomy_delete
+AFTER DELETE ON market_taxonomy
+BEGIN
+    DELETE FROM market_search
+    WHERE rowid = (SELECT docid FROM market_search_ids WHERE market_id = OLD.market_id);
+    INSERT INTO market_search (rowid, market_id, title, description, editorial_description, tags, taxonomy)
+    SELECT s.docid, m.market_id, m.title, m.description, m.editorial_description,
+           (SELECT group_concat(tag, ' ') FROM market_tags WHERE market_id = m.market_id),
+           (SELECT group_concat(replace(taxonomy_path, '/', ' '), ' ')
+            FROM market_taxonomy WHERE market_id = m.market_id)
+    FROM markets m
+    JOIN market_search_ids s ON s.market_id = m.market_id
+    WHERE m.market_id = OLD.market_id;
+END;
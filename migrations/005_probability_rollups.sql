@@ -0,0 +1,139 @@
+-- Probability History Rollups
+-- Date: 2026-10-18
+-- Purpose: 1m / 1h / 1d OHLC buckets of probability_history so detail charts
+--          read a bounded number of rows at the resolution they need
+--          (probability_series.py) instead of every raw point
+
+-- 1. probability_rollups
+-- One row per (market, resolution, bucket). bucket_start is the bucket's
+-- start in the same ISO format as probability_history.timestamp.
+-- first_ts / last_ts let out-of-order inserts keep open/close correct
+CREATE TABLE IF NOT EXISTS probability_rollups (
+    market_id TEXT NOT NULL,
+    resolution TEXT NOT NULL,  -- '1m', '1h', '1d'
+    bucket_start TEXT NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    volume REAL NOT NULL DEFAULT 0,
+    samples INTEGER NOT NULL DEFAULT 0,
+    first_ts TEXT NOT NULL,
+    last_ts TEXT NOT NULL,
+    PRIMARY KEY (market_id, resolution, bucket_start)
+) WITHOUT ROWID;
+
+-- Range reads on the raw series (may already exist from database_schema.sql)
+CREATE INDEX IF NOT EXISTS idx_probability_history_market_time
+    ON probability_history(market_id, timestamp DESC);
+
+-- 2. Backfill from existing history
+DELETE FROM probability_rollups;
+
+INSERT INTO probability_rollups
+    (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+SELECT market_id, '1m', bucket, first_p, MAX(probability), MIN(probability), last_p,
+       COALESCE(SUM(volume), 0), COUNT(*), MIN(timestamp), MAX(timestamp)
+FROM (
+    SELECT market_id, probability, volume, timestamp,
+           strftime('%Y-%m-%dT%H:%M:00', timestamp) AS bucket,
+           FIRST_VALUE(probability) OVER w AS first_p,
+           LAST_VALUE(probability) OVER w AS last_p
+    FROM probability_history
+    WHERE timestamp IS NOT NULL
+    WINDOW w AS (
+        PARTITION BY market_id, strftime('%Y-%m-%dT%H:%M:00', timestamp)
+        ORDER BY timestamp, id
+        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+    )
+)
+GROUP BY market_id, bucket;
+
+INSERT INTO probability_rollups
+    (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+SELECT market_id, '1h', bucket, first_p, MAX(probability), MIN(probability), last_p,
+       COALESCE(SUM(volume), 0), COUNT(*), MIN(timestamp), MAX(timestamp)
+FROM (
+    SELECT market_id, probability, volume, timestamp,
+           strftime('%Y-%m-%dT%H:00:00', timestamp) AS bucket,
+           FIRST_VALUE(probability) OVER w AS first_p,
+           LAST_VALUE(probability) OVER w AS last_p
+    FROM probability_history
+    WHERE timestamp IS NOT NULL
+    WINDOW w AS (
+        PARTITION BY market_id, strftime('%Y-%m-%dT%H:00:00', timestamp)
+        ORDER BY timestamp, id
+        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+    )
+)
+GROUP BY market_id, bucket;
+
+INSERT INTO probability_rollups
+    (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+SELECT market_id, '1d', bucket, first_p, MAX(probability), MIN(probability), last_p,
+       COALESCE(SUM(volume), 0), COUNT(*), MIN(timestamp), MAX(timestamp)
+FROM (
+    SELECT market_id, probability, volume, timestamp,
+           strftime('%Y-%m-%dT00:00:00', timestamp) AS bucket,
+           FIRST_VALUE(probability) OVER w AS first_p,
+           LAST_VALUE(probability) OVER w AS last_p
+    FROM probability_history
+    WHERE timestamp IS NOT NULL
+    WINDOW w AS (
+        PARTITION BY market_id, strftime('%Y-%m-%dT00:00:00', timestamp)
+        ORDER BY timestamp, id
+        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+    )
+)
+GROUP BY market_id, bucket;
+
+-- 3. Trigger: fold each new history point into its three buckets
+CREATE TRIGGER IF NOT EXISTS trg_probability_rollups_insert
+AFTER INSERT ON probability_history
+WHEN NEW.timestamp IS NOT NULL
+BEGIN
+    INSERT INTO probability_rollups
+        (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+    VALUES (NEW.market_id, '1m', strftime('%Y-%m-%dT%H:%M:00', NEW.timestamp),
+            NEW.probability, NEW.probability, NEW.probability, NEW.probability,
+            COALESCE(NEW.volume, 0), 1, NEW.timestamp, NEW.timestamp)
+    ON CONFLICT (market_id, resolution, bucket_start) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        close = CASE WHEN excluded.last_ts >= last_ts THEN excluded.close ELSE close END,
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        volume = volume + excluded.volume,
+        samples = samples + 1,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts);
+
+    INSERT INTO probability_rollups
+        (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+    VALUES (NEW.market_id, '1h', strftime('%Y-%m-%dT%H:00:00', NEW.timestamp),
+            NEW.probability, NEW.probability, NEW.probability, NEW.probability,
+            COALESCE(NEW.volume, 0), 1, NEW.timestamp, NEW.timestamp)
+    ON CONFLICT (market_id, resolution, bucket_start) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        close = CASE WHEN excluded.last_ts >= last_ts THEN excluded.close ELSE close END,
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        volume = volume + excluded.volume,
+        samples = samples + 1,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts);
+
+    INSERT INTO probability_rollups
+        (market_id, resolution, bucket_start, open, high, low, close, volume, samples, first_ts, last_ts)
+    VALUES (NEW.market_id, '1d', strftime('%Y-%m-%dT00:00:00', NEW.timestamp),
+            NEW.probability, NEW.probability, NEW.probability, NEW.probability,
+            COALESCE(NEW.volume, 0), 1, NEW.timestamp, NEW.timestamp)
+    ON CONFLICT (market_id, resolution, bucket_start) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        close = CASE WHEN excluded.last_ts >= last_ts THEN excluded.close ELSE close END,
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        volume = volume + excluded.volume,
+        samples = samples + 1,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts);
+END;
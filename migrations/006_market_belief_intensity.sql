@@ -0,0 +1,47 @@
+-- Persisted Belief Intensity
+-- Date: 2026-10-18
+-- Purpose: markets.belief_intensity kept current by triggers, plus one index
+--          per /api/v1/markets sort key, so listing ranks and paginates in
+--          SQL instead of scoring every open market in Python
+
+-- 1. Column + backfill
+-- Same formula as brain_algorithm.calculate_belief_intensity with the config.py
+-- weights: (volume_24h / 10000) * 0.6 + (1 - |0.5 - probability| * 2) * 0.4
+-- (re-run the backfill if those constants change)
+ALTER TABLE markets ADD COLUMN belief_intensity REAL NOT NULL DEFAULT 0;
+
+UPDATE markets SET belief_intensity =
+    (COALESCE(volume_24h, 0) / 10000.0) * 0.6 + (1 - ABS(0.5 - probability) * 2) * 0.4;
+
+-- 2. Triggers: recompute when the inputs change
+CREATE TRIGGER IF NOT EXISTS trg_markets_belief_intensity_insert
+AFTER INSERT ON markets
+BEGIN
+    UPDATE markets SET belief_intensity =
+        (COALESCE(NEW.volume_24h, 0) / 10000.0) * 0.6 + (1 - ABS(0.5 - NEW.probability) * 2) * 0.4
+    WHERE market_id = NEW.market_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_markets_belief_intensity_update
+AFTER UPDATE OF volume_24h, probability ON markets
+BEGIN
+    UPDATE markets SET belief_intensity =
+        (COALESCE(NEW.volume_24h, 0) / 10000.0) * 0.6 + (1 - ABS(0.5 - NEW.probability) * 2) * 0.4
+    WHERE market_id = NEW.market_id;
+END;
+
+-- 3. Keyset indexes per sort key: WHERE status = ? [AND category = ?]
+-- ORDER BY <key> DESC, market_id (NULL volume ranks as 0)
+CREATE INDEX IF NOT EXISTS idx_markets_status_belief
+    ON markets(status, belief_intensity DESC, market_id);
+CREATE INDEX IF NOT EXISTS idx_markets_status_volume_key
+    ON markets(status, COALESCE(volume_24h, 0) DESC, market_id);
+CREATE INDEX IF NOT EXISTS idx_markets_status_probability
+    ON markets(status, probability DESC, market_id);
+
+CREATE INDEX IF NOT EXISTS idx_markets_category_belief
+    ON markets(status, category, belief_intensity DESC, market_id);
+CREATE INDEX IF NOT EXISTS idx_markets_category_volume_key
+    ON markets(status, category, COALESCE(volume_24h, 0) DESC, market_id);
+CREATE INDEX IF NOT EXISTS idx_markets_category_probability
+    ON markets(status, category, probability DESC, market_id);
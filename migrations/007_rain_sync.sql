@@ -0,0 +1,56 @@
+-- Rain Mirror Sync
+-- Date: 2026-10-18
+-- Purpose: State for rain_sync.py, which mirrors Rain markets, options and
+--          trades into brain.db so request paths (and the BRain v1 scorer)
+--          read locally instead of calling the Rain API per request
+
+-- 1. rain_sync_state
+-- One row per stream. watermark: 'markets' = when the last complete pass
+-- started (the mirror is at least that fresh); 'trades' = newest mirrored
+-- trade as "<timestamp>|<trade_id>"
+CREATE TABLE IF NOT EXISTS rain_sync_state (
+    stream TEXT PRIMARY KEY,  -- 'markets', 'trades'
+    watermark TEXT,
+    last_success_at TEXT,
+    last_attempt_at TEXT,
+    last_error TEXT,
+    rows_synced INTEGER NOT NULL DEFAULT 0
+);
+
+-- 2. rain_sync_lease
+-- Only one process (gunicorn worker / cron) syncs at a time
+CREATE TABLE IF NOT EXISTS rain_sync_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT,
+    expires_at REAL NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO rain_sync_lease (id, owner, expires_at) VALUES (1, NULL, 0);
+
+-- 3. rain_market_mirror
+-- Markets that came from Rain, with fingerprints of what was last written:
+-- unchanged markets cost no writes (and no catalog/search trigger churn)
+CREATE TABLE IF NOT EXISTS rain_market_mirror (
+    market_id TEXT PRIMARY KEY,
+    content_fp TEXT NOT NULL,  -- title/description/category/type/status/dates/tags
+    quote_fp TEXT NOT NULL,    -- probability/volumes/participants
+    options_fp TEXT NOT NULL,  -- multi-option outcomes
+    synced_at TEXT NOT NULL
+);
+
+-- 4. rain_trades
+CREATE TABLE IF NOT EXISTS rain_trades (
+    trade_id TEXT PRIMARY KEY,
+    market_id TEXT NOT NULL,
+    outcome TEXT,
+    side TEXT,
+    amount REAL,
+    price REAL,
+    trader TEXT,
+    timestamp TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rain_trades_market_time
+    ON rain_trades(market_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_rain_trades_time
+    ON rain_trades(timestamp);
@@ -0,0 +1,30 @@
+-- Probability Delta Index
+-- Date: 2026-10-18
+-- Purpose: Per-market probability as of fixed offsets (1h/6h/24h/7d ago),
+--          advanced by VelocityComputer.record_current_probabilities, so
+--          odds changes and rising scores for every market come from one
+--          indexed read instead of two history lookups per market
+
+-- 1. market_probability_deltas
+-- prob_<offset> = probability of the latest market_probability_history
+-- snapshot recorded at or before (recorded_at - offset); at_<offset> is
+-- when that snapshot was taken. NULL until the market has one that old
+CREATE TABLE IF NOT EXISTS market_probability_deltas (
+    market_id TEXT PRIMARY KEY,
+    probability REAL,              -- at the last snapshot
+    recorded_at TIMESTAMP NOT NULL, -- last snapshot
+    prob_1h REAL,
+    at_1h TIMESTAMP,
+    prob_6h REAL,
+    at_6h TIMESTAMP,
+    prob_24h REAL,
+    at_24h TIMESTAMP,
+    prob_7d REAL,
+    at_7d TIMESTAMP
+);
+
+-- 2. History by time
+-- Each snapshot advances the offsets over the rows that crossed them since
+-- the previous one (a recorded_at range, across markets)
+CREATE INDEX IF NOT EXISTS idx_probability_history_time
+    ON market_probability_history(recorded_at);
@@ -0,0 +1,15 @@
+-- Sliding-Window Impression Counters
+-- Date: 2026-10-18
+-- Purpose: Hourly impression buckets per (user, market) so impressions_24h /
+--          impressions_7d are exact at read time, replacing the daily
+--          cleanup_old_impressions reset (counts only grew until it ran)
+
+-- 1. user_market_impressions: 7-day hourly ring
+-- impression_hours: 168 bytes, one count per hour (capped at 255), slot =
+-- epoch hour % 168; impression_hour: epoch hour of the newest slot. Slots
+-- more than 167 hours older than that are stale and read as 0.
+-- impressions_24h / impressions_7d stay, holding the counts as of the last
+-- write (ImpressionTracker reads the ring). Rows written before this
+-- migration keep their old counters until their next impression.
+ALTER TABLE user_market_impressions ADD COLUMN impression_hours BLOB;
+ALTER TABLE user_market_impressions ADD COLUMN impression_hour INTEGER;
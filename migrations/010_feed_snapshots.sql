@@ -0,0 +1,21 @@
+-- Shared Feed Snapshots
+-- Date: 2026-10-18
+-- Purpose: Ranked feed snapshots behind /api/brain/feed cursors, stored in
+--          brain.db so a cursor works on whichever gunicorn worker it
+--          reaches (in-process snapshots only worked on the worker that
+--          served page 1)
+
+-- 1. feed_snapshots
+-- payload: zlib-compressed JSON {geo_bucket, limit, hidden_ids,
+-- market_fields, sequence, pending}; items hold market_id/score/channel/
+-- reason_tags, markets are re-read from the catalog when a page is served.
+-- expires_at: unix time; pushed back on every page, swept on save
+CREATE TABLE IF NOT EXISTS feed_snapshots (
+    snapshot_id TEXT PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_feed_snapshots_expires
+    ON feed_snapshots(expires_at);
@@ -7,7 +7,6 @@ Implements full ranking algorithm from spec:
 
 Modified: Uses local SQLite database for market data
 """
-import sqlite3
 import math
 import random
 from datetime import datetime, timedelta
@@ -15,8 +14,20 @@ from typing import Dict, List, Optional
 from collections import defaultdict
 import json
 
+from db_pool import db_pool
+from market_catalog import market_catalog
+from tracking_engine import RAW_SCORE_SQL, live_topic_score
+from velocity_computer import load_probability_anchors
+
 DB_PATH = 'brain.db'  # Local database for all data
 
+# Market columns used for ranking (tags are always included)
+MARKET_FIELDS = (
+    'market_id', 'title', 'description', 'category', 'probability',
+    'volume_24h', 'volume_total', 'image_url', 'created_at',
+    'resolution_date', 'editorial_description'
+)
+
 # Ranking weights (from BRain spec)
 PERSONAL_WEIGHTS = {
     'interest': 0.35,
@@ -34,12 +45,15 @@ FINAL_WEIGHTS = {
     'editorial': 0.05
 }
 
+# 24h probability move that counts as fully rising (20 points)
+RISING_FULL_SHIFT = 0.20
+
 class PersonalizationEngine:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
     def _select_hero(self, ranked_markets: List[Dict]) -> List[Dict]:
         """
@@ -70,59 +84,17 @@ class PersonalizationEngine:
         return [hero_market]
     
     def _fetch_markets_from_db(self, limit: int = 200) -> List[Dict]:
-        """Fetch markets from local database"""
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        """Fetch open markets (by volume_total) from the shared in-memory catalog"""
+        markets = market_catalog.get_snapshot().open_markets(
+            order_by='volume_total',
+            limit=limit,
+            fields=MARKET_FIELDS
+        )
         
-        cursor.execute("""
-            SELECT 
-                m.market_id,
-                m.title,
-                m.description,
-                m.category,
-                m.probability,
-                m.volume_24h,
-                m.volume_total,
-                m.image_url,
-                m.created_at,
-                m.resolution_date,
-                m.editorial_description
-            FROM markets m
-            WHERE m.status = 'open'
-            ORDER BY m.volume_total DESC
-            LIMIT ?
-        """, (limit,))
-        
-        markets = []
-        for row in cursor.fetchall():
-            market_id = row[0]
-            market = {
-                'market_id': market_id,
-                'title': row[1],
-                'description': row[2],
-                'category': row[3],
-                'probability': row[4],
-                'volume_24h': row[5] or 0,
-                'volume_total': row[6] or 0,
-                'image_url': row[7],
-                'created_at': row[8],
-                'resolution_date': row[9],
-                'editorial_description': row[10],
-                'tags': []
-            }
-            
-            # Fetch tags for this market
-            cursor.execute("""
-                SELECT tag FROM market_tags
-                WHERE market_id = ?
-                ORDER BY tag
-            """, (market_id,))
-            
-            market['tags'] = [tag_row[0] for tag_row in cursor.fetchall()]
-            
-            markets.append(market)
+        for market in markets:
+            market['volume_24h'] = market['volume_24h'] or 0
+            market['volume_total'] = market['volume_total'] or 0
         
-        conn.close()
         return markets
     
     def get_personalized_feed(self, user_key: Optional[str] = None, limit: int = 20, user_country: Optional[str] = None) -> Dict:
@@ -202,14 +174,21 @@ class PersonalizationEngine:
         row = cursor.fetchone()
         user_geo = row[0] if row else None
         
+        # Per-market inputs, preloaded in one query each
+        # (trending blended localized + global based on user's geo)
+        trending_scores = self._get_trending_scores(cursor, user_geo)
+        belief_anchors = load_probability_anchors(cursor, [m['market_id'] for m in markets])
+        category_dwell = self._get_category_dwell(cursor, user_key)
+        seen_beliefs = self._get_seen_beliefs(cursor, user_key)
+        
         scored_markets = []
         for market in markets:
             # Calculate PersonalScore components
             interest = self._calculate_interest(market, user_scores)
             similarity = self._calculate_similarity(market, recent_viewed, user_scores)
-            depth = self._calculate_depth(cursor, user_key, market)
+            depth = self._calculate_depth(market, category_dwell)
             freshness = self._calculate_freshness(market)
-            followup = self._calculate_followup(cursor, user_key, market)
+            followup = self._calculate_followup(market, seen_beliefs)
             negative = self._calculate_negative(market, user_scores)
             diversity = 0.0  # Will apply after sorting
             
@@ -224,11 +203,10 @@ class PersonalizationEngine:
                 PERSONAL_WEIGHTS['diversity'] * diversity
             )
             
-            # Get trending score (blended localized + global based on user's geo)
-            trending = self._get_trending_score(cursor, market['market_id'], user_geo)
+            trending = trending_scores.get(market['market_id'], 0.0)
             
             # Get rising score (belief change)
-            rising = self._calculate_rising(market)
+            rising = self._calculate_rising(market, belief_anchors)
             
             # Editorial boost (placeholder)
             editorial = 0.0
@@ -311,9 +289,12 @@ class PersonalizationEngine:
         Global ranking (no personalization) - belief intensity + trending + NEWS BOOST
         Prioritizes fresh news items (politics, entertainment, world events)
         """
-        # Get brain.db connection for trending data
+        # Trending data from brain.db
         conn = self._get_conn()
         cursor = conn.cursor()
+        trending_scores = self._get_trending_scores(cursor)
+        belief_anchors = load_probability_anchors(cursor, [m['market_id'] for m in markets])
+        conn.close()
         
         # News categories that get freshness boost (including sports)
         NEWS_CATEGORIES = ['Politics', 'Entertainment', 'World', 'Crime', 'Economics', 'Culture',
@@ -327,10 +308,10 @@ class PersonalizationEngine:
             belief_intensity = volume_score * 0.6 + contestedness * 0.4
             
             # Trending
-            trending = self._get_trending_score(cursor, market['market_id'])
+            trending = trending_scores.get(market['market_id'], 0.0)
             
             # Rising
-            rising = self._calculate_rising(market)
+            rising = self._calculate_rising(market, belief_anchors)
             
             # NEWS BOOST: Prioritize fresh news items
             news_boost = 0.0
@@ -386,7 +367,6 @@ class PersonalizationEngine:
                 'geo_boost': geo_boost
             }
         
-        conn.close()
         markets.sort(key=lambda x: x['scores']['final'], reverse=True)
         
         # Enforce category diversity in top 9 (prevent sports-only feeds)
@@ -396,15 +376,18 @@ class PersonalizationEngine:
     
     def _get_user_scores(self, cursor, user_key: str) -> Dict:
         """Get user's category and tag scores"""
-        cursor.execute("""
-            SELECT topic_type, topic_value, score
+        cursor.execute(f"""
+            SELECT topic_type, topic_value, score, {RAW_SCORE_SQL}, last_updated
             FROM user_topic_scores
             WHERE user_key = ?
         """, (user_key,))
         
+        now = datetime.now()
+        
         scores = defaultdict(dict)
         for row in cursor.fetchall():
-            topic_type, topic_value, score = row
+            topic_type, topic_value, score, raw_score, last_updated = row
+            score = live_topic_score(score, raw_score, last_updated, now)  # Decay to now
             scores[topic_type][topic_value] = score / 100.0  # Normalize to 0-1
         
         return scores
@@ -459,7 +442,19 @@ class PersonalizationEngine:
         # (Full implementation would compare tags/taxonomy)
         return 0.5  # Placeholder
     
-    def _calculate_depth(self, cursor, user_key: str, market: Dict) -> float:
+    def _get_category_dwell(self, cursor, user_key: str) -> Dict[str, float]:
+        """User's average dwell time (ms) per market category"""
+        cursor.execute("""
+            SELECT m.category, AVG(CAST(ui.dwell_ms AS REAL)) as avg_dwell
+            FROM user_interactions ui
+            JOIN markets m ON ui.market_id = m.market_id
+            WHERE ui.user_key = ? AND ui.dwell_ms IS NOT NULL
+            GROUP BY m.category
+        """, (user_key,))
+        
+        return {category: avg_dwell for category, avg_dwell in cursor.fetchall() if category}
+    
+    def _calculate_depth(self, market: Dict, category_dwell: Dict[str, float]) -> float:
         """
         User engagement depth with similar markets
         """
@@ -467,16 +462,8 @@ class PersonalizationEngine:
         if not category:
             return 0.0
         
-        # Get average dwell time on similar category markets
-        cursor.execute("""
-            SELECT AVG(CAST(dwell_ms AS REAL)) as avg_dwell
-            FROM user_interactions ui
-            JOIN markets m ON ui.market_id = m.market_id
-            WHERE ui.user_key = ? AND m.category = ? AND ui.dwell_ms IS NOT NULL
-        """, (user_key, category))
-        
-        row = cursor.fetchone()
-        avg_dwell = row[0] if row and row[0] else 0
+        # Average dwell time on similar category markets
+        avg_dwell = category_dwell.get(category) or 0
         
         # Normalize (30s = 0.5, 60s = 1.0)
         return min(1.0, avg_dwell / 60000)
@@ -497,22 +484,24 @@ class PersonalizationEngine:
         except:
             return 0.5
     
-    def _calculate_followup(self, cursor, user_key: str, market: Dict) -> float:
+    def _get_seen_beliefs(self, cursor, user_key: str) -> Dict[str, Optional[float]]:
+        """Probability each market had when the user last saw it"""
+        cursor.execute("""
+            SELECT market_id, belief_at_view FROM seen_snapshots
+            WHERE user_key = ?
+        """, (user_key,))
+        
+        return dict(cursor.fetchall())
+    
+    def _calculate_followup(self, market: Dict, seen_beliefs: Dict[str, Optional[float]]) -> float:
         """
         Boost if meaningful change since last seen
         """
         market_id = market['market_id']
-        
-        cursor.execute("""
-            SELECT belief_at_view FROM seen_snapshots
-            WHERE user_key = ? AND market_id = ?
-        """, (user_key, market_id))
-        
-        row = cursor.fetchone()
-        if not row:
+        if market_id not in seen_beliefs:
             return 0.0  # Never seen before
         
-        belief_at_view = row[0]
+        belief_at_view = seen_beliefs[market_id]
         current_belief = market.get('probability', 0.5)
         
         # Check if changed by > 5%
@@ -540,47 +529,56 @@ class PersonalizationEngine:
         
         return penalty
     
-    def _get_trending_score(self, cursor, market_id: str, user_geo: Optional[str] = None) -> float:
+    def _get_trending_scores(self, cursor, user_geo: Optional[str] = None) -> Dict[str, float]:
         """
-        Get trending score from cache
-        Blends localized (70%) + global (30%) if user_geo available
+        Trending scores from cache, by market_id (missing = 0.0)
+        Blends localized (40%) + global (60%) if user_geo available
         """
-        # Get global trending
-        cursor.execute("""
-            SELECT score FROM trending_cache
-            WHERE market_id = ? AND scope = 'global' AND window = '24h'
-        """, (market_id,))
-        
-        row = cursor.fetchone()
-        global_score = row[0] if row else 0.0
-        
-        # If no geo or no localized data, return global only
+        # If no geo or no localized data, global only
         if not user_geo or user_geo in ['UNKNOWN', 'LOCAL', '']:
-            return global_score
+            cursor.execute("""
+                SELECT market_id, score FROM trending_cache
+                WHERE scope = 'global' AND window = '24h'
+            """)
+            return {market_id: score for market_id, score in cursor.fetchall()}
         
-        # Get localized trending for user's country
+        # Global and the user's country in one pass
         cursor.execute("""
-            SELECT score FROM trending_cache
-            WHERE market_id = ? AND scope = ? AND window = '24h'
-        """, (market_id, f'local:{user_geo}'))
-        
-        row = cursor.fetchone()
-        local_score = row[0] if row else 0.0
+            SELECT market_id, scope, score FROM trending_cache
+            WHERE scope IN ('global', ?) AND window = '24h'
+        """, (f'local:{user_geo}',))
+        
+        global_scores = {}
+        local_scores = {}
+        for market_id, scope, score in cursor.fetchall():
+            if scope == 'global':
+                global_scores[market_id] = score
+            else:
+                local_scores[market_id] = score
         
         # Blend: 40% local + 60% global (balance local relevance with global diversity)
         # Changed from 70/30 to prevent over-indexing on local markets
-        blended_score = 0.4 * local_score + 0.6 * global_score
-        
-        return blended_score
+        return {
+            market_id: 0.4 * local_scores.get(market_id, 0.0) + 0.6 * global_scores.get(market_id, 0.0)
+            for market_id in global_scores.keys() | local_scores.keys()
+        }
     
-    def _calculate_rising(self, market: Dict) -> float:
+    def _calculate_rising(self, market: Dict,
+                          belief_anchors: Optional[Dict[str, Dict[str, Optional[float]]]]) -> float:
         """
-        Belief shift magnitude (simplified)
+        Belief shift magnitude: probability move over the last 24h
+        belief_anchors: load_probability_anchors() result
         """
-        # TODO: Compare current probability to 24h ago
-        # For now, use contestedness as proxy
         prob = market.get('probability', 0.5)
-        return abs(0.5 - prob)
+        if belief_anchors is None:
+            # No delta index (migrations/008): contestedness as proxy
+            return abs(0.5 - prob)
+        
+        prob_24h_ago = belief_anchors.get(market['market_id'], {}).get('24h')
+        if prob_24h_ago is None:
+            return 0.0  # No snapshot that old yet
+        
+        return min(1.0, abs(prob - prob_24h_ago) / RISING_FULL_SHIFT)
     
     def _apply_diversity_penalty(self, markets: List[Dict]) -> List[Dict]:
         """
@@ -0,0 +1,232 @@
+"""
+BRain - Probability History Series
+Chart-sized probability_history for market detail pages and the API
+
+Raw history grows without bound for long-lived markets. A request asks for
+at most `points` points (optionally from `since`) and we read from the
+cheapest tier that still has enough detail:
+- raw probability_history, if the range holds few enough rows
+- otherwise the coarsest 1m / 1h / 1d rollup (migrations/005) that still
+  has `points` buckets in the range
+then LTTB-downsample to `points`, which keeps the peaks and dips a chart
+needs instead of every n-th point.
+
+Points keep the raw row shape ({probability, volume, timestamp}); rollup
+points add high/low and use the bucket's close as probability, timestamped
+with the close (last_ts) so they line up with raw points.
+"""
+import logging
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from db_pool import db_pool
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# Default chart size (detail page canvas) and the API's upper bound
+CHART_POINTS = 200
+MAX_POINTS = 5000
+
+# Read at most this many rows per requested point before downsampling
+OVERSAMPLE = 4
+
+# Rollup tiers, finest first: (resolution, bucket seconds)
+ROLLUP_TIERS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+
+# ?since= shorthand: 30m, 24h, 7d, 4w
+_RELATIVE_RE = re.compile(r'^(\d+)([mhdw])$')
+_RELATIVE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_since(value: Optional[str], now: Optional[datetime] = None) -> Optional[str]:
+    """
+    ISO timestamp (history format) for ?since=, or None if not given
+    Accepts an ISO date/time or a relative window like '24h' / '7d'
+    Raises: ValueError if unparseable
+    """
+    if not value:
+        return None
+
+    match = _RELATIVE_RE.match(value.strip())
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        start = (now or datetime.utcnow()) - timedelta(**{_RELATIVE_UNITS[unit]: amount})
+    else:
+        start = datetime.fromisoformat(value.strip().replace('Z', ''))
+    return start.isoformat()
+
+
+def _epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def lttb(points: Sequence[Dict], threshold: int, x_key: str = 'timestamp',
+         y_key: str = 'probability') -> List[Dict]:
+    """
+    Largest-Triangle-Three-Buckets downsampling to `threshold` points
+
+    Keeps the first and last point; from each bucket in between picks the
+    point forming the largest triangle with the previous pick and the next
+    bucket's average, so visual extremes survive.
+    """
+    count = len(points)
+    if threshold >= count:
+        return list(points)
+    threshold = max(threshold, 3)
+
+    xs = [_epoch(p[x_key]) for p in points]
+    ys = [p[y_key] for p in points]
+
+    sampled = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, count)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+
+        # Point in this bucket with the largest triangle
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best_area, best = -1.0, range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, j
+
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class ProbabilitySeries:
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._has_rollups: Optional[bool] = None
+
+        # Monitoring counters: reads per tier
+        self.reads = {'raw': 0, **{resolution: 0 for resolution, _ in ROLLUP_TIERS}}
+
+    def _get_conn(self):
+        conn = db_pool.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_series(self, market_id: str, points: int = CHART_POINTS,
+                   since: Optional[str] = None, conn=None) -> Dict:
+        """
+        Downsampled history for one market
+
+        since: ISO timestamp (see parse_since), or None for the whole history
+        conn: optional open connection to reuse (not closed here)
+        Returns: {'resolution': 'raw'|'1m'|'1h'|'1d', 'points': [...]}
+        """
+        points = max(3, min(points, MAX_POINTS))
+        own_conn = conn is None
+        if own_conn:
+            conn = self._get_conn()
+
+        try:
+            cursor = conn.cursor()
+            budget = points * OVERSAMPLE
+
+            raw = self._read_raw(cursor, market_id, since, budget + 1)
+            if len(raw) <= budget or not self._rollups_available(cursor):
+                if len(raw) > budget:
+                    # No rollups: full raw read (the old behaviour), still downsampled
+                    raw = self._read_raw(cursor, market_id, since, None)
+                self.reads['raw'] += 1
+                return {'resolution': 'raw', 'points': lttb(raw, points)}
+
+            resolution = self._pick_tier(cursor, market_id, since, points)
+            rows = self._read_rollup(cursor, market_id, resolution, since)
+            self.reads[resolution] += 1
+            return {'resolution': resolution, 'points': lttb(rows, points)}
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _read_raw(self, cursor, market_id: str, since: Optional[str],
+                  limit: Optional[int]) -> List[Dict]:
+        where, params = "market_id = ?", [market_id]
+        if since:
+            where += " AND timestamp >= ?"
+            params.append(since)
+        sql = f"""
+            SELECT probability, volume, timestamp
+            FROM probability_history
+            WHERE {where} AND timestamp IS NOT NULL
+            ORDER BY timestamp ASC
+        """
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _pick_tier(self, cursor, market_id: str, since: Optional[str], points: int) -> str:
+        """
+        Coarsest rollup that still has `points` buckets over the range
+        (so LTTB has real detail to choose from, while a finer tier is only
+        read when a coarser one would leave the chart short)
+        """
+        where, params = "market_id = ? AND resolution = '1d'", [market_id]
+        if since:
+            where += " AND bucket_start >= ?"
+            params.append(since[:10])
+        cursor.execute(f"""
+            SELECT MIN(first_ts), MAX(last_ts) FROM probability_rollups WHERE {where}
+        """, params)
+        first, last = cursor.fetchone()
+        if first is None:
+            return ROLLUP_TIERS[0][0]
+
+        span = _epoch(last) - max(_epoch(first), _epoch(since) if since else 0.0)
+        for resolution, seconds in reversed(ROLLUP_TIERS):
+            if span / seconds >= points:
+                return resolution
+        return ROLLUP_TIERS[0][0]
+
+    def _read_rollup(self, cursor, market_id: str, resolution: str,
+                     since: Optional[str]) -> List[Dict]:
+        where, params = "market_id = ? AND resolution = ?", [market_id, resolution]
+        if since:
+            where += " AND last_ts >= ?"
+            params.append(since)
+        cursor.execute(f"""
+            SELECT last_ts AS timestamp, close AS probability, volume, high, low
+            FROM probability_rollups
+            WHERE {where}
+            ORDER BY bucket_start ASC
+        """, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _rollups_available(self, cursor) -> bool:
+        """Whether migrations/005 is applied (checked once per process)"""
+        if self._has_rollups is None:
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'probability_rollups'
+            """)
+            self._has_rollups = cursor.fetchone() is not None
+            if not self._has_rollups:
+                logger.warning("probability_rollups missing (apply migrations/005_probability_rollups.sql); "
+                               "long histories are read raw")
+        return self._has_rollups
+
+    def stats(self) -> Dict:
+        return {'rollups_available': self._has_rollups, 'reads': dict(self.reads)}
+
+
+# Global instance
+probability_series = ProbabilitySeries()
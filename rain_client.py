@@ -1,30 +1,238 @@
 """
 Rain API Client
 Fetches data from Rain Protocol (mock or real)
+
+Built for many concurrent page requests against one upstream:
+- pooled keep-alive connections, bounded parallelism for batch/page fetches
+- in-process TTL + LRU cache; entries past their TTL are still served for
+  STALE_WHILE_REVALIDATE seconds while one background refresh runs, and up
+  to STALE_IF_ERROR seconds when Rain is failing
+- identical in-flight requests are coalesced into one upstream call
+- circuit breaker: after BREAKER_THRESHOLD consecutive failures calls skip
+  the network for BREAKER_COOLDOWN seconds, then one trial call decides
+
+Cached responses are shared between callers: treat them as read-only.
 """
 import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Connections / parallel requests to Rain (per process)
+MAX_CONCURRENCY = 8
+
+# (connect, read) seconds
+TIMEOUT = (2, 5)
+
+# Cache TTLs in seconds per kind of call (0 = never cached)
+MARKET_LIST_TTL = 15
+MARKET_TTL = 10
+TRADES_TTL = 5
+AGGREGATE_TTL = 60  # stats, leaderboard
+
+STALE_WHILE_REVALIDATE = 60
+STALE_IF_ERROR = 600
+CACHE_MAX_ENTRIES = 2048
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+
+# Page size for list_all_markets
+LIST_PAGE_SIZE = 100
+
+
+class RainAPIError(Exception):
+    """Rain unreachable or failing (raised by strict calls only)"""
+
+
 class RainClient:
     """Client for Rain Protocol API"""
     
     def __init__(self, base_url: str = "http://localhost:5000/api/v1"):
         self.base_url = base_url
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        self._pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='rain')
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='rain-refresh')
+        
+        self._cache: 'OrderedDict[tuple, tuple]' = OrderedDict()  # key -> (data, fetched_at)
+        self._inflight: Dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        
+        # Circuit breaker
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_running = False
+        
+        # Monitoring counters
+        self.requests = 0
+        self.errors = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.short_circuited = 0
+        self.breaker_trips = 0
+    
+    def _get(self, endpoint: str, params: dict = None, ttl: float = 0) -> dict:
+        """
+        Make GET request to Rain API
+        
+        With ttl > 0 the response is cached (see module docstring).
+        Returns {} on error when nothing usable is cached.
+        """
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        now = time.time()
+        
+        if ttl > 0:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    self._cache.move_to_end(key)
+            if entry is not None:
+                data, fetched_at = entry
+                age = now - fetched_at
+                if age < ttl:
+                    self.hits += 1
+                    return data
+                if age < ttl + STALE_WHILE_REVALIDATE:
+                    self.stale_hits += 1
+                    self._refresh_async(key, endpoint, params)
+                    return data
+        else:
+            entry = None
+        
+        data = self._fetch(key, endpoint, params, cache=ttl > 0)
+        if data is None:
+            # Failed: stale-if-error
+            if entry is not None and now - entry[1] < STALE_IF_ERROR:
+                self.stale_hits += 1
+                return entry[0]
+            return {}
+        return data
+    
+    def _fetch(self, key: tuple, endpoint: str, params: Optional[dict],
+               cache: bool) -> Optional[dict]:
+        """One upstream call per key at a time; None on failure"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not leader:
+            self.coalesced += 1
+            try:
+                return future.result(timeout=sum(TIMEOUT) + 1)
+            except Exception:
+                return None
+        
+        self._run(future, key, endpoint, params, cache)
+        return future.result()
+    
+    def _refresh_async(self, key: tuple, endpoint: str, params: Optional[dict]):
+        """Background refresh of a stale entry (skipped if one is running)"""
+        with self._lock:
+            if key in self._inflight:
+                return
+            future = Future()
+            self._inflight[key] = future
+        self._refresher.submit(self._run, future, key, endpoint, params, True)
+    
+    def _run(self, future: Future, key: tuple, endpoint: str, params: Optional[dict],
+             cache: bool):
+        """Leader side: request, cache and publish the result"""
+        data = None
+        try:
+            data = self._request(endpoint, params)
+            if data is not None and cache:
+                with self._lock:
+                    self._cache[key] = (data, time.time())
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > CACHE_MAX_ENTRIES:
+                        self._cache.popitem(last=False)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(data)
+    
+    def _request(self, endpoint: str, params: Optional[dict],
+                 strict: bool = False) -> Optional[dict]:
+        """
+        The actual HTTP call, behind the circuit breaker; None on failure
+        
+        strict: None only when Rain answers 404; any other failure (5xx,
+        timeout, open breaker, bad JSON) raises RainAPIError
+        """
+        if not self._breaker_allows():
+            self.short_circuited += 1
+            if strict:
+                raise RainAPIError(f"Rain circuit breaker open ({endpoint})")
+            return None
         
-    def _get(self, endpoint: str, params: dict = None) -> dict:
-        """Make GET request to Rain API"""
         url = f"{self.base_url}{endpoint}"
+        self.requests += 1
         try:
-            response = self.session.get(url, params=params, timeout=5)
+            response = self.session.get(url, params=params, timeout=TIMEOUT)
+            if response.status_code < 500:
+                # Rain answered: 4xx (e.g. unknown market) isn't an outage
+                self._record_success()
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
+            status = e.response.status_code if getattr(e, 'response', None) is not None else None
+            if status is None or status >= 500:
+                self._record_failure()
+            self.errors += 1
             logger.error(f"Rain API error: {e}")
-            return {}
+            if strict and status != 404:
+                raise RainAPIError(f"Rain request failed ({endpoint}): {e}") from e
+            return None
+        except ValueError as e:
+            self._record_failure()
+            self.errors += 1
+            logger.error(f"Rain API returned invalid JSON for {endpoint}: {e}")
+            if strict:
+                raise RainAPIError(f"Rain returned invalid JSON ({endpoint})") from e
+            return None
+    
+    def _breaker_allows(self) -> bool:
+        with self._lock:
+            if self._open_until == 0.0:
+                return True
+            if time.time() < self._open_until or self._trial_running:
+                return False
+            # Half-open: let one trial call through
+            self._trial_running = True
+            return True
+    
+    def _record_success(self):
+        with self._lock:
+            if self._open_until:
+                logger.info("Rain API recovered, closing circuit breaker")
+            self._failures = 0
+            self._open_until = 0.0
+            self._trial_running = False
+    
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= BREAKER_THRESHOLD:
+                if not self._trial_running:
+                    self.breaker_trips += 1
+                    logger.warning(f"Rain API failing ({self._failures} in a row), "
+                                   f"skipping calls for {BREAKER_COOLDOWN}s")
+                self._open_until = time.time() + BREAKER_COOLDOWN
+                self._trial_running = False
     
     def health(self) -> dict:
         """Check API health"""
@@ -59,22 +267,92 @@ class RainClient:
         if market_type:
             params['market_type'] = market_type
         
-        data = self._get("/markets", params)
+        data = self._get("/markets", params, ttl=MARKET_LIST_TTL)
         return data.get('markets', [])
     
-    def get_market(self, market_id: str) -> Optional[Dict]:
+    def get_market(self, market_id: str, cached: bool = True,
+                   strict: bool = False) -> Optional[Dict]:
         """
         Get market details
         
         Args:
             market_id: Market identifier
+            cached: False to bypass the cache
+            strict: uncached; None only if Rain answers 404, RainAPIError
+                on any other failure (None otherwise also means "failed")
         
         Returns:
             Market data or None
         """
-        data = self._get(f"/markets/{market_id}")
+        if strict:
+            endpoint = f"/markets/{market_id}"
+            data = self._request(endpoint, None, strict=True)
+            if data is None:
+                return None
+            if 'market' not in data:
+                raise RainAPIError(f"Rain returned no market ({endpoint})")
+            return data['market']
+        
+        data = self._get(f"/markets/{market_id}", ttl=MARKET_TTL if cached else 0)
         return data.get('market')
     
+    def get_markets(self, market_ids: List[str], cached: bool = True,
+                    strict: bool = False) -> List[Dict]:
+        """
+        Get several markets' details, fetched in parallel
+        (at most MAX_CONCURRENCY requests at a time, cached like get_market)
+        
+        Args:
+            market_ids: Market identifiers
+            cached: False to bypass the cache
+            strict: as for get_market; skipped IDs are then exactly the
+                ones Rain doesn't know
+        
+        Returns:
+            Markets in market_ids order (unknown IDs skipped)
+        """
+        markets = self._pool.map(lambda market_id: self.get_market(market_id, cached, strict),
+                                 market_ids)
+        return [market for market in markets if market]
+    
+    def list_all_markets(self, status: str = "open", page_size: int = LIST_PAGE_SIZE,
+                         cached: bool = True, strict: bool = False) -> List[Dict]:
+        """
+        Every market with this status: the first page gives the total, the
+        remaining pages are fetched in parallel
+        
+        Args:
+            cached: False to bypass the cache (mirroring needs current data)
+            strict: raise RainAPIError if any page fails, instead of
+                returning what could be fetched
+        
+        Returns:
+            List of markets (Rain order)
+        """
+        ttl = MARKET_LIST_TTL if cached else 0
+        
+        def page(offset):
+            data = self._get("/markets", {'status': status, 'limit': page_size, 'offset': offset}, ttl=ttl)
+            if 'markets' not in data and strict:
+                raise RainAPIError(f"Rain market list failed (status={status}, offset={offset})")
+            return data
+        
+        first = page(0)
+        markets = list(first.get('markets', []))
+        total = first.get('total')
+        
+        if total is None:
+            # No total from Rain: walk the pages
+            offset = page_size
+            while len(markets) == offset:
+                markets.extend(page(offset).get('markets', []))
+                offset += page_size
+            return markets
+        
+        for data in self._pool.map(page, range(page_size, total, page_size)):
+            markets.extend(data.get('markets', []))
+        return markets
+    
     def get_user_positions(self, user_id: str) -> Dict:
         """
         Get user's positions
@@ -87,17 +365,18 @@ class RainClient:
         """
         return self._get(f"/user/{user_id}/positions")
     
-    def list_trades(self, limit: int = 50) -> List[Dict]:
+    def list_trades(self, limit: int = 50, cached: bool = True) -> List[Dict]:
         """
         Get recent trades
         
         Args:
             limit: Number of trades
+            cached: False to bypass the cache
         
         Returns:
             List of trades
         """
-        data = self._get("/trades", {'limit': limit})
+        data = self._get("/trades", {'limit': limit}, ttl=TRADES_TTL if cached else 0)
         return data.get('trades', [])
     
     def get_leaderboard(self, limit: int = 10) -> List[Dict]:
@@ -110,7 +389,7 @@ class RainClient:
         Returns:
             Leaderboard data
         """
-        data = self._get("/leaderboard", {'limit': limit})
+        data = self._get("/leaderboard", {'limit': limit}, ttl=AGGREGATE_TTL)
         return data.get('leaderboard', [])
     
     def get_platform_stats(self) -> Dict:
@@ -120,7 +399,7 @@ class RainClient:
         Returns:
             Platform stats
         """
-        return self._get("/stats")
+        return self._get("/stats", ttl=AGGREGATE_TTL)
     
     def convert_to_brain_format(self, rain_market: Dict) -> Dict:
         """
@@ -135,8 +414,9 @@ class RainClient:
         # Extract top options for multi-option markets
         top_options = None
         if rain_market.get('market_type') == 'multiple':
-            outcomes = rain_market.get('outcomes', [])
-            outcomes.sort(key=lambda x: x['probability'], reverse=True)
+            # sorted(), not sort(): rain_market may be a shared cached object
+            outcomes = sorted(rain_market.get('outcomes', []),
+                              key=lambda x: x['probability'], reverse=True)
             top_options = [
                 {
                     'option_id': f"opt_{i}",
@@ -177,6 +457,24 @@ class RainClient:
             'belief_intensity': self._calculate_belief_intensity(rain_market)
         }
     
+    def stats(self) -> Dict:
+        """Cache, coalescing and circuit breaker counters for monitoring"""
+        lookups = self.hits + self.stale_hits + self.requests
+        return {
+            'base_url': self.base_url,
+            'requests': self.requests,
+            'errors': self.errors,
+            'cache_entries': len(self._cache),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'hit_rate': round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'breaker_open': time.time() < self._open_until,
+            'breaker_trips': self.breaker_trips,
+            'short_circuited': self.short_circuited
+        }
+    
     def _calculate_belief_intensity(self, market: Dict) -> float:
         """Calculate BRain belief intensity score"""
         volume_score = market['volume_24h'] / 10000
@@ -9,6 +9,7 @@ class RainClient:
     def __init__(self, base_url: str = "http://localhost:5001"):
         self.base_url = base_url
         self.timeout = 5  # seconds
+        self.session = requests.Session()  # keep-alive between calls
     
     def get_markets(self, status: str = 'open', category: Optional[str] = None, 
                    limit: int = 100, offset: int = 0) -> List[Dict]:
@@ -24,7 +25,7 @@ class RainClient:
             params['category'] = category
         
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/api/v1/markets",
                 params=params,
                 timeout=self.timeout
@@ -38,7 +39,7 @@ class RainClient:
     def get_market(self, market_id: str) -> Optional[Dict]:
         """Get single market by ID"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/api/v1/markets/{market_id}",
                 timeout=self.timeout
             )
@@ -51,7 +52,7 @@ class RainClient:
     def get_markets_batch(self, market_ids: List[str]) -> List[Dict]:
         """Get multiple markets by IDs"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/v1/markets/batch",
                 json={'market_ids': market_ids},
                 timeout=self.timeout
@@ -65,7 +66,7 @@ class RainClient:
     def health_check(self) -> bool:
         """Check if Rain API is healthy"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/health",
                 timeout=self.timeout
             )
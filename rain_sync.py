@@ -0,0 +1,504 @@
+"""
+BRain - Rain Mirror Sync
+Keeps brain.db a mirror of Rain (markets, options, tags, trades), so with
+USE_RAIN_API every request path, the catalog and the BRain v1 scorer read
+locally instead of calling Rain per request
+
+Each pass:
+- markets: the open list (pages fetched in parallel) is fingerprinted
+  against rain_market_mirror and only new or changed markets are written,
+  in bulk, with a probability_history point whenever the quote moved.
+  Mirrored markets that left the open list get their final status from the
+  detail endpoint (closed only on a 404; any other failure aborts
+  the pass, which is retried)
+- trades: rows past the (timestamp, trade_id) watermark are appended
+
+Rain has no change feed, so the diff is what makes it incremental: a quiet
+pass reads Rain but writes nothing (and bumps no catalog version). Writes
+go in one transaction per pass; the catalog picks them up through the
+migration 002 change log.
+
+Requires migrations/007_rain_sync.sql. Run in-process (start()) or as a
+loop: python rain_sync.py
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from db_pool import db_pool
+from rain_client import RainAPIError
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# Seconds between passes
+SYNC_INTERVAL = 15
+
+# A pass must finish within this or another process may take over
+LEASE_SECONDS = SYNC_INTERVAL * 4
+
+# Trades fetched per pass (newest first from Rain)
+TRADES_PAGE = 500
+
+CONTENT_FIELDS = ('title', 'description', 'category', 'market_type', 'status',
+                  'created_at', 'resolution_date')
+QUOTE_FIELDS = ('probability', 'volume_24h', 'volume_total', 'participant_count')
+
+_CHUNK_SIZE = 500
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def _chunks(items: List[str], size: int = _CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def normalize_market(rain_market: Dict) -> Dict:
+    """
+    Rain market (list or detail payload) -> markets row, tags and options,
+    with the fingerprints rain_market_mirror compares
+    """
+    market_id = rain_market['market_id']
+    row = {field: rain_market.get(field) for field in CONTENT_FIELDS + QUOTE_FIELDS}
+    row['status'] = row['status'] or 'open'
+    row['market_type'] = row['market_type'] or 'binary'
+    for field in ('volume_24h', 'volume_total', 'participant_count'):
+        row[field] = row[field] or 0
+
+    category = rain_market.get('category')
+    tags = sorted(set(rain_market.get('tags') or ([category.lower()] if category else [])))
+
+    # Multi-option outcomes ('options' from rain_api.py, 'outcomes' from the mock)
+    options = []
+    if row['market_type'] == 'multiple':
+        for position, option in enumerate(rain_market.get('options') or rain_market.get('outcomes') or []):
+            options.append((
+                option.get('option_id') or f"{market_id}_opt{position}",
+                market_id,
+                option.get('option_text') or option.get('name'),
+                option.get('probability') or 0,
+                position
+            ))
+
+    # Stable per market (hash() is salted per process)
+    image_url = rain_market.get('image_url') or \
+        f"https://picsum.photos/seed/{zlib.crc32(market_id.encode('utf-8')) % 1000}/800/400"
+
+    return {
+        'market_id': market_id,
+        'row': row,
+        'image_url': image_url,
+        'tags': tags,
+        'options': options,
+        'content_fp': _fingerprint([row[field] for field in CONTENT_FIELDS] + [tags]),
+        'quote_fp': _fingerprint([row[field] for field in QUOTE_FIELDS]),
+        'options_fp': _fingerprint(options)
+    }
+
+
+class RainSync:
+    def __init__(self, db_path: str = DB_PATH, interval: float = SYNC_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self.rain_client = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Monitoring counters (this process)
+        self.passes = 0
+        self.skipped = 0
+        self.failures = 0
+        self.markets_inserted = 0
+        self.markets_updated = 0
+        self.quotes_updated = 0
+        self.markets_closed = 0
+        self.history_points = 0
+        self.trades_inserted = 0
+        self.trade_gaps = 0
+        self.last_pass_ms = 0.0
+
+    def _get_conn(self):
+        return db_pool.connect(self.db_path)
+
+    def use_rain(self, rain_client):
+        """Mirror from this client"""
+        self.rain_client = rain_client
+
+    def sync_once(self) -> Dict:
+        """
+        One pass, if this process holds the lease
+        Returns: counts for the pass ({'leader': False} if another process syncs)
+        """
+        with self._lock:
+            if not self._acquire_lease():
+                self.skipped += 1
+                return {'leader': False}
+
+            start = time.time()
+            started_at = datetime.now().isoformat()
+            try:
+                result = self._sync(started_at)
+            except Exception as e:
+                self.failures += 1
+                self._record_error(started_at, e)
+                raise
+
+            self.passes += 1
+            self.last_pass_ms = (time.time() - start) * 1000
+            result['duration_ms'] = round(self.last_pass_ms, 1)
+            return result
+
+    def _sync(self, started_at: str) -> Dict:
+        # Network first, outside any transaction
+        rain_markets = self.rain_client.list_all_markets(cached=False, strict=True)
+        trades = self.rain_client.list_trades(limit=TRADES_PAGE, cached=False)
+
+        current = {}
+        for rain_market in rain_markets:
+            market = normalize_market(rain_market)
+            current[market['market_id']] = market
+
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            mirror = {
+                row[0]: row[1:] for row in
+                cursor.execute("SELECT market_id, content_fp, quote_fp, options_fp FROM rain_market_mirror")
+            }
+            vanished = self._vanished_open(cursor, [mid for mid in mirror if mid not in current])
+        finally:
+            conn.close()
+
+        # Mirrored markets no longer listed as open: final status from details.
+        # Strict: only a 404 closes a market; any other failure aborts the
+        # pass (RainAPIError), so a flaky page can't close open markets
+        closed_ids = []
+        if vanished:
+            details = {m['market_id']: m for m in
+                       self.rain_client.get_markets(vanished, cached=False, strict=True)}
+            for market_id in vanished:
+                if market_id in details:
+                    current[market_id] = normalize_market(details[market_id])
+                else:
+                    closed_ids.append(market_id)
+
+        inserts, content_updates, quote_updates, option_updates = [], [], [], []
+        for market_id, market in current.items():
+            previous = mirror.get(market_id)
+            if previous is None:
+                inserts.append(market)
+                continue
+            content_fp, quote_fp, options_fp = previous
+            if market['content_fp'] != content_fp:
+                content_updates.append(market)
+            elif market['quote_fp'] != quote_fp:
+                quote_updates.append(market)
+            if market['options_fp'] != options_fp:
+                option_updates.append(market)
+
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+
+            history = self._write_markets(cursor, started_at, inserts, content_updates,
+                                          quote_updates, option_updates, mirror)
+            if closed_ids:
+                cursor.executemany("UPDATE markets SET status = 'closed' WHERE market_id = ?",
+                                   [(mid,) for mid in closed_ids])
+                # Forget the content fingerprint, so a market Rain lists
+                # again is reopened
+                cursor.executemany("""
+                    UPDATE rain_market_mirror SET content_fp = 'closed', synced_at = ?
+                    WHERE market_id = ?
+                """, [(started_at, mid) for mid in closed_ids])
+            trades_inserted = self._write_trades(cursor, trades)
+
+            changed = len(inserts) + len(content_updates) + len(quote_updates) + len(closed_ids)
+            self._record_success(cursor, 'markets', started_at, changed)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self.markets_inserted += len(inserts)
+        self.markets_updated += len(content_updates)
+        self.quotes_updated += len(quote_updates)
+        self.markets_closed += len(closed_ids)
+        self.history_points += history
+        self.trades_inserted += trades_inserted
+
+        return {
+            'leader': True,
+            'markets_seen': len(rain_markets),
+            'inserted': len(inserts),
+            'updated': len(content_updates),
+            'quotes_updated': len(quote_updates),
+            'options_updated': len(option_updates),
+            'closed': len(closed_ids),
+            'history_points': history,
+            'trades_inserted': trades_inserted
+        }
+
+    def _vanished_open(self, cursor, market_ids: List[str]) -> List[str]:
+        """Of these mirrored markets, the ones still open locally"""
+        still_open = []
+        for chunk in _chunks(market_ids):
+            cursor.execute(f"""
+                SELECT market_id FROM markets
+                WHERE status = 'open' AND market_id IN ({','.join('?' for _ in chunk)})
+            """, chunk)
+            still_open.extend(row[0] for row in cursor.fetchall())
+        return still_open
+
+    def _write_markets(self, cursor, now: str, inserts: List[Dict], content_updates: List[Dict],
+                       quote_updates: List[Dict], option_updates: List[Dict], mirror: Dict) -> int:
+        """Bulk upserts; returns the number of probability_history points appended"""
+        columns = CONTENT_FIELDS + QUOTE_FIELDS
+
+        if inserts:
+            # Upsert: the market may predate the mirror in brain.db
+            cursor.executemany(f"""
+                INSERT INTO markets (market_id, {', '.join(columns)}, image_url)
+                VALUES (?, {', '.join('?' for _ in columns)}, ?)
+                ON CONFLICT(market_id) DO UPDATE SET
+                    {', '.join(f'{c} = excluded.{c}' for c in columns)}
+            """, [
+                (m['market_id'], *(m['row'][c] for c in columns), m['image_url']) for m in inserts
+            ])
+
+        if content_updates:
+            cursor.executemany(f"""
+                UPDATE markets SET {', '.join(f'{c} = ?' for c in columns)}
+                WHERE market_id = ?
+            """, [(*(m['row'][c] for c in columns), m['market_id']) for m in content_updates])
+
+        if quote_updates:
+            cursor.executemany(f"""
+                UPDATE markets SET {', '.join(f'{c} = ?' for c in QUOTE_FIELDS)}
+                WHERE market_id = ?
+            """, [(*(m['row'][c] for c in QUOTE_FIELDS), m['market_id']) for m in quote_updates])
+
+        # Tags follow content; options are replaced when they changed
+        retagged = inserts + content_updates
+        if retagged:
+            cursor.executemany("DELETE FROM market_tags WHERE market_id = ?",
+                               [(m['market_id'],) for m in retagged])
+            cursor.executemany("INSERT OR IGNORE INTO market_tags (market_id, tag) VALUES (?, ?)",
+                               [(m['market_id'], tag) for m in retagged for tag in m['tags']])
+
+        reoptioned = [m for m in inserts if m['options']] + option_updates
+        if reoptioned:
+            cursor.executemany("DELETE FROM market_options WHERE market_id = ?",
+                               [(m['market_id'],) for m in reoptioned])
+            cursor.executemany("""
+                INSERT OR REPLACE INTO market_options (option_id, market_id, option_text, probability, position)
+                VALUES (?, ?, ?, ?, ?)
+            """, [option for m in reoptioned for option in m['options']])
+
+        # History point for every new quote (content-only changes keep the quote)
+        quoted = inserts + quote_updates + [
+            m for m in content_updates if m['quote_fp'] != mirror[m['market_id']][1]
+        ]
+        cursor.executemany("""
+            INSERT INTO probability_history (market_id, probability, volume, timestamp)
+            VALUES (?, ?, ?, ?)
+        """, [(m['market_id'], m['row']['probability'], m['row']['volume_24h'], now) for m in quoted])
+
+        written = inserts + content_updates + quote_updates + option_updates
+        cursor.executemany("""
+            INSERT INTO rain_market_mirror (market_id, content_fp, quote_fp, options_fp, synced_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(market_id) DO UPDATE SET
+                content_fp = excluded.content_fp,
+                quote_fp = excluded.quote_fp,
+                options_fp = excluded.options_fp,
+                synced_at = excluded.synced_at
+        """, [(m['market_id'], m['content_fp'], m['quote_fp'], m['options_fp'], now) for m in written])
+
+        return len(quoted)
+
+    def _write_trades(self, cursor, trades: List[Dict]) -> int:
+        """Append trades past the watermark; returns rows inserted"""
+        cursor.execute("SELECT watermark FROM rain_sync_state WHERE stream = 'trades'")
+        row = cursor.fetchone()
+        watermark = tuple(row[0].split('|', 1)) if row and row[0] else None
+
+        fresh = sorted(
+            (t for t in trades if t.get('trade_id') and t.get('timestamp')),
+            key=lambda t: (t['timestamp'], t['trade_id'])
+        )
+        if watermark is not None:
+            if fresh and (fresh[0]['timestamp'], fresh[0]['trade_id']) > watermark and \
+                    len(fresh) >= TRADES_PAGE:
+                # Whole page is newer than the watermark: trades in between were missed
+                self.trade_gaps += 1
+                logger.warning(f"Rain trades: more than {TRADES_PAGE} new trades since last pass, gap possible")
+            fresh = [t for t in fresh if (t['timestamp'], t['trade_id']) > watermark]
+
+        if not fresh:
+            return 0
+
+        before = cursor.connection.total_changes
+        cursor.executemany("""
+            INSERT OR IGNORE INTO rain_trades
+                (trade_id, market_id, outcome, side, amount, price, trader, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (t['trade_id'], t.get('market_id'), t.get('outcome'), t.get('side'),
+             t.get('amount'), t.get('price'), t.get('user'), t['timestamp'])
+            for t in fresh
+        ])
+        inserted = cursor.connection.total_changes - before
+
+        newest = fresh[-1]
+        self._record_success(cursor, 'trades', f"{newest['timestamp']}|{newest['trade_id']}", inserted)
+        return inserted
+
+    def _record_success(self, cursor, stream: str, watermark: str, rows: int):
+        now = datetime.now().isoformat()
+        cursor.execute("""
+            INSERT INTO rain_sync_state (stream, watermark, last_success_at, last_attempt_at, last_error, rows_synced)
+            VALUES (?, ?, ?, ?, NULL, ?)
+            ON CONFLICT(stream) DO UPDATE SET
+                watermark = excluded.watermark,
+                last_success_at = excluded.last_success_at,
+                last_attempt_at = excluded.last_attempt_at,
+                last_error = NULL,
+                rows_synced = rows_synced + excluded.rows_synced
+        """, (stream, watermark, now, now, rows))
+
+    def _record_error(self, started_at: str, error: Exception):
+        level = logging.WARNING if isinstance(error, RainAPIError) else logging.ERROR
+        logger.log(level, f"Rain sync pass failed: {error}", exc_info=level == logging.ERROR)
+        try:
+            conn = self._get_conn()
+            try:
+                conn.execute("""
+                    INSERT INTO rain_sync_state (stream, last_attempt_at, last_error)
+                    VALUES ('markets', ?, ?)
+                    ON CONFLICT(stream) DO UPDATE SET
+                        last_attempt_at = excluded.last_attempt_at,
+                        last_error = excluded.last_error
+                """, (started_at, str(error)[:500]))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _acquire_lease(self) -> bool:
+        """Take or extend the single-writer lease"""
+        now = time.time()
+        conn = self._get_conn()
+        try:
+            cursor = conn.execute("""
+                UPDATE rain_sync_lease
+                SET owner = ?, expires_at = ?
+                WHERE id = 1 AND (owner = ? OR owner IS NULL OR expires_at < ?)
+            """, (self.owner, now + LEASE_SECONDS, self.owner, now))
+            conn.commit()
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start the background sync loop (idempotent)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rain-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception:
+                pass  # logged and recorded in rain_sync_state by sync_once
+            self._stop.wait(self.interval)
+
+    def lag_seconds(self) -> Optional[float]:
+        """Age of the mirror: seconds since the last complete pass started"""
+        conn = self._get_conn()
+        try:
+            row = conn.execute("SELECT watermark FROM rain_sync_state WHERE stream = 'markets'").fetchone()
+        finally:
+            conn.close()
+        if not row or not row[0]:
+            return None
+        return round(time.time() - datetime.fromisoformat(row[0]).timestamp(), 1)
+
+    def stats(self) -> Dict:
+        """Sync lag, per-stream state and write counts for monitoring"""
+        conn = self._get_conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            streams = {
+                row['stream']: dict(row) for row in
+                conn.execute("SELECT * FROM rain_sync_state")
+            }
+            lease = conn.execute("SELECT owner, expires_at FROM rain_sync_lease WHERE id = 1").fetchone()
+        finally:
+            conn.close()
+
+        return {
+            'running': self.running,
+            'leader': bool(lease) and lease['owner'] == self.owner and lease['expires_at'] > time.time(),
+            'lag_seconds': self.lag_seconds(),
+            'streams': streams,
+            'passes': self.passes,
+            'skipped': self.skipped,
+            'failures': self.failures,
+            'markets_inserted': self.markets_inserted,
+            'markets_updated': self.markets_updated,
+            'quotes_updated': self.quotes_updated,
+            'markets_closed': self.markets_closed,
+            'history_points': self.history_points,
+            'trades_inserted': self.trades_inserted,
+            'trade_gaps': self.trade_gaps,
+            'last_pass_ms': round(self.last_pass_ms, 1)
+        }
+
+
+# Global instance
+rain_sync = RainSync()
+
+
+if __name__ == '__main__':
+    from config import RAIN_API_URL
+    from rain_client import RainClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    rain_sync.use_rain(RainClient(RAIN_API_URL))
+    print(f"🌧️  Mirroring {RAIN_API_URL} into {DB_PATH} every {SYNC_INTERVAL}s")
+    while True:
+        try:
+            print(rain_sync.sync_once())
+        except Exception as e:
+            print(f"❌ Sync pass failed: {e}")
+        time.sleep(SYNC_INTERVAL)
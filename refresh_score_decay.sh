@@ -4,8 +4,12 @@
 
 cd /home/ubuntu/.openclaw/workspace/currents-full-local
 
-# Calculate decay factor: 5% per 7 days = 0.9928 per day
-# Formula: (0.95)^(1/7) = 0.992754
+# Learned scores (raw_score set) decay lazily from raw_score/last_updated at
+# read time (tracking_engine.live_topic_score); this job only materializes the
+# decayed value into the score column for ORDER BY score / dashboards.
+# Seeded rows (no interactions, raw_score NULL or its DEFAULT 0.0) keep the
+# old multiplicative decay:
+# 5% per 7 days = 0.9928 per day, (0.95)^(1/7) = 0.992754
 DECAY_FACTOR=0.992754
 
 /home/linuxbrew/.linuxbrew/bin/python3 << EOF
@@ -13,34 +17,50 @@ import sqlite3
 import logging
 from datetime import datetime
 
+from tracking_engine import register_score_functions
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DB_PATH = 'brain.db'
 DECAY_FACTOR = $DECAY_FACTOR
 
+conn = None
 try:
     conn = sqlite3.connect(DB_PATH)
+    register_score_functions(conn)
     cursor = conn.cursor()
     
-    # Apply decay to user_topic_scores
+    # Materialize lazily-decayed scores (raw_score/last_updated unchanged)
+    now = datetime.now().isoformat()
+    cursor.execute("""
+        UPDATE user_topic_scores
+        SET score = topic_norm(topic_decay(raw_score, last_updated, ?))
+        WHERE interactions > 0
+    """, (now,))
+    materialized = cursor.rowcount
+    
+    # Apply decay to seeded scores
     cursor.execute("""
         UPDATE user_topic_scores
         SET score = score * ?
-        WHERE score > 0
+        WHERE score > 0 AND (interactions IS NULL OR interactions = 0)
     """, (DECAY_FACTOR,))
     
     rows_updated = cursor.rowcount
     conn.commit()
     
-    logger.info(f"Score decay applied: {rows_updated} scores updated with factor {DECAY_FACTOR}")
-    print(f"{datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')} - Score decay: {rows_updated} scores updated")
+    logger.info(f"Score decay applied: {materialized} scores materialized, "
+                f"{rows_updated} seeded scores updated with factor {DECAY_FACTOR}")
+    print(f"{datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')} - Score decay: "
+          f"{materialized} materialized, {rows_updated} seeded scores updated")
     
 except Exception as e:
     logger.error(f"Score decay failed: {e}")
     print(f"ERROR: {e}")
 finally:
-    conn.close()
+    if conn is not None:
+        conn.close()
 EOF
 
 echo "$(date -u '+%Y-%m-%d %H:%M UTC') - Score decay completed" >> /tmp/score_decay.log
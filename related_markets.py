@@ -0,0 +1,459 @@
+"""
+BRain - Related Markets Index
+Precomputed top-K tag-similar markets for the market detail page
+
+Each market is a sparse tag vector: its own tags weighted by IDF, plus tags
+users engage with alongside them (tag_cooccurrence) at a reduced weight.
+Neighbours are the open markets with the highest cosine similarity, found
+through a tag -> markets inverted index and stored per market, so
+get_related() is a dict lookup instead of an IN (...) / COUNT(DISTINCT tag)
+join per page view.
+
+The index follows the market source in the background:
+- local mode: the market catalog snapshot. When tags or status change, only
+  the changed markets and the markets sharing a (non-common) tag with them
+  are re-ranked; IDF stays frozen between full rebuilds
+- Rain mode: the Rain market list, re-fetched every RAIN_REFRESH_INTERVAL
+A full rebuild (fresh IDF + co-occurrence) runs every FULL_REBUILD_INTERVAL.
+Neighbours that closed or disappeared since are skipped at lookup, which is
+why more than the 3 shown on the page are stored.
+"""
+import heapq
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from db_pool import db_pool
+from market_catalog import market_catalog
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'brain.db'
+
+# Neighbours stored per market
+RELATED_TOP_K = 10
+
+# Co-occurring tags added to a market's vector, per own tag, and their weight
+# relative to an own tag (scaled by how often the pair co-occurs)
+COOC_PARTNERS = 3
+COOC_WEIGHT = 0.3
+COOC_MIN_COUNT = 2
+
+# Tags on more open markets than this ("politics", "crypto") don't generate
+# candidates (they still count in the similarity). They only fill in with their
+# COMMON_TAG_FILL most traded markets when rarer tags find fewer than top-K.
+COMMON_TAG_MARKETS = 500
+COMMON_TAG_FILL = 50
+
+# More changed markets than this fraction of the catalog: rebuild everything
+INCREMENTAL_MAX_FRACTION = 0.1
+
+# Seconds between refresh checks / full rebuilds / Rain re-fetches
+REFRESH_INTERVAL = 2.0
+FULL_REBUILD_INTERVAL = 3600
+RAIN_REFRESH_INTERVAL = 300
+
+# Rain market list page size
+RAIN_PAGE_SIZE = 100
+
+
+def load_tag_affinity(cursor) -> Dict[str, Tuple[Tuple[str, float], ...]]:
+    """
+    {tag: ((partner_tag, weight), ...)} from tag_cooccurrence
+
+    weight = COOC_WEIGHT * count / (tag's strongest pair count), top
+    COOC_PARTNERS partners per tag; empty if the table is missing
+    """
+    try:
+        cursor.execute("""
+            SELECT tag_a, tag_b, count FROM tag_cooccurrence
+            WHERE count >= ? AND tag_a != tag_b
+        """, (COOC_MIN_COUNT,))
+    except sqlite3.OperationalError:
+        return {}
+
+    pairs = defaultdict(list)
+    for tag_a, tag_b, count in cursor.fetchall():
+        pairs[tag_a].append((count, tag_b))
+        pairs[tag_b].append((count, tag_a))
+
+    affinity = {}
+    for tag, partners in pairs.items():
+        top = heapq.nlargest(COOC_PARTNERS, partners)
+        strongest = top[0][0]
+        affinity[tag] = tuple((partner, COOC_WEIGHT * count / strongest) for count, partner in top)
+    return affinity
+
+
+def _tag_key(market: Mapping) -> Tuple:
+    """What the index depends on: tags and whether the market is a candidate"""
+    return tuple(market.get('tags') or ()), market.get('status') == 'open'
+
+
+def _volume(market: Mapping) -> float:
+    return market.get('volume_total') or market.get('volume_24h') or 0.0
+
+
+class RelatedIndex:
+    """
+    Tag vectors, inverted index and stored neighbours for one market set
+
+    Not thread-safe for writers: RelatedMarkets builds or updates a copy and
+    swaps it in, readers only call related_ids().
+    """
+
+    def __init__(self, markets: Mapping[str, Mapping], affinity: Mapping, top_k: int = RELATED_TOP_K):
+        self.top_k = top_k
+        self.affinity = affinity
+        self.built_at = time.time()
+
+        self.keys: Dict[str, Tuple] = {}
+        self.volumes: Dict[str, float] = {}
+        self.vectors: Dict[str, Dict[str, float]] = {}
+        self.norms: Dict[str, float] = {}
+        self.postings: Dict[str, Set[str]] = defaultdict(set)  # tag -> open market_ids
+        self.members: Dict[str, Set[str]] = defaultdict(set)   # tag -> all market_ids
+        self.neighbours: Dict[str, Tuple[str, ...]] = {}
+
+        # IDF over own tags of open markets, frozen until the next full build
+        open_count = 0
+        doc_freq = defaultdict(int)
+        for market in markets.values():
+            if market.get('status') == 'open':
+                open_count += 1
+                for tag in set(market.get('tags') or ()):
+                    doc_freq[tag] += 1
+        self.open_count = max(open_count, 1)
+        self.idf = {tag: self._idf_for(df) for tag, df in doc_freq.items()}
+
+        self._fill_lists: Dict[str, List[str]] = {}
+        for market_id, market in markets.items():
+            self._add(market_id, market)
+        for market_id in markets:
+            self.neighbours[market_id] = self._rank(market_id)
+        self._fill_lists.clear()
+
+    def _idf_for(self, doc_freq: int) -> float:
+        return math.log(1.0 + self.open_count / max(doc_freq, 1))
+
+    def _vector(self, tags: Iterable[str]) -> Dict[str, float]:
+        vector = {}
+        for tag in tags:
+            vector[tag] = self.idf.get(tag) or self._idf_for(1)
+        for tag in list(vector):
+            for partner, weight in self.affinity.get(tag, ()):
+                expanded = weight * (self.idf.get(partner) or self._idf_for(1))
+                if expanded > vector.get(partner, 0.0):
+                    vector[partner] = expanded
+        return vector
+
+    def _add(self, market_id: str, market: Mapping):
+        key = _tag_key(market)
+        vector = self._vector(key[0])
+        self.keys[market_id] = key
+        self.volumes[market_id] = _volume(market)
+        self.vectors[market_id] = vector
+        self.norms[market_id] = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        for tag in vector:
+            self.members[tag].add(market_id)
+            if key[1]:
+                self.postings[tag].add(market_id)
+
+    def _remove(self, market_id: str):
+        vector = self.vectors.pop(market_id, None)
+        if vector is None:
+            return
+        for tag in vector:
+            for index in (self.postings, self.members):
+                ids = index.get(tag)
+                if ids is not None:
+                    ids.discard(market_id)
+                    if not ids:
+                        del index[tag]
+        self.keys.pop(market_id, None)
+        self.volumes.pop(market_id, None)
+        self.norms.pop(market_id, None)
+        self.neighbours.pop(market_id, None)
+
+    def _is_common(self, tag: str) -> bool:
+        return len(self.postings.get(tag, ())) > COMMON_TAG_MARKETS
+
+    def _most_traded(self, tag: str) -> List[str]:
+        """COMMON_TAG_FILL most traded open markets with a common tag"""
+        cached = self._fill_lists.get(tag)
+        if cached is None:
+            cached = heapq.nlargest(COMMON_TAG_FILL, self.postings.get(tag, ()),
+                                    key=lambda mid: self.volumes[mid])
+            self._fill_lists[tag] = cached
+        return cached
+
+    def _rank(self, market_id: str) -> Tuple[str, ...]:
+        """Top-K open markets by cosine similarity (ties: more volume first)"""
+        vector = self.vectors[market_id]
+
+        candidates = set()
+        common = []
+        for tag in vector:
+            if self._is_common(tag):
+                common.append(tag)
+            else:
+                candidates.update(self.postings.get(tag, ()))
+        candidates.discard(market_id)
+        if len(candidates) < self.top_k:
+            for tag in common:
+                candidates.update(self._most_traded(tag))
+            candidates.discard(market_id)
+
+        norm = self.norms[market_id]
+        scored = []
+        for other in candidates:
+            other_vector = self.vectors[other]
+            dot = sum(weight * other_vector.get(tag, 0.0) for tag, weight in vector.items())
+            scored.append((dot / (norm * self.norms[other]), self.volumes[other], other))
+
+        return tuple(other for _, _, other in heapq.nlargest(self.top_k, scored))
+
+    def update(self, markets: Mapping[str, Mapping], changed_ids: Iterable[str]) -> int:
+        """
+        Apply tag/status changes for `changed_ids` (present in `markets` or
+        deleted) and re-rank the markets that could gain or lose them as a
+        neighbour through a shared tag; returns how many were re-ranked
+        """
+        affected = set()
+        for market_id in changed_ids:
+            for tag in self.vectors.get(market_id, ()):
+                if not self._is_common(tag):
+                    affected.update(self.members.get(tag, ()))
+            self._remove(market_id)
+
+            market = markets.get(market_id)
+            if market is None:
+                continue
+            self._add(market_id, market)
+            for tag in self.vectors[market_id]:
+                if not self._is_common(tag):
+                    affected.update(self.members.get(tag, ()))
+            affected.add(market_id)
+
+        for market_id in affected:
+            if market_id in self.vectors:
+                self.neighbours[market_id] = self._rank(market_id)
+        self._fill_lists.clear()
+        return len(affected)
+
+    def copy(self) -> 'RelatedIndex':
+        """Copy to update while readers keep using this one"""
+        index = RelatedIndex({}, self.affinity, self.top_k)
+        index.built_at = self.built_at
+        index.open_count = self.open_count
+        index.idf = self.idf
+        index.keys = dict(self.keys)
+        index.volumes = dict(self.volumes)
+        index.vectors = dict(self.vectors)
+        index.norms = dict(self.norms)
+        index.neighbours = dict(self.neighbours)
+        index.postings = defaultdict(set, {tag: set(ids) for tag, ids in self.postings.items()})
+        index.members = defaultdict(set, {tag: set(ids) for tag, ids in self.members.items()})
+        return index
+
+    def related_ids(self, market_id: str) -> Tuple[str, ...]:
+        return self.neighbours.get(market_id, ())
+
+
+class RelatedMarkets:
+    def __init__(self, catalog=market_catalog, db_path: str = DB_PATH,
+                 top_k: int = RELATED_TOP_K):
+        self.catalog = catalog
+        self.db_path = db_path
+        self.top_k = top_k
+
+        # Rain mode: callable returning the current markets {market_id: market}
+        self._rain_loader: Optional[Callable[[], Dict[str, Dict]]] = None
+
+        # (index, source, Rain markets), replaced as one so readers never pair
+        # an index with another build's source. source: catalog snapshot
+        # (local) or fetch time (Rain)
+        self._current: Optional[Tuple[RelatedIndex, object, Dict[str, Dict]]] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Monitoring counters
+        self.full_builds = 0
+        self.incremental_updates = 0
+        self.last_build_ms = 0.0
+        self.last_update_ms = 0.0
+        self.last_update_markets = 0
+
+    def _get_conn(self):
+        return db_pool.connect(self.db_path)
+
+    def use_rain(self, rain_client):
+        """Index the Rain market list instead of the local catalog"""
+        def load():
+            markets = {}
+            for rain_market in rain_client.list_all_markets(page_size=RAIN_PAGE_SIZE):
+                market = rain_client.convert_to_brain_format(rain_market)
+                markets[market['market_id']] = market
+            return markets
+
+        self._rain_loader = load
+
+    def get_related(self, market_id: str, limit: int = 3) -> List[Dict]:
+        """
+        Up to `limit` related open markets (copies), most similar first
+
+        Local markets carry tags (list) and tag_overlap like the old query
+        """
+        current = self._current
+        if current is None or not self.running:
+            self.refresh(block=current is None)
+            current = self._current
+        if current is None:
+            return []
+
+        index, snapshot, rain_markets = current
+        related_ids = index.related_ids(market_id)
+
+        if self._rain_loader is not None:
+            return [dict(rain_markets[mid]) for mid in related_ids if mid in rain_markets][:limit]
+
+        own_tags = set(index.keys.get(market_id, ((), False))[0])
+        related_ids = [
+            mid for mid in related_ids
+            if snapshot.markets.get(mid, {}).get('status') == 'open'
+        ][:limit]
+        related = snapshot.get_many(related_ids)
+        for market in related:
+            market['tag_overlap'] = len(own_tags.intersection(market['tags']))
+        return related
+
+    def refresh(self, block: bool = True):
+        """Bring the index up to date with the market source"""
+        if not self._lock.acquire(blocking=block):
+            return  # another thread is already refreshing
+        try:
+            if self._rain_loader is not None:
+                self._refresh_rain()
+            else:
+                self._refresh_local()
+        finally:
+            self._lock.release()
+
+    def _refresh_local(self):
+        snapshot = self.catalog.get_snapshot(max_staleness=REFRESH_INTERVAL)
+        current = self._current
+        if current is not None and snapshot is current[1]:
+            return
+
+        if current is None or time.time() - current[0].built_at >= FULL_REBUILD_INTERVAL:
+            self._current = (self._build(snapshot.markets), snapshot, {})
+            return
+
+        # Markets are shared between snapshots unless reloaded; only tag or
+        # status changes matter here (prices move all the time)
+        index, previous, _ = current
+        old_markets, new_markets = previous.markets, snapshot.markets
+        changed = [
+            mid for mid, market in new_markets.items()
+            if old_markets.get(mid) is not market and
+            (mid not in index.keys or _tag_key(market) != index.keys[mid])
+        ]
+        changed.extend(mid for mid in index.keys if mid not in new_markets)
+
+        if len(changed) > INCREMENTAL_MAX_FRACTION * max(len(new_markets), 1):
+            index = self._build(new_markets)
+        elif changed:
+            index = self._update(index, new_markets, changed)
+        self._current = (index, snapshot, {})
+
+    def _refresh_rain(self):
+        current = self._current
+        if current is not None and time.time() - current[1] < RAIN_REFRESH_INTERVAL:
+            return
+
+        try:
+            markets = self._rain_loader()
+        except Exception as e:
+            logger.error(f"Related markets: Rain market list failed: {e}")
+            if current is None:
+                self._current = (self._build({}), time.time(), {})
+            else:
+                self._current = (current[0], time.time(), current[2])
+            return
+
+        self._current = (self._build(markets), time.time(), markets)
+
+    def _build(self, markets: Mapping[str, Mapping]) -> RelatedIndex:
+        start = time.time()
+        conn = self._get_conn()
+        try:
+            affinity = load_tag_affinity(conn.cursor())
+        finally:
+            conn.close()
+
+        index = RelatedIndex(markets, affinity, self.top_k)
+        self.full_builds += 1
+        self.last_build_ms = (time.time() - start) * 1000
+        logger.info(f"🔗 Related markets index: {len(markets)} markets, "
+                    f"{len(affinity)} co-occurring tags, {self.last_build_ms:.0f}ms")
+        return index
+
+    def _update(self, index: RelatedIndex, markets: Mapping[str, Mapping],
+                changed_ids: List[str]) -> RelatedIndex:
+        """Incremental update on a copy of `index`, returned for swapping in"""
+        start = time.time()
+        index = index.copy()
+        self.last_update_markets = index.update(markets, changed_ids)
+        self.incremental_updates += 1
+        self.last_update_ms = (time.time() - start) * 1000
+        return index
+
+    def start(self):
+        """Start the background refresher (idempotent)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='related-markets', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Related markets refresh failed: {e}", exc_info=True)
+            self._stop.wait(REFRESH_INTERVAL)
+
+    def stats(self) -> Dict:
+        """Index size, build/update cost and source for monitoring"""
+        index = self._current[0] if self._current else None
+        return {
+            'running': self.running,
+            'source': 'rain' if self._rain_loader is not None else 'catalog',
+            'markets': len(index.vectors) if index else 0,
+            'tags': len(index.postings) if index else 0,
+            'co_occurring_tags': len(index.affinity) if index else 0,
+            'top_k': self.top_k,
+            'age_seconds': round(time.time() - index.built_at, 1) if index else None,
+            'full_builds': self.full_builds,
+            'incremental_updates': self.incremental_updates,
+            'last_build_ms': round(self.last_build_ms, 2),
+            'last_update_ms': round(self.last_update_ms, 2),
+            'last_update_markets': self.last_update_markets
+        }
+
+
+# Global instance
+related_markets = RelatedMarkets()
@@ -2,13 +2,14 @@
 BRain v1 - Session State Manager
 Manages short-term user intent with fast decay (session vs long-term)
 """
-import sqlite3
 import json
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 
+from db_pool import db_pool
+
 DB_PATH = 'brain.db'
 
 class SessionManager:
@@ -20,16 +21,20 @@ class SessionManager:
         }
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
-    def get_or_create_session(self, user_key: str) -> Dict:
+    def get_or_create_session(self, user_key: str, cursor=None) -> Dict:
         """
         Get active session or create new one if expired
         
+        cursor: run inside the caller's transaction (caller commits)
+        
         Returns: {session_id, tag_weights, category_weights, last_event_at}
         """
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        owns_conn = cursor is None
+        if owns_conn:
+            conn = self._get_conn()
+            cursor = conn.cursor()
         
         now = datetime.now()
         timeout_minutes = self.config['timeout_minutes']
@@ -53,7 +58,8 @@ class SessionManager:
             
             if time_since_last <= timeout_minutes and now < expires_at:
                 # Session still active
-                conn.close()
+                if owns_conn:
+                    conn.close()
                 return {
                     'session_id': session_id,
                     'tag_weights': json.loads(tag_weights_json),
@@ -79,8 +85,9 @@ class SessionManager:
         """, (user_key, session_id, now, expires_at,
               session_id, now, expires_at))
         
-        conn.commit()
-        conn.close()
+        if owns_conn:
+            conn.commit()
+            conn.close()
         
         return {
             'session_id': session_id,
@@ -90,7 +97,7 @@ class SessionManager:
         }
     
     def update_session_weights(self, user_key: str, market_data: Dict, 
-                               event_weight: float):
+                               event_weight: float, cursor=None):
         """
         Update session weights with decay
         
@@ -100,16 +107,59 @@ class SessionManager:
         
         market_data: {category, tags: []}
         event_weight: Action weight (e.g., 6.0 for participate, 2.0 for click)
+        cursor: run inside the caller's transaction (caller commits)
         """
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        self.update_session_weights_bulk(user_key, [(market_data, event_weight)], cursor)
+    
+    def update_session_weights_bulk(self, user_key: str, updates: List[Tuple[Dict, float]],
+                                    cursor=None):
+        """
+        Apply several events in order with one session read and one write
+        Same result as calling update_session_weights() once per event
+        
+        updates: [(market_data, event_weight), ...]
+        cursor: run inside the caller's transaction (caller commits)
+        """
+        if not updates:
+            return
+        
+        owns_conn = cursor is None
+        if owns_conn:
+            conn = self._get_conn()
+            cursor = conn.cursor()
         
         # Get current session
-        session = self.get_or_create_session(user_key)
+        session = self.get_or_create_session(user_key, cursor)
         
         tag_weights = session['tag_weights']
         category_weights = session['category_weights']
         
+        for market_data, event_weight in updates:
+            tag_weights, category_weights = self._apply_event(
+                tag_weights, category_weights, market_data, event_weight
+            )
+        
+        # Update database
+        now = datetime.now()
+        expires_at = now + timedelta(hours=2)
+        
+        cursor.execute("""
+            UPDATE user_session_state
+            SET tag_weights = ?,
+                category_weights = ?,
+                last_event_at = ?,
+                expires_at = ?
+            WHERE user_key = ?
+        """, (json.dumps(tag_weights), json.dumps(category_weights),
+              now, expires_at, user_key))
+        
+        if owns_conn:
+            conn.commit()
+            conn.close()
+    
+    def _apply_event(self, tag_weights: Dict, category_weights: Dict,
+                     market_data: Dict, event_weight: float) -> Tuple[Dict, Dict]:
+        """Decay, add one event's contribution, trim"""
         decay_mult = self.config['decay_multiplier']
         
         # Apply decay to all existing weights
@@ -133,22 +183,7 @@ class SessionManager:
         tag_weights = dict(sorted(tag_weights.items(), key=lambda x: x[1], reverse=True)[:50])
         category_weights = dict(sorted(category_weights.items(), key=lambda x: x[1], reverse=True)[:20])
         
-        # Update database
-        now = datetime.now()
-        expires_at = now + timedelta(hours=2)
-        
-        cursor.execute("""
-            UPDATE user_session_state
-            SET tag_weights = ?,
-                category_weights = ?,
-                last_event_at = ?,
-                expires_at = ?
-            WHERE user_key = ?
-        """, (json.dumps(tag_weights), json.dumps(category_weights),
-              now, expires_at, user_key))
-        
-        conn.commit()
-        conn.close()
+        return tag_weights, category_weights
     
     def get_session_weights(self, user_key: str) -> Dict:
         """
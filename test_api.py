@@ -86,7 +86,132 @@ def test_multi_option():
         bar = '█' * int(prob_pct / 2)
         print(f"   {opt['option_text']:25} {prob_pct:5.1f}% {bar}")
 
+def test_history_downsampling():
+    print_section("History Downsampling (LTTB, offline)")
+    from datetime import datetime, timedelta
+    from probability_series import lttb
+    
+    start = datetime(2026, 1, 1)
+    points = [
+        {'timestamp': (start + timedelta(minutes=i)).isoformat(), 'probability': 0.5}
+        for i in range(1000)
+    ]
+    points[437]['probability'] = 0.95  # spike
+    points[812]['probability'] = 0.05  # dip
+    
+    sampled = lttb(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] is points[0] and sampled[-1] is points[-1]
+    assert [p['timestamp'] for p in sampled] == sorted(p['timestamp'] for p in sampled)
+    assert points[437] in sampled and points[812] in sampled
+    assert lttb(points[:10], 50) == points[:10]
+    assert len(lttb(points, 1)) == 3  # never fewer than first/middle/last
+    print(f"1000 points -> {len(sampled)}: endpoints, order, spike and dip kept")
+
+def test_cursor_encoding():
+    print_section("Keyset Cursors (encode_after / decode_after, offline)")
+    from api import encode_after, decode_after
+    
+    cases = [(0, 'm'), (12.5, 'm_eth_flip'), (-3, 'ab'), (1e-9, 'abc'),
+             (987654321, 'ünïcode-market'), (0.123456789, 'x' * 37)]
+    for sort_value, market_id in cases:
+        cursor = encode_after(sort_value, market_id)
+        assert '=' not in cursor
+        assert decode_after(cursor) == (sort_value, market_id)
+    
+    for bad in ('', '!!!', encode_after('high', 'm1'), encode_after(1, 2), 'W10'):
+        try:
+            decode_after(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"decode_after accepted {bad!r}")
+    print(f"{len(cases)} cursors round-trip (every padding length); malformed ones raise ValueError")
+
+def test_score_batch():
+    print_section("BRain v1 Batch Scoring (local brain.db)")
+    import os
+    if not os.path.exists('brain.db'):
+        print("No brain.db here, skipped")
+        return
+    from brain_v1_scorer import brain_v1_scorer
+    from impression_tracker import impression_tracker
+    from market_catalog import market_catalog
+    
+    import sqlite3
+    conn = sqlite3.connect('brain.db')
+    row = conn.execute("""
+        SELECT user_key FROM user_topic_scores GROUP BY user_key ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()
+    conn.close()
+    users = ['test_batch_new_user'] + ([row[0]] if row else [])
+    
+    markets = market_catalog.get_snapshot().open_markets(limit=60)
+    for user_key, geo_bucket in [(user, geo) for user in users for geo in ('IL', 'GLOBAL')]:
+        impressions = impression_tracker.get_user_impressions(user_key)
+        batch = brain_v1_scorer.score_batch(markets, user_key, geo_bucket, impressions)
+        assert set(batch) == {m['market_id'] for m in markets}
+        for market in markets:
+            single = brain_v1_scorer.calculate_final_score(
+                market, user_key, geo_bucket, impressions.get(market['market_id'])
+            )
+            result = batch[market['market_id']]
+            assert abs(result['score'] - single['score']) < 1e-9, market['market_id']
+            assert result['reason_tags'] == single['reason_tags'], market['market_id']
+    assert brain_v1_scorer.score_batch([], 'test_batch_new_user', 'IL') == {}
+    print(f"score_batch == calculate_final_score (score + reason tags) for {len(markets)} markets, "
+          f"{len(users)} users")
+
+def test_impression_ring():
+    print_section("Impression Hour Ring (wrap, gaps, legacy rows, offline)")
+    import random
+    from datetime import datetime, timedelta
+    from impression_tracker import (RING_HOURS, _EPOCH, _add_to_ring, _epoch_hour,
+                                    _legacy_ring, window_counts)
+    
+    def at(hour):
+        return _EPOCH + timedelta(hours=hour, minutes=30)
+    
+    rng = random.Random(25)
+    base = (_epoch_hour(datetime(2026, 10, 18)) // RING_HOURS + 1) * RING_HOURS - 3  # just before a slot-0 wrap
+    for trial in range(500):
+        ring, end_hour, shown = None, None, []
+        hour = base + rng.randrange(6)
+        for _ in range(rng.randrange(1, 40)):
+            # Mostly small steps, sometimes gaps past the whole ring
+            hour += rng.choice((0, 0, 1, 2, 23, 24, 25, 100, 167, 168, 169, 400))
+            ring, end_hour = _add_to_ring(ring, end_hour, hour)
+            shown.append(hour)
+        now_hour = hour + rng.choice((0, 1, 23, 24, 100, 167, 168, 200))
+        expected = (
+            sum(1 for h in shown if h > now_hour - 24),
+            sum(1 for h in shown if h > now_hour - RING_HOURS)
+        )
+        assert window_counts(ring, end_hour, at(now_hour)) == expected, trial
+    
+    # Impressions older than the ring are ignored
+    ring, end_hour = _add_to_ring(None, None, base + 400)
+    assert _add_to_ring(ring, end_hour, base + 400 - RING_HOURS) == (ring, end_hour)
+    
+    # Legacy rows: 24h count at last_shown_at, the rest a day earlier
+    last_shown = at(base + 10)
+    ring, end_hour = _legacy_ring(3, 10, last_shown.isoformat())
+    assert window_counts(ring, end_hour, last_shown) == (3, 10)
+    assert window_counts(ring, end_hour, last_shown + timedelta(hours=24)) == (0, 10)
+    assert window_counts(ring, end_hour, last_shown + timedelta(hours=RING_HOURS)) == (0, 0)
+    assert _legacy_ring(0, 0, last_shown) == (None, None)
+    assert _legacy_ring(4, 2, None) == (None, None)
+    ring, end_hour = _add_to_ring(ring, end_hour, end_hour + 2)
+    assert window_counts(ring, end_hour, last_shown + timedelta(hours=2)) == (4, 11)
+    print("500 random impression sequences match a brute-force count; legacy rows convert")
+
 if __name__ == "__main__":
+    # Offline helper checks (no server needed)
+    test_history_downsampling()
+    test_cursor_encoding()
+    test_impression_ring()
+    
+    test_score_batch()
+    
     try:
         test_health()
         test_markets_list()
@@ -169,6 +169,35 @@ def test_platform_stats():
     print(f"Markets Resolved (24h): {stats['markets_resolved_24h']}")
     print(f"Avg Market Volume: ${stats['avg_market_volume']:,.2f}")
 
+def test_client_cache():
+    print_section("Client Cache, Coalescing & Batch Fetch")
+    client = get_rain_client()
+    
+    # Identical concurrent calls share one upstream request
+    import threading
+    before = client.stats()['requests']
+    threads = [threading.Thread(target=client.list_markets, kwargs={'limit': 7}) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f"10 concurrent list_markets(limit=7) -> {client.stats()['requests'] - before} upstream request(s)")
+    
+    markets = client.list_all_markets(page_size=3)
+    print(f"list_all_markets: {len(markets)} markets (pages fetched in parallel)")
+    
+    market_ids = [m['market_id'] for m in markets[:5]]
+    batch = client.get_markets(market_ids)
+    print(f"get_markets: {len(batch)}/{len(market_ids)} markets")
+    
+    # Strict detail fetch: None only for a market Rain answers 404 for
+    strict = client.get_markets(market_ids, cached=False, strict=True)
+    assert [m['market_id'] for m in strict] == [m['market_id'] for m in batch]
+    assert client.get_market('no-such-market', strict=True) is None
+    print("strict get_markets: same markets; unknown ID -> None (404), failures raise")
+    
+    print(json.dumps(client.stats(), indent=2))
+
 if __name__ == "__main__":
     try:
         print("\n🌧️  Testing Mock Rain Protocol API")
@@ -183,6 +212,7 @@ if __name__ == "__main__":
         test_recent_trades()
         test_leaderboard()
         test_platform_stats()
+        test_client_cache()
         
         print(f"\n{'='*70}")
         print("  ✅ All Rain API tests completed successfully!")
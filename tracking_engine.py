@@ -8,6 +8,10 @@ import json
 import math
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+from collections import Counter, defaultdict
+
+from db_pool import db_pool
+from feed_cache import feed_cache
 
 # BRain v1 imports
 try:
@@ -44,18 +48,92 @@ SCORE_MULTIPLIERS = {
     'related': 0.20
 }
 
+# BRain v1: events that stamp user_market_impressions (event -> interaction type)
+IMPRESSION_INTERACTIONS = {
+    'click': 'click',
+    'participate': 'trade',
+    'hide': 'hide'
+}
+
+# BRain v1: events that don't move session (short-term) weights
+NON_SESSION_EVENTS = ('impression', 'scroll_past', 'skip_fast')
+
 # Profile limits
 TOP_N_TAGS = 200
 TOP_N_TAXONOMY = 200
 DECAY_HALF_LIFE_DAYS = 30
 
+def _parse_ts(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def topic_decay(raw_score: float, from_ts, to_ts=None) -> float:
+    """
+    Decay a raw topic score from its reference time to to_ts (default now)
+    Closed form exp(-days / DECAY_HALF_LIFE_DAYS), so decaying in steps or
+    all at once gives the same result
+    """
+    if raw_score is None:
+        return 0.0
+    
+    start = _parse_ts(from_ts)
+    if start is None:
+        return raw_score
+    
+    end = _parse_ts(to_ts) if to_ts is not None else datetime.now()
+    if end is None:
+        return raw_score
+    
+    days_since = max(0.0, (end - start).total_seconds() / 86400)
+    return raw_score * math.exp(-days_since / DECAY_HALF_LIFE_DAYS)
+
+
+def topic_norm(raw_score: float) -> float:
+    """Normalize raw score to 0-100 with sigmoid"""
+    x = -(raw_score or 0.0) + 5
+    if x > 700:
+        return 0.0
+    return 100 / (1 + math.exp(x))
+
+
+# raw_score as readers should pass it to live_topic_score(): NULL for rows
+# never written by the tracker (seeded test users get raw_score's DEFAULT 0.0
+# but no interactions), so a learned raw that netted to 0 still decays
+RAW_SCORE_SQL = "CASE WHEN interactions > 0 THEN raw_score END"
+
+
+def live_topic_score(score: float, raw_score: Optional[float], last_updated, now=None) -> float:
+    """
+    Current 0-100 score for a user_topic_scores row (decayed at read time)
+    
+    Rows written directly with a score and no raw_score (seeded test users,
+    see RAW_SCORE_SQL) keep their stored score.
+    """
+    if raw_score is None:
+        return score or 0.0
+    return topic_norm(topic_decay(raw_score, last_updated, now))
+
+
+def register_score_functions(conn):
+    """Expose topic_decay()/topic_norm() to SQL on this connection"""
+    conn.create_function('topic_decay', 3, topic_decay, deterministic=True)
+    conn.create_function('topic_norm', 1, topic_norm, deterministic=True)
+
+
 class TrackingEngine:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
     
     def _get_conn(self):
         """Get database connection"""
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
     
     def record_interaction(self, user_key: str, market_id: str, event_type: str,
                           dwell_ms: Optional[int] = None, section: Optional[str] = None,
@@ -69,47 +147,141 @@ class TrackingEngine:
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        timestamp = datetime.now()
+        interaction_id = self.record_interaction_on_cursor(
+            cursor, user_key, market_id, event_type,
+            dwell_ms=dwell_ms, section=section, position=position,
+            geo_country=geo_country
+        )
         
-        # Insert interaction
-        cursor.execute("""
-            INSERT INTO user_interactions 
-            (user_key, market_id, event_type, ts, dwell_ms, section, position, geo_country)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_key, market_id, event_type, timestamp.isoformat(),
-              dwell_ms, section, position, geo_country))
+        conn.commit()
+        conn.close()
+        
+        feed_cache.invalidate_events(user_key, [event_type])
         
-        interaction_id = cursor.lastrowid
+        return interaction_id
+    
+    def record_interactions_bulk(self, user_key: str, events: List[Dict],
+                                 geo_country: Optional[str] = None) -> List[int]:
+        """
+        Record a batch of events for one user in a single transaction
+        Returns: interaction_ids (same order as events)
+        
+        events: [{market_id, event_type, dwell_ms?, section?, position?, ts?}]
+        """
+        if not events:
+            return []
         
-        # Update profile immediately (long-term)
-        self._update_profile_from_interaction(
-            cursor, user_key, market_id, event_type, dwell_ms
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        
+        interaction_ids = self.record_interactions_bulk_on_cursor(
+            cursor, user_key, events, geo_country
         )
         
         conn.commit()
         conn.close()
         
-        # BRain v1: Update impression tracker for click/trade/hide
-        if BRAIN_V1_ENABLED and event_type in ['click', 'participate', 'hide']:
-            interaction_map = {
-                'click': 'click',
-                'participate': 'trade',
-                'hide': 'hide'
-            }
-            impression_tracker.update_interaction_timestamp(
-                user_key, market_id, interaction_map[event_type], timestamp
-            )
+        # Clicks/hides/participations change the user's next feed right away
+        feed_cache.invalidate_events(user_key, [e['event_type'] for e in events])
+        
+        return interaction_ids
+    
+    def record_interaction_on_cursor(self, cursor, user_key: str, market_id: str, event_type: str,
+                                     dwell_ms: Optional[int] = None, section: Optional[str] = None,
+                                     position: Optional[int] = None, geo_country: Optional[str] = None,
+                                     timestamp: Optional[datetime] = None) -> int:
+        """
+        record_interaction() inside the caller's transaction (caller commits)
         
-        # BRain v1: Update session state (short-term)
-        if BRAIN_V1_ENABLED and event_type not in ['impression', 'scroll_past', 'skip_fast']:
-            # Get market data for session update
-            cursor = self._get_conn().cursor()
-            cursor.execute("SELECT category FROM markets WHERE market_id = ?", (market_id,))
-            row = cursor.fetchone()
-            if row:
-                category = row[0]
-                cursor.execute("SELECT tag FROM market_tags WHERE market_id = ?", (market_id,))
-                tags = [r[0] for r in cursor.fetchall()]
+        timestamp: when the event happened (default: now)
+        """
+        event = {
+            'market_id': market_id,
+            'event_type': event_type,
+            'dwell_ms': dwell_ms,
+            'section': section,
+            'position': position,
+            'ts': timestamp
+        }
+        return self.record_interactions_bulk_on_cursor(cursor, user_key, [event], geo_country)[0]
+    
+    def record_interactions_bulk_on_cursor(self, cursor, user_key: str, events: List[Dict],
+                                           geo_country: Optional[str] = None) -> List[int]:
+        """
+        record_interactions_bulk() inside the caller's transaction (caller commits)
+        
+        Market metadata is read once per distinct market, topic-score deltas
+        are summed per (topic_type, topic_value) and written once each, and
+        session weights are read and written once for the whole batch.
+        """
+        if not events:
+            return []
+        
+        now = datetime.now()
+        timestamps = [event.get('ts') or now for event in events]
+        
+        # Insert interactions
+        cursor.executemany("""
+            INSERT INTO user_interactions 
+            (user_key, market_id, event_type, ts, dwell_ms, section, position, geo_country)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (user_key, event['market_id'], event['event_type'], ts.isoformat(),
+             event.get('dwell_ms'), event.get('section'), event.get('position'), geo_country)
+            for event, ts in zip(events, timestamps)
+        ])
+        
+        # Single writer inside one transaction: AUTOINCREMENT ids are consecutive
+        cursor.execute("SELECT last_insert_rowid()")
+        last_id = cursor.fetchone()[0]
+        interaction_ids = list(range(last_id - len(events) + 1, last_id + 1))
+        
+        # Market metadata, once per distinct market
+        metadata = self._load_market_metadata(
+            cursor, list({event['market_id'] for event in events})
+        )
+        
+        topic_deltas = defaultdict(lambda: [0.0, 0])  # (topic_type, topic_value) -> [delta, count]
+        cooccurrences = Counter()
+        profile_events = 0
+        interaction_timestamps = {}  # (market_id, interaction_type) -> ts
+        session_updates = []
+        
+        for event, ts in zip(events, timestamps):
+            market_id = event['market_id']
+            event_type = event['event_type']
+            dwell_ms = event.get('dwell_ms')
+            meta = metadata.get(market_id)
+            
+            # Long-term profile
+            if meta:
+                category, tags = meta
+                delta = self._event_delta(event_type, dwell_ms)
+                
+                if category:
+                    entry = topic_deltas[('category', category)]
+                    entry[0] += delta * SCORE_MULTIPLIERS['category']
+                    entry[1] += 1
+                
+                for tag in tags:
+                    entry = topic_deltas[('tag', tag)]
+                    entry[0] += delta * SCORE_MULTIPLIERS['tag']
+                    entry[1] += 1
+                
+                # Co-occurrences (alphabetical order for consistent storage)
+                for i, tag_a in enumerate(tags):
+                    for tag_b in tags[i+1:]:
+                        cooccurrences[(min(tag_a, tag_b), max(tag_a, tag_b))] += 1
+                
+                profile_events += 1
+            
+            # BRain v1: impression tracker for click/trade/hide (latest event wins)
+            if BRAIN_V1_ENABLED and event_type in IMPRESSION_INTERACTIONS:
+                interaction_timestamps[(market_id, IMPRESSION_INTERACTIONS[event_type])] = ts
+            
+            # BRain v1: session state (short-term)
+            if BRAIN_V1_ENABLED and meta and event_type not in NON_SESSION_EVENTS:
+                category, tags = meta
                 
                 # Get event weight
                 event_weight = ACTION_WEIGHTS.get(event_type, 1.0)
@@ -118,149 +290,135 @@ class TrackingEngine:
                 if dwell_ms and dwell_ms >= 5000:
                     event_weight *= (1.2 if dwell_ms >= 30000 else 1.1)
                 
-                # Update session
-                session_manager.update_session_weights(
-                    user_key,
-                    {'category': category, 'tags': tags},
-                    event_weight
-                )
-            cursor.close()
+                session_updates.append(({'category': category, 'tags': tags}, event_weight))
         
-        return interaction_id
-    
-    def _update_profile_from_interaction(self, cursor, user_key: str, market_id: str,
-                                        event_type: str, dwell_ms: Optional[int]):
-        """
-        Update user profile based on interaction
-        """
-        # Get market metadata
-        cursor.execute("""
-            SELECT category FROM markets WHERE market_id = ?
-        """, (market_id,))
-        row = cursor.fetchone()
-        if not row:
-            return
+        # One score upsert per topic
+        self._update_topic_scores(cursor, user_key, topic_deltas)
         
-        category = row[0]
+        if cooccurrences:
+            cursor.executemany("""
+                INSERT INTO tag_cooccurrence (tag_a, tag_b, count)
+                VALUES (?, ?, ?)
+                ON CONFLICT(tag_a, tag_b) DO UPDATE SET
+                    count = count + excluded.count,
+                    last_updated = CURRENT_TIMESTAMP
+            """, [(tag_a, tag_b, count) for (tag_a, tag_b), count in cooccurrences.items()])
         
-        # Get market tags
-        cursor.execute("""
-            SELECT tag FROM market_tags WHERE market_id = ?
-        """, (market_id,))
-        tags = [r[0] for r in cursor.fetchall()]
+        # Update user profile last_active
+        if profile_events:
+            cursor.execute("""
+                INSERT INTO user_profiles (user_key, last_active, total_interactions)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_key) DO UPDATE SET
+                    last_active = excluded.last_active,
+                    total_interactions = total_interactions + excluded.total_interactions
+            """, (user_key, datetime.now().isoformat(), profile_events))
+        
+        for (market_id, interaction_type), ts in interaction_timestamps.items():
+            impression_tracker.update_interaction_timestamp(
+                user_key, market_id, interaction_type, ts, cursor
+            )
+        
+        if session_updates:
+            session_manager.update_session_weights_bulk(user_key, session_updates, cursor)
         
-        # Calculate score delta
+        return interaction_ids
+    
+    def _load_market_metadata(self, cursor, market_ids: List[str]) -> Dict[str, tuple]:
+        """{market_id: (category, [tags])} for markets that exist"""
+        metadata = {}
+        
+        # SQLite variable limit: chunk the IN (...) list
+        for i in range(0, len(market_ids), 500):
+            chunk = market_ids[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            
+            cursor.execute(f"""
+                SELECT market_id, category FROM markets WHERE market_id IN ({placeholders})
+            """, chunk)
+            for market_id, category in cursor.fetchall():
+                metadata[market_id] = (category, [])
+            
+            cursor.execute(f"""
+                SELECT market_id, tag FROM market_tags WHERE market_id IN ({placeholders})
+            """, chunk)
+            for market_id, tag in cursor.fetchall():
+                if market_id in metadata:
+                    metadata[market_id][1].append(tag)
+        
+        return metadata
+    
+    def _event_delta(self, event_type: str, dwell_ms: Optional[int]) -> float:
+        """Score delta for one event (before topic-type multipliers)"""
         base_weight = ACTION_WEIGHTS.get(event_type, 1.0)
         
         # Adjust for dwell time if applicable
-        if event_type.startswith('dwell') or dwell_ms:
-            if dwell_ms:
-                # Scale by dwell time (max at 60s)
-                dwell_factor = min(1.0, dwell_ms / 60000)
-                delta = base_weight * dwell_factor
-            else:
-                delta = base_weight
-        else:
-            delta = base_weight
-        
-        # Update category score
-        if category:
-            self._update_topic_score(
-                cursor, user_key, 'category', category,
-                delta * SCORE_MULTIPLIERS['category']
-            )
+        if dwell_ms:
+            # Scale by dwell time (max at 60s)
+            dwell_factor = min(1.0, dwell_ms / 60000)
+            return base_weight * dwell_factor
         
-        # Update tag scores
-        for tag in tags:
-            self._update_topic_score(
-                cursor, user_key, 'tag', tag,
-                delta * SCORE_MULTIPLIERS['tag']
-            )
-        
-        # Record co-occurrences
-        if len(tags) > 1:
-            for i, tag_a in enumerate(tags):
-                for tag_b in tags[i+1:]:
-                    self._record_cooccurrence(cursor, tag_a, tag_b)
-        
-        # Update user profile last_active
-        cursor.execute("""
-            INSERT INTO user_profiles (user_key, last_active, total_interactions)
-            VALUES (?, ?, 1)
-            ON CONFLICT(user_key) DO UPDATE SET
-                last_active = ?,
-                total_interactions = total_interactions + 1
-        """, (user_key, datetime.now().isoformat(), datetime.now().isoformat()))
+        return base_weight
     
-    def _update_topic_score(self, cursor, user_key: str, topic_type: str,
-                           topic_value: str, delta: float):
+    def _update_topic_scores(self, cursor, user_key: str,
+                             topic_deltas: Dict[tuple, List]):
         """
-        Update score for a specific topic
+        Apply summed deltas to topic scores: one UPSERT per topic, no reads
+        
+        Scores are stored as raw_score at reference time last_updated; the
+        stored raw is decayed to now inside the UPSERT and the delta added.
+        score_history keeps one snapshot per topic per hour (latest wins).
+        
+        topic_deltas: {(topic_type, topic_value): [delta, interactions]}
         """
-        # Get current score
-        cursor.execute("""
-            SELECT raw_score, interactions, last_updated FROM user_topic_scores
-            WHERE user_key = ? AND topic_type = ? AND topic_value = ?
-        """, (user_key, topic_type, topic_value))
+        if not topic_deltas:
+            return
         
-        row = cursor.fetchone()
+        register_score_functions(cursor.connection)
+        now = datetime.now().isoformat()
         
-        if row:
-            raw_score, interactions, last_updated = row
-            
-            # Apply decay
-            if last_updated:
-                days_since = (datetime.now() - datetime.fromisoformat(last_updated)).days
-                decay_factor = math.exp(-days_since / DECAY_HALF_LIFE_DAYS)
-                raw_score = raw_score * decay_factor
-            
-            # Add delta
-            new_raw_score = raw_score + delta
-            new_interactions = interactions + 1
-            
-            # Normalize to 0-100 scale with sigmoid
-            normalized_score = 100 / (1 + math.exp(-new_raw_score + 5))
-            
-            # Update
-            cursor.execute("""
-                UPDATE user_topic_scores
-                SET raw_score = ?, score = ?, interactions = ?, last_updated = ?
-                WHERE user_key = ? AND topic_type = ? AND topic_value = ?
-            """, (new_raw_score, normalized_score, new_interactions,
-                  datetime.now().isoformat(), user_key, topic_type, topic_value))
-        else:
-            # Create new entry
-            raw_score = delta
-            normalized_score = 100 / (1 + math.exp(-raw_score + 5))
-            
-            cursor.execute("""
-                INSERT INTO user_topic_scores
+        cursor.executemany("""
+            INSERT INTO user_topic_scores
                 (user_key, topic_type, topic_value, raw_score, score, interactions, last_updated)
-                VALUES (?, ?, ?, ?, ?, 1, ?)
-            """, (user_key, topic_type, topic_value, raw_score, normalized_score,
-                  datetime.now().isoformat()))
+            VALUES (?, ?, ?, ?, topic_norm(?), ?, ?)
+            ON CONFLICT(user_key, topic_type, topic_value) DO UPDATE SET
+                raw_score = topic_decay(raw_score, last_updated, excluded.last_updated)
+                            + excluded.raw_score,
+                score = topic_norm(topic_decay(raw_score, last_updated, excluded.last_updated)
+                                   + excluded.raw_score),
+                interactions = interactions + excluded.interactions,
+                last_updated = excluded.last_updated
+        """, [
+            (user_key, topic_type, topic_value, delta, delta, count, now)
+            for (topic_type, topic_value), (delta, count) in topic_deltas.items()
+        ])
+        
+        keys = [(user_key, topic_type, topic_value) for topic_type, topic_value in topic_deltas]
+        
+        # Record score history snapshot (for evolution timeline), hourly
+        cursor.executemany("""
+            UPDATE score_history
+            SET score = (SELECT score FROM user_topic_scores
+                         WHERE user_key = ?1 AND topic_type = ?2 AND topic_value = ?3),
+                snapshot_ts = CURRENT_TIMESTAMP
+            WHERE history_id = (
+                SELECT MAX(history_id) FROM score_history
+                WHERE user_key = ?1 AND topic_type = ?2 AND topic_value = ?3
+                  AND snapshot_ts >= strftime('%Y-%m-%d %H:00:00', 'now')
+            )
+        """, keys)
         
-        # Record score history snapshot (for evolution timeline)
-        cursor.execute("""
+        cursor.executemany("""
             INSERT INTO score_history (user_key, topic_type, topic_value, score)
-            VALUES (?, ?, ?, ?)
-        """, (user_key, topic_type, topic_value, normalized_score))
-    
-    def _record_cooccurrence(self, cursor, tag_a: str, tag_b: str):
-        """
-        Record that two tags appeared together
-        """
-        # Ensure alphabetical order for consistent storage
-        if tag_a > tag_b:
-            tag_a, tag_b = tag_b, tag_a
-        
-        cursor.execute("""
-            INSERT INTO tag_cooccurrence (tag_a, tag_b, count)
-            VALUES (?, ?, 1)
-            ON CONFLICT(tag_a, tag_b) DO UPDATE SET
-                count = count + 1,
-                last_updated = CURRENT_TIMESTAMP
-        """, (tag_a, tag_b))
+            SELECT user_key, topic_type, topic_value, score
+            FROM user_topic_scores
+            WHERE user_key = ?1 AND topic_type = ?2 AND topic_value = ?3
+              AND NOT EXISTS (
+                  SELECT 1 FROM score_history
+                  WHERE user_key = ?1 AND topic_type = ?2 AND topic_value = ?3
+                    AND snapshot_ts >= strftime('%Y-%m-%d %H:00:00', 'now')
+              )
+        """, keys)
     
     def record_seen(self, user_key: str, market_id: str, belief: float,
                    volume: float, status: str) -> None:
@@ -0,0 +1,43 @@
+"""
+BRain v1 - User Context
+Everything the pipeline needs to know about one user, loaded once per request
+Built by BRainV1Scorer.build_user_context() and consumed by FeedComposer
+(candidates + diversity) and the scorer, so per-candidate work never goes
+back to SQLite for user state
+"""
+from typing import Dict, Optional, Set
+
+
+class UserContext:
+    def __init__(self, user_key: str, geo_bucket: str, is_new: bool,
+                 topic_scores: Dict[str, Dict[str, float]], session: Optional[Dict],
+                 impressions: Dict[str, Dict], hidden_ids: Set[str]):
+        self.user_key = user_key
+        self.geo_bucket = geo_bucket
+        self.is_new = is_new
+
+        # {topic_type: {topic_value: 0-1 score}} from user_topic_scores
+        self.topic_scores = topic_scores
+
+        # {category_weights, tag_weights} from session_manager (None if unavailable)
+        self.session = session
+
+        # {market_id: impression dict} for every market this user has been shown
+        self.impressions = impressions
+
+        # Markets hidden within hide_suppression_days
+        self.hidden_ids = hidden_ids
+
+    def impression(self, market_id: str) -> Optional[Dict]:
+        """Impression data for one market (None if never shown)"""
+        return self.impressions.get(market_id)
+
+    def with_impressions(self, impressions: Dict[str, Dict], hidden_ids: Set[str]) -> 'UserContext':
+        """Same user state with fresher impressions (cached feed rankings)"""
+        return UserContext(self.user_key, self.geo_bucket, self.is_new, self.topic_scores,
+                           self.session, impressions, hidden_ids)
+
+    def __repr__(self):
+        return (f"UserContext(user_key={self.user_key!r}, geo_bucket={self.geo_bucket!r}, "
+                f"is_new={self.is_new}, impressions={len(self.impressions)}, "
+                f"hidden={len(self.hidden_ids)})")
@@ -1,268 +1,533 @@
 """
 BRain v1 - Velocity Computer
 Computes rolling activity stats (5m/1h/24h) for trending and "changed" logic
-Run this every 1-5 minutes via cron
+Run this every 30 seconds to 5 minutes via cron
+
+Rollups are maintained incrementally (migrations/003):
+- only user_interactions rows above the high-water mark are read
+- events are counted into per-minute ring buckets per (market, geo)
+- the 5m/1h/24h counters get new events added and buckets that slid out of
+  each window since the last tick subtracted, so a tick costs O(new events +
+  expiring buckets) instead of O(markets x countries x 3) window scans
+
+Probability snapshots also advance a per-market delta index (migrations/008):
+the probability each market had 1h/6h/24h/7d ago, read in one query by the
+odds-change tick, the v1 "changed" logic and personalization's rising score.
+Without it, odds changes are read from history per market as before.
 """
+import logging
 import sqlite3
 import math
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from collections import defaultdict
 
+from db_pool import db_pool
+
+logger = logging.getLogger(__name__)
+
 DB_PATH = 'brain.db'
 
+# Ring buffer size: one slot per minute, 24h deep (the largest window)
+RING_MINUTES = 24 * 60
+
+# Rollup windows in minutes, in market_velocity_rollups column order
+WINDOWS = (('5m', 5), ('1h', 60), ('24h', 24 * 60))
+
+VIEW_EVENTS = ('impression', 'click', 'view_market')
+TRADE_EVENTS = ('participate', 'participate_intent')
+
+# Geo values that only count towards GLOBAL
+EXCLUDED_GEOS = ('', 'UNKNOWN', 'LOCAL')
+
+# user_interactions rows read per query while catching up
+INGEST_BATCH = 50000
+
+# Probability delta offsets, in market_probability_deltas column order
+DELTA_OFFSETS = (
+    ('1h', timedelta(hours=1)),
+    ('6h', timedelta(hours=6)),
+    ('24h', timedelta(hours=24)),
+    ('7d', timedelta(days=7)),
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_minute(ts: datetime) -> int:
+    return int((ts - _EPOCH).total_seconds() // 60)
+
+
+def _parse_ts(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def load_probability_anchors(cursor, market_ids: Optional[List[str]] = None
+                             ) -> Optional[Dict[str, Dict[str, Optional[float]]]]:
+    """
+    Probability each market had 1h/6h/24h/7d ago (as of its last snapshot)
+    
+    Returns: {market_id: {'1h': p, '6h': p, '24h': p, '7d': p}}, p None when
+    no snapshot is that old; None if migrations/008 is not applied
+    """
+    columns = ', '.join(f'prob_{label}' for label, _ in DELTA_OFFSETS)
+    query = f"SELECT market_id, {columns} FROM market_probability_deltas"
+    
+    try:
+        if market_ids is None:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        else:
+            rows = []
+            # SQLite variable limit: chunk the IN (...) list
+            for i in range(0, len(market_ids), 500):
+                chunk = market_ids[i:i + 500]
+                placeholders = ','.join('?' for _ in chunk)
+                cursor.execute(f"{query} WHERE market_id IN ({placeholders})", chunk)
+                rows.extend(cursor.fetchall())
+    except sqlite3.OperationalError:
+        return None
+    
+    labels = [label for label, _ in DELTA_OFFSETS]
+    return {row[0]: dict(zip(labels, row[1:])) for row in rows}
+
+
+def load_velocity_rollups(cursor, market_ids: List[str],
+                          geo_bucket: str) -> Dict[Tuple[str, str], Tuple]:
+    """
+    Bulk-load (trades_1h, views_1h, odds_change_1h) for these markets in
+    GLOBAL and geo_bucket
+
+    Returns: {(market_id, geo_bucket): row}
+    """
+    velocity = {}
+    
+    # SQLite variable limit: chunk the IN (...) list
+    for i in range(0, len(market_ids), 500):
+        chunk = market_ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(f"""
+            SELECT market_id, geo_bucket, trades_1h, views_1h, odds_change_1h
+            FROM market_velocity_rollups
+            WHERE geo_bucket IN ('GLOBAL', ?)
+              AND market_id IN ({placeholders})
+        """, [geo_bucket] + chunk)
+        
+        for row in cursor.fetchall():
+            velocity[(row[0], row[1])] = row[2:]
+    
+    return velocity
+
+
 class VelocityComputer:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        self._has_deltas: Optional[bool] = None
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        return db_pool.connect(self.db_path)
+    
+    def _deltas_available(self, cursor) -> bool:
+        """Whether migrations/008 is applied (checked once per process)"""
+        if self._has_deltas is None:
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'market_probability_deltas'
+            """)
+            self._has_deltas = cursor.fetchone() is not None
+            if not self._has_deltas:
+                logger.warning("market_probability_deltas missing (apply migrations/008_probability_deltas.sql); "
+                               "odds changes are read from history per market")
+        return self._has_deltas
     
     def compute_all_rollups(self):
         """
-        Compute velocity rollups for all markets and geo buckets
-        Call this every 1-5 minutes
+        Advance velocity rollups for all markets and geo buckets
+        Call this every 30 seconds to 5 minutes
         
-        Returns: {updated_count, duration_ms}
+        Ingests new interactions since the high-water mark and slides the
+        windows forward. Falls back to a rebuild from the last 24h of events
+        on first run or when the job has been down longer than the ring.
+        
+        Returns: {updated_count, duration_ms, geo_buckets, events_ingested, mode}
         """
         start = datetime.now()
+        now_minute = _epoch_minute(start)
         
-        # Compute global rollups
-        global_count = self._compute_rollups_for_geo('GLOBAL')
+        conn = self._get_conn()
+        cursor = conn.cursor()
         
-        # Compute per-country rollups (get active countries from recent interactions)
-        countries = self._get_active_countries()
-        country_count = 0
-        for country in countries:
-            country_count += self._compute_rollups_for_geo(country)
+        try:
+            # Single writer: watermark, buckets and rollups move together
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            state = self._read_watermark(cursor)
+            rebuild = state is None or now_minute - state[1] >= RING_MINUTES
+            
+            if rebuild:
+                last_id = self._rebuild_start_id(cursor, start)
+                last_minute = now_minute
+                cursor.execute("DELETE FROM market_velocity_buckets")
+                window_deltas = None
+            else:
+                last_id, last_minute = state
+                # Expire before ingesting, so late events landing in an
+                # already-expired minute are neither added nor subtracted
+                window_deltas = self._expired_deltas(cursor, last_minute, now_minute)
+            
+            last_id, bucket_counts, events = self._ingest_events(cursor, last_id, now_minute)
+            self._write_buckets(cursor, bucket_counts)
+            
+            if rebuild:
+                updated_pairs = self._rebuild_rollups(cursor, now_minute, start)
+            else:
+                self._add_new_events(window_deltas, bucket_counts, now_minute)
+                updated_pairs = self._apply_window_deltas(cursor, window_deltas, start)
+            
+            self._write_watermark(cursor, last_id, now_minute)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
         # Compute odds changes
         odds_count = self._compute_odds_changes()
         
+        # Stamp again once the odds are in: rollup_version() (trending ETags)
+        # has to move after the tick's last write, not only mid-tick
+        conn = self._get_conn()
+        conn.execute("UPDATE velocity_watermark SET updated_at = ? WHERE id = 1", (datetime.now(),))
+        conn.commit()
+        conn.close()
+        
         duration_ms = (datetime.now() - start).total_seconds() * 1000
         
         return {
-            'updated_count': global_count + country_count + odds_count,
+            'updated_count': len(updated_pairs) + odds_count,
             'duration_ms': duration_ms,
-            'geo_buckets': 1 + len(countries)
+            'geo_buckets': len({geo for _, geo in updated_pairs}),
+            'events_ingested': events,
+            'mode': 'rebuild' if rebuild else 'incremental'
         }
     
-    def _get_active_countries(self) -> List[str]:
-        """Get list of countries with recent activity (last 7 days)"""
+    def rollup_version(self) -> Optional[str]:
+        """When the rollups last finished a tick (None before the first run)"""
         conn = self._get_conn()
-        cursor = conn.cursor()
-        
-        cutoff = (datetime.now() - timedelta(days=7)).isoformat()
-        
-        cursor.execute("""
-            SELECT DISTINCT geo_country
-            FROM user_interactions
-            WHERE geo_country IS NOT NULL
-              AND geo_country NOT IN ('', 'UNKNOWN', 'LOCAL')
-              AND ts > ?
-        """, (cutoff,))
-        
-        countries = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        return countries
+        try:
+            row = conn.execute("SELECT updated_at FROM velocity_watermark WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            return None  # migrations/003 not applied
+        finally:
+            conn.close()
+        return str(row[0]) if row else None
     
-    def _compute_rollups_for_geo(self, geo_bucket: str) -> int:
-        """
-        Compute rollups for a specific geo bucket (GLOBAL or country code)
-        
-        Returns: number of markets updated
-        """
+    def reset_rollups(self):
+        """Drop the watermark so the next run rebuilds from the last 24h of events"""
         conn = self._get_conn()
-        cursor = conn.cursor()
-        
-        now = datetime.now()
-        
-        # Time windows
-        cutoff_5m = (now - timedelta(minutes=5)).isoformat()
-        cutoff_1h = (now - timedelta(hours=1)).isoformat()
-        cutoff_24h = (now - timedelta(hours=24)).isoformat()
-        
-        # Build geo filter
-        if geo_bucket == 'GLOBAL':
-            geo_filter = "1=1"  # All interactions
-            geo_params = []
-        else:
-            geo_filter = "geo_country = ?"
-            geo_params = [geo_bucket]
+        conn.execute("DELETE FROM velocity_watermark")
+        conn.commit()
+        conn.close()
+    
+    # ------------------------------------------------------------------
+    # Watermark
+    # ------------------------------------------------------------------
+    
+    def _read_watermark(self, cursor) -> Optional[Tuple[int, int]]:
+        cursor.execute("""
+            SELECT last_interaction_id, last_minute
+            FROM velocity_watermark
+            WHERE id = 1
+        """)
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
+    
+    def _write_watermark(self, cursor, last_id: int, minute: int):
+        cursor.execute("""
+            INSERT INTO velocity_watermark (id, last_interaction_id, last_minute, updated_at)
+            VALUES (1, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                last_interaction_id = excluded.last_interaction_id,
+                last_minute = excluded.last_minute,
+                updated_at = excluded.updated_at
+        """, (last_id, minute, datetime.now()))
+    
+    def _rebuild_start_id(self, cursor, now: datetime) -> int:
+        """Watermark to replay the last 24h from (uses idx_interactions_ts)"""
+        cutoff_24h = (now - timedelta(minutes=RING_MINUTES)).isoformat()
         
-        # Get all active markets
         cursor.execute("""
-            SELECT DISTINCT market_id
-            FROM user_interactions
-            WHERE ts > ?
+            SELECT MIN(interaction_id) FROM user_interactions WHERE ts > ?
         """, (cutoff_24h,))
+        first_id = cursor.fetchone()[0]
+        if first_id is not None:
+            return first_id - 1
         
-        active_markets = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT COALESCE(MAX(interaction_id), 0) FROM user_interactions")
+        return cursor.fetchone()[0]
+    
+    # ------------------------------------------------------------------
+    # Ingestion
+    # ------------------------------------------------------------------
+    
+    def _ingest_events(self, cursor, last_id: int,
+                       now_minute: int) -> Tuple[int, Dict[Tuple[str, str, int], List[int]], int]:
+        """
+        Read interactions above the watermark and count them per minute
         
-        updated_count = 0
+        SQLite has a single writer, so interaction_ids become visible in
+        order and a plain high-water mark never skips a row.
         
-        for market_id in active_markets:
-            # Count views (impressions + clicks + view_market)
-            view_events = ['impression', 'click', 'view_market']
-            trade_events = ['participate', 'participate_intent']
-            
-            # 5-minute window
-            cursor.execute(f"""
-                SELECT 
-                    SUM(CASE WHEN event_type IN ('impression','click','view_market') THEN 1 ELSE 0 END) as views,
-                    SUM(CASE WHEN event_type IN ('participate','participate_intent') THEN 1 ELSE 0 END) as trades
-                FROM user_interactions
-                WHERE market_id = ?
-                  AND ts > ?
-                  AND {geo_filter}
-            """, [market_id, cutoff_5m] + geo_params)
-            
-            row_5m = cursor.fetchone()
-            views_5m = row_5m[0] or 0
-            trades_5m = row_5m[1] or 0
-            
-            # 1-hour window
-            cursor.execute(f"""
-                SELECT 
-                    SUM(CASE WHEN event_type IN ('impression','click','view_market') THEN 1 ELSE 0 END) as views,
-                    SUM(CASE WHEN event_type IN ('participate','participate_intent') THEN 1 ELSE 0 END) as trades
+        Returns: (new_last_id, {(market_id, geo, minute): [views, trades]}, rows_read)
+        """
+        bucket_counts = defaultdict(lambda: [0, 0])
+        oldest_minute = now_minute - RING_MINUTES
+        rows_read = 0
+        
+        while True:
+            cursor.execute("""
+                SELECT interaction_id, market_id, event_type, ts, geo_country
                 FROM user_interactions
-                WHERE market_id = ?
-                  AND ts > ?
-                  AND {geo_filter}
-            """, [market_id, cutoff_1h] + geo_params)
+                WHERE interaction_id > ?
+                ORDER BY interaction_id
+                LIMIT ?
+            """, (last_id, INGEST_BATCH))
+            rows = cursor.fetchall()
+            if not rows:
+                break
             
-            row_1h = cursor.fetchone()
-            views_1h = row_1h[0] or 0
-            trades_1h = row_1h[1] or 0
-            
-            # 24-hour window
-            cursor.execute(f"""
-                SELECT 
-                    SUM(CASE WHEN event_type IN ('impression','click','view_market') THEN 1 ELSE 0 END) as views,
-                    SUM(CASE WHEN event_type IN ('participate','participate_intent') THEN 1 ELSE 0 END) as trades
-                FROM user_interactions
-                WHERE market_id = ?
-                  AND ts > ?
-                  AND {geo_filter}
-            """, [market_id, cutoff_24h] + geo_params)
+            last_id = rows[-1][0]
+            rows_read += len(rows)
             
-            row_24h = cursor.fetchone()
-            views_24h = row_24h[0] or 0
-            trades_24h = row_24h[1] or 0
+            for _, market_id, event_type, ts, geo_country in rows:
+                if event_type in VIEW_EVENTS:
+                    kind = 0
+                elif event_type in TRADE_EVENTS:
+                    kind = 1
+                else:
+                    continue
+                
+                parsed = _parse_ts(ts)
+                if parsed is None:
+                    continue
+                
+                # Clock skew: never bucket into the future
+                minute = min(_epoch_minute(parsed), now_minute)
+                if minute <= oldest_minute:
+                    continue  # Older than the ring
+                
+                bucket_counts[(market_id, 'GLOBAL', minute)][kind] += 1
+                if geo_country and geo_country not in EXCLUDED_GEOS:
+                    bucket_counts[(market_id, geo_country, minute)][kind] += 1
             
-            # Volume (if we have it - placeholder for now)
-            volume_5m = None
-            volume_1h = None
-            volume_24h = None
+            if len(rows) < INGEST_BATCH:
+                break
+        
+        return last_id, bucket_counts, rows_read
+    
+    def _write_buckets(self, cursor, bucket_counts: Dict[Tuple[str, str, int], List[int]]):
+        """Add counts into ring slots, resetting slots that held an older minute"""
+        cursor.executemany("""
+            INSERT INTO market_velocity_buckets
+                (market_id, geo_bucket, slot, minute, views, trades)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(market_id, geo_bucket, slot) DO UPDATE SET
+                views = CASE
+                    WHEN excluded.minute = minute THEN views + excluded.views
+                    WHEN excluded.minute > minute THEN excluded.views
+                    ELSE views END,
+                trades = CASE
+                    WHEN excluded.minute = minute THEN trades + excluded.trades
+                    WHEN excluded.minute > minute THEN excluded.trades
+                    ELSE trades END,
+                minute = MAX(minute, excluded.minute)
+        """, [
+            (market_id, geo, minute % RING_MINUTES, minute, views, trades)
+            for (market_id, geo, minute), (views, trades) in bucket_counts.items()
+        ])
+    
+    # ------------------------------------------------------------------
+    # Window maintenance
+    # ------------------------------------------------------------------
+    
+    def _expired_deltas(self, cursor, last_minute: int,
+                        now_minute: int) -> Dict[Tuple[str, str], List[int]]:
+        """
+        Negative deltas for buckets that slid out of each window since last tick
+        
+        Returns: {(market_id, geo): [views_5m, views_1h, views_24h,
+                                     trades_5m, trades_1h, trades_24h]}
+        """
+        deltas = defaultdict(lambda: [0] * 6)
+        
+        for idx, (_, window) in enumerate(WINDOWS):
+            low, high = last_minute - window, now_minute - window
+            if high <= low:
+                continue
             
-            # Upsert rollup
             cursor.execute("""
-                INSERT INTO market_velocity_rollups
-                    (market_id, geo_bucket, 
-                     views_5m, views_1h, views_24h,
-                     trades_5m, trades_1h, trades_24h,
-                     volume_5m, volume_1h, volume_24h,
-                     updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(market_id, geo_bucket) DO UPDATE SET
-                    views_5m = ?,
-                    views_1h = ?,
-                    views_24h = ?,
-                    trades_5m = ?,
-                    trades_1h = ?,
-                    trades_24h = ?,
-                    volume_5m = ?,
-                    volume_1h = ?,
-                    volume_24h = ?,
-                    updated_at = ?
-            """, (market_id, geo_bucket,
-                  views_5m, views_1h, views_24h,
-                  trades_5m, trades_1h, trades_24h,
-                  volume_5m, volume_1h, volume_24h,
-                  now,
-                  views_5m, views_1h, views_24h,
-                  trades_5m, trades_1h, trades_24h,
-                  volume_5m, volume_1h, volume_24h,
-                  now))
+                SELECT market_id, geo_bucket, SUM(views), SUM(trades)
+                FROM market_velocity_buckets
+                WHERE minute > ? AND minute <= ?
+                GROUP BY market_id, geo_bucket
+            """, (low, high))
             
-            updated_count += 1
+            for market_id, geo, views, trades in cursor.fetchall():
+                delta = deltas[(market_id, geo)]
+                delta[idx] -= views
+                delta[3 + idx] -= trades
         
-        conn.commit()
-        conn.close()
+        return deltas
+    
+    def _add_new_events(self, deltas: Dict[Tuple[str, str], List[int]],
+                        bucket_counts: Dict[Tuple[str, str, int], List[int]], now_minute: int):
+        """Positive deltas for new events that fall inside each window"""
+        for (market_id, geo, minute), (views, trades) in bucket_counts.items():
+            delta = deltas[(market_id, geo)]
+            for idx, (_, window) in enumerate(WINDOWS):
+                if minute > now_minute - window:
+                    delta[idx] += views
+                    delta[3 + idx] += trades
+    
+    def _apply_window_deltas(self, cursor, deltas: Dict[Tuple[str, str], List[int]],
+                             now: datetime) -> List[Tuple[str, str]]:
+        """Add deltas onto market_velocity_rollups (creating rows as needed)"""
+        rows = [
+            (market_id, geo, *delta, now)
+            for (market_id, geo), delta in deltas.items()
+            if any(delta)
+        ]
+        
+        cursor.executemany("""
+            INSERT INTO market_velocity_rollups
+                (market_id, geo_bucket,
+                 views_5m, views_1h, views_24h,
+                 trades_5m, trades_1h, trades_24h,
+                 updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(market_id, geo_bucket) DO UPDATE SET
+                views_5m = views_5m + excluded.views_5m,
+                views_1h = views_1h + excluded.views_1h,
+                views_24h = views_24h + excluded.views_24h,
+                trades_5m = trades_5m + excluded.trades_5m,
+                trades_1h = trades_1h + excluded.trades_1h,
+                trades_24h = trades_24h + excluded.trades_24h,
+                updated_at = excluded.updated_at
+        """, rows)
+        
+        return [(row[0], row[1]) for row in rows]
+    
+    def _rebuild_rollups(self, cursor, now_minute: int, now: datetime) -> List[Tuple[str, str]]:
+        """Recompute every window from the ring (first run / after long downtime)"""
+        cursor.execute("""
+            SELECT market_id, geo_bucket,
+                SUM(CASE WHEN minute > ? THEN views ELSE 0 END),
+                SUM(CASE WHEN minute > ? THEN views ELSE 0 END),
+                SUM(views),
+                SUM(CASE WHEN minute > ? THEN trades ELSE 0 END),
+                SUM(CASE WHEN minute > ? THEN trades ELSE 0 END),
+                SUM(trades)
+            FROM market_velocity_buckets
+            WHERE minute > ?
+            GROUP BY market_id, geo_bucket
+        """, (now_minute - 5, now_minute - 60,
+              now_minute - 5, now_minute - 60,
+              now_minute - RING_MINUTES))
+        rows = [(*row, now) for row in cursor.fetchall()]
+        
+        # Anything not in the ring has no activity in the last 24h
+        cursor.execute("""
+            UPDATE market_velocity_rollups
+            SET views_5m = 0, views_1h = 0, views_24h = 0,
+                trades_5m = 0, trades_1h = 0, trades_24h = 0
+        """)
         
-        return updated_count
+        cursor.executemany("""
+            INSERT INTO market_velocity_rollups
+                (market_id, geo_bucket,
+                 views_5m, views_1h, views_24h,
+                 trades_5m, trades_1h, trades_24h,
+                 updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(market_id, geo_bucket) DO UPDATE SET
+                views_5m = excluded.views_5m,
+                views_1h = excluded.views_1h,
+                views_24h = excluded.views_24h,
+                trades_5m = excluded.trades_5m,
+                trades_1h = excluded.trades_1h,
+                trades_24h = excluded.trades_24h,
+                updated_at = excluded.updated_at
+        """, rows)
+        
+        return [(row[0], row[1]) for row in rows]
     
     def _compute_odds_changes(self) -> int:
         """
         Compute odds_change_1h and odds_change_24h for all markets
-        Requires market_probability_history table
+        Reads market_probability_deltas (migrations/008), kept current by
+        record_current_probabilities(); without it, market_probability_history
         
-        Returns: number of markets updated
+        Returns: number of rollup rows updated
         """
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        now = datetime.now()
-        cutoff_1h = (now - timedelta(hours=1)).isoformat()
-        cutoff_24h = (now - timedelta(hours=24)).isoformat()
+        if not self._deltas_available(cursor):
+            updated_count = self._compute_odds_changes_from_history(cursor, datetime.now())
+            conn.commit()
+            conn.close()
+            return updated_count
         
-        # Get all active markets
+        # Markets without a snapshot that old count as unchanged
         cursor.execute("""
-            SELECT market_id, probability
-            FROM markets
-            WHERE status = 'open'
-        """)
-        
-        markets = cursor.fetchall()
-        updated_count = 0
-        
-        for market_id, current_prob in markets:
-            # Get probability 1h ago
-            cursor.execute("""
-                SELECT probability
-                FROM market_probability_history
-                WHERE market_id = ?
-                  AND recorded_at <= ?
-                ORDER BY recorded_at DESC
-                LIMIT 1
-            """, (market_id, cutoff_1h))
-            
-            row_1h = cursor.fetchone()
-            prob_1h_ago = row_1h[0] if row_1h else current_prob
-            odds_change_1h = abs(current_prob - prob_1h_ago)
-            
-            # Get probability 24h ago
-            cursor.execute("""
-                SELECT probability
-                FROM market_probability_history
-                WHERE market_id = ?
-                  AND recorded_at <= ?
-                ORDER BY recorded_at DESC
-                LIMIT 1
-            """, (market_id, cutoff_24h))
-            
-            row_24h = cursor.fetchone()
-            prob_24h_ago = row_24h[0] if row_24h else current_prob
-            odds_change_24h = abs(current_prob - prob_24h_ago)
-            
-            # Update all geo buckets for this market
-            cursor.execute("""
-                UPDATE market_velocity_rollups
-                SET odds_change_1h = ?,
-                    odds_change_24h = ?,
-                    updated_at = ?
-                WHERE market_id = ?
-            """, (odds_change_1h, odds_change_24h, now, market_id))
-            
-            updated_count += cursor.rowcount
-        
+            UPDATE market_velocity_rollups
+            SET odds_change_1h = abs(m.probability - coalesce(d.prob_1h, m.probability)),
+                odds_change_24h = abs(m.probability - coalesce(d.prob_24h, m.probability)),
+                updated_at = ?
+            FROM markets m
+            LEFT JOIN market_probability_deltas d ON d.market_id = m.market_id
+            WHERE m.market_id = market_velocity_rollups.market_id
+              AND m.status = 'open'
+        """, (datetime.now(),))
+        
+        updated_count = cursor.rowcount
         conn.commit()
         conn.close()
         
         return updated_count
     
+    def _compute_odds_changes_from_history(self, cursor, now: datetime) -> int:
+        """_compute_odds_changes() before migrations/008: latest snapshot per offset"""
+        cursor.execute("""
+            UPDATE market_velocity_rollups
+            SET odds_change_1h = abs(m.probability - coalesce((
+                    SELECT probability FROM market_probability_history h
+                    WHERE h.market_id = m.market_id AND h.recorded_at <= :cutoff_1h
+                    ORDER BY h.recorded_at DESC LIMIT 1
+                ), m.probability)),
+                odds_change_24h = abs(m.probability - coalesce((
+                    SELECT probability FROM market_probability_history h
+                    WHERE h.market_id = m.market_id AND h.recorded_at <= :cutoff_24h
+                    ORDER BY h.recorded_at DESC LIMIT 1
+                ), m.probability)),
+                updated_at = :now
+            FROM markets m
+            WHERE m.market_id = market_velocity_rollups.market_id
+              AND m.status = 'open'
+        """, {
+            'cutoff_1h': now - timedelta(hours=1),
+            'cutoff_24h': now - timedelta(hours=24),
+            'now': now
+        })
+        return cursor.rowcount
+    
     def record_current_probabilities(self):
         """
         Snapshot current market probabilities for odds_change computation
@@ -281,17 +546,19 @@ class VelocityComputer:
         
         markets = cursor.fetchall()
         
-        for market_id, probability in markets:
-            cursor.execute("""
-                INSERT INTO market_probability_history
-                    (market_id, probability, recorded_at)
-                VALUES (?, ?, ?)
-            """, (market_id, probability, now))
+        cursor.executemany("""
+            INSERT INTO market_probability_history
+                (market_id, probability, recorded_at)
+            VALUES (?, ?, ?)
+        """, [(market_id, probability, now) for market_id, probability in markets])
         
+        # Before the cleanup: the 7d offset reads snapshots it is about to drop
+        if self._deltas_available(cursor):
+            self._advance_deltas(cursor, now)
         conn.commit()
         
-        # Cleanup old history (keep last 7 days)
-        cutoff = (now - timedelta(days=7)).isoformat()
+        # Cleanup old history (keep last 7 days); a datetime, like recorded_at
+        cutoff = now - timedelta(days=7)
         cursor.execute("""
             DELETE FROM market_probability_history
             WHERE recorded_at < ?
@@ -305,6 +572,47 @@ class VelocityComputer:
             'recorded': len(markets),
             'deleted_old': deleted
         }
+    
+    def _advance_deltas(self, cursor, now: datetime):
+        """
+        Move each offset of market_probability_deltas forward to `now`
+        
+        Only history rows that crossed an offset since the previous snapshot
+        are read: for 1h, those recorded in (previous - 1h, now - 1h]. The
+        first run reads all history.
+        """
+        cursor.execute("SELECT MAX(recorded_at) FROM market_probability_deltas")
+        previous = _parse_ts(cursor.fetchone()[0])
+        
+        cursor.execute("""
+            INSERT INTO market_probability_deltas (market_id, probability, recorded_at)
+            SELECT market_id, probability, ?
+            FROM markets
+            WHERE status = 'open'
+            ON CONFLICT(market_id) DO UPDATE SET
+                probability = excluded.probability,
+                recorded_at = excluded.recorded_at
+        """, (now,))
+        
+        for label, offset in DELTA_OFFSETS:
+            cutoff = now - offset
+            since = previous - offset if previous else None
+            if since is not None and since >= cutoff:
+                continue
+            
+            # Latest crossing snapshot per market (bare column of MAX())
+            cursor.execute(f"""
+                UPDATE market_probability_deltas
+                SET prob_{label} = h.probability,
+                    at_{label} = h.recorded_at
+                FROM (
+                    SELECT market_id, probability, MAX(recorded_at) AS recorded_at
+                    FROM market_probability_history
+                    WHERE recorded_at > ? AND recorded_at <= ?
+                    GROUP BY market_id
+                ) h
+                WHERE market_probability_deltas.market_id = h.market_id
+            """, (since or '', cutoff))
 
 # Global instance
 velocity_computer = VelocityComputer()